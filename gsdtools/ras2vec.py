@@ -25,7 +25,12 @@ Take in input one or more raster datasets and generate a vector file
 containing the bounding box polygon and, optionally, a GCP layer of
 each input dataset.
 
-Note: currently only the KML format is supported for output.
+The output format is selected according to the output file extension:
+KML is used by default while GeoPackage (.gpkg) and SQLite (.sqlite)
+outputs have a spatial index (R-tree) that can be used to query
+products covering a point, a bounding box or a polygon::
+
+  $ %prog query INDEX --bbox XMIN YMIN XMAX YMAX
 
 This program aims to be an improved and more flexible version of the
 gdaltindex utility.
@@ -45,7 +50,11 @@ gdaltindex utility.
 
 import os
 import sys
+import json
+import time
+import fnmatch
 import logging
+import multiprocessing
 
 from osgeo import gdal, ogr, osr
 
@@ -63,6 +72,39 @@ else:
 #DEFAULT_OGRDRIVER = 'KML'   # compatibility with old GDAL versions
 DEFAULT_OGRDRIVER = 'LIBKML'
 
+#: output formats (OGR driver names)
+FORMATS = {
+    'KML': DEFAULT_OGRDRIVER,
+    'GeoJSON': 'GeoJSON',
+    'GPKG': 'GPKG',
+    'SQLite': 'SQLite',
+    'FlatGeobuf': 'FlatGeobuf',
+}
+
+#: formats that only support a single layer per file
+SINGLE_LAYER_FORMATS = ('GeoJSON', 'FlatGeobuf')
+
+#: OGR drivers selected by output file extension
+OGRDRIVER_EXTENSIONS = {
+    '.kml': DEFAULT_OGRDRIVER,
+    '.kmz': DEFAULT_OGRDRIVER,
+    '.gpkg': 'GPKG',
+    '.sqlite': 'SQLite',
+    '.geojson': 'GeoJSON',
+    '.json': 'GeoJSON',
+    '.fgb': 'FlatGeobuf',
+}
+
+#: layer creation options (spatial index)
+OGRDRIVER_LAYER_OPTIONS = {
+    'GPKG': ['SPATIAL_INDEX=YES'],
+    'SQLite': ['SPATIAL_INDEX=YES'],
+    'FlatGeobuf': ['SPATIAL_INDEX=YES'],
+}
+
+#: number of features written in each transaction
+DEFAULT_BATCH_SIZE = 1000
+
 
 def makesrs(srs):
     # @NOTE: KML by specification uses only a single projection, EPSG:4326
@@ -83,7 +125,7 @@ def create_box_layer(ds, name='', srs=None, gtype=ogr.wkbUnknown, opt=None):
     srs = makesrs(srs)
 
     if opt == None:
-        opt = ''
+        opt = OGRDRIVER_LAYER_OPTIONS.get(ds.GetDriver().GetName(), [])
 
     layer = ds.CreateLayer(name, srs, gtype, opt)
 
@@ -103,7 +145,7 @@ def create_GCP_layer(ds, name='', srs=None, gtype=ogr.wkbPoint25D, opt=None):
     srs = makesrs(srs)
 
     if opt == None:
-        opt = ''
+        opt = OGRDRIVER_LAYER_OPTIONS.get(ds.GetDriver().GetName(), [])
 
     layer = ds.CreateLayer(name, srs, gtype, opt)
 
@@ -195,7 +237,74 @@ def geographic_info(ds, srsout=None):
     return corners, outgcps
 
 
-def export_bounding_box(layer, corners, description='', mark_corners=True):
+class FeatureWriter(object):
+    '''Write features grouping them in transactions of *batchsize* items.
+
+    Transactions are opened lazily at the first written feature and
+    are committed each *batchsize* features or when :meth:`flush` is
+    called (e.g. before the creation of a new layer).  Data sources
+    that do not support transactions are written feature by feature.
+
+    '''
+
+    def __init__(self, datasource, batchsize=DEFAULT_BATCH_SIZE):
+        self.datasource = datasource
+        self.batchsize = batchsize
+        self.count = 0
+        self._pending = 0
+        self._supported = batchsize > 1
+        self._active = False
+        self._layers = {}
+
+    def _begin(self, layer):
+        if not self._supported:
+            return
+
+        # @COMPATIBILITY: data source level transactions are only available
+        #                 in GDAL >= 2.0
+        if hasattr(self.datasource, 'StartTransaction'):
+            if not self._active:
+                self._active = (self.datasource.StartTransaction() == 0)
+                self._supported = self._active
+        elif layer.GetName() not in self._layers:
+            if layer.StartTransaction() == 0:
+                self._layers[layer.GetName()] = layer
+
+    def write(self, layer, feature):
+        self._begin(layer)
+
+        if layer.CreateFeature(feature) != 0:
+            raise RuntimeError('failed to create a new feature.')
+
+        self.count += 1
+        self._pending += 1
+        if self._pending >= self.batchsize:
+            self.flush()
+
+    def flush(self):
+        if self._active:
+            if self.datasource.CommitTransaction() != 0:
+                raise RuntimeError('failed to commit transaction.')
+            self._active = False
+        for layer in self._layers.values():
+            if layer.CommitTransaction() != 0:
+                raise RuntimeError('failed to commit transaction.')
+        self._layers = {}
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+
+
+def write_feature(layer, feature, writer=None):
+    if writer is not None:
+        writer.write(layer, feature)
+    elif layer.CreateFeature(feature) != 0:
+        raise RuntimeError('failed to create a new feature.')
+
+
+def export_bounding_box(layer, corners, description='', mark_corners=True,
+                        writer=None):
     # ring
     ring = ogr.Geometry(type=ogr.wkbLinearRing)
     for gcp in corners:
@@ -217,8 +326,7 @@ def export_bounding_box(layer, corners, description='', mark_corners=True):
     feature.SetStyleString('BRUSH(fc:#FF000064);PEN(c:#FF0000)')  # red filled
     feature.SetGeometry(poly)
 
-    if layer.CreateFeature(feature) != 0:
-        raise RuntimeError('failed to create a new feature.')
+    write_feature(layer, feature, writer)
     feature.Destroy()
 
     if mark_corners:
@@ -235,12 +343,11 @@ def export_bounding_box(layer, corners, description='', mark_corners=True):
 
             feature.SetGeometry(point)
 
-            if layer.CreateFeature(feature) != 0:
-                raise RuntimeError('failed to create a new feature.')
+            write_feature(layer, feature, writer)
             feature.Destroy()
 
 
-def export_gcps(layer, gcps):
+def export_gcps(layer, gcps, writer=None):
     for id_, gcp in enumerate(gcps):
 
         if gcp.Id:
@@ -263,14 +370,18 @@ def export_gcps(layer, gcps):
         feature.SetField('Id', gcp.Id)
         feature.SetGeometry(point)
 
-        if layer.CreateFeature(feature) != 0:
-            raise RuntimeError('failed to create a new feature.')
+        write_feature(layer, feature, writer)
         feature.Destroy()
 
 
+def guess_driver(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    return OGRDRIVER_EXTENSIONS.get(ext, DEFAULT_OGRDRIVER)
+
+
 def create_datasource(filename, drivername=None):
     if not drivername:
-        drivername = DEFAULT_OGRDRIVER
+        drivername = guess_driver(filename)
     driver = ogr.GetDriverByName(drivername)
     if not driver:
         raise RuntimeError('unable to instantiate the "%s" driver.' %
@@ -287,7 +398,7 @@ def create_datasource(filename, drivername=None):
 
 
 def export_raster(src, dst, boxlayer=None, gcplayer=None, srsout=None,
-                  mark_corners=True):
+                  mark_corners=True, writer=None):
     if isinstance(src, basestring):
         filename = src
         src = gdal.Open(filename)
@@ -304,42 +415,58 @@ def export_raster(src, dst, boxlayer=None, gcplayer=None, srsout=None,
     # Instantiate the coordinate transformer
     corners, gcps = geographic_info(src, srsout)
 
-    # Bounding box
     description = src.GetDescription().strip()
+
+    return export_footprint(dst, description, corners, gcps, boxlayer,
+                            gcplayer, srsout, mark_corners, writer)
+
+
+def export_footprint(dst, description, corners, gcps, boxlayer=None,
+                     gcplayer=None, srsout=None, mark_corners=True,
+                     writer=None):
+    srsout = makesrs(srsout)
+
+    def createlayer(factory, name):
+        # @NOTE: layers are created out of transactions
+        if writer is not None:
+            writer.flush()
+        return factory(dst, name, srsout)
+
+    # Bounding box
     if boxlayer is None or boxlayer == '':
         boxlayername = os.path.basename(description)
-        boxlayer = create_box_layer(dst, boxlayername, srsout)
+        boxlayer = createlayer(create_box_layer, boxlayername)
     elif boxlayer and isinstance(boxlayer, basestring):
         boxlayername = boxlayer
         boxlayer = dst.GetLayerByName(boxlayername)
         if boxlayer is None:
-            boxlayer = create_box_layer(dst, boxlayername, srsout)
+            boxlayer = createlayer(create_box_layer, boxlayername)
 
     if boxlayer is None:
         raise RuntimeError('unable to create a new layer.')
 
-    export_bounding_box(boxlayer, corners, description, mark_corners)
+    export_bounding_box(boxlayer, corners, description, mark_corners, writer)
 
     # GCPs
     if gcps and gcplayer is not False:
         if gcplayer in (None, True, ''):
             gcplayername = 'gcps_%s' % os.path.basename(description)
-            gcplayer = create_GCP_layer(dst, gcplayername, srsout)
+            gcplayer = createlayer(create_GCP_layer, gcplayername)
         elif gcplayer and isinstance(gcplayer, basestring):
             gcplayername = gcplayer
             gcplayer = dst.GetLayerByName(gcplayername)
             if gcplayer is None:
-                gcplayer = create_GCP_layer(dst, gcplayername, srsout)
+                gcplayer = createlayer(create_GCP_layer, gcplayername)
 
         if gcplayer is None:
             raise RuntimeError('unable to create a new layer.')
 
-        export_gcps(gcplayer, gcps)
+        export_gcps(gcplayer, gcps, writer)
 
     return boxlayer, gcplayer
 
 
-def compact_index(srclist, dst):
+def compact_index(srclist, dst, writer=None):
     if isinstance(dst, basestring):
         dst = create_datasource(dst)
 
@@ -361,7 +488,8 @@ def compact_index(srclist, dst):
                 continue
 
         try:
-            export_raster(src, dst, boxlayer, False, mark_corners=False)
+            export_raster(src, dst, boxlayer, False, mark_corners=False,
+                          writer=writer)
         except ValueError as e:
             if 'no geographic info' in str(e):
                 logging.error(str(e))
@@ -370,10 +498,11 @@ def compact_index(srclist, dst):
 
         subdatasets = [subds for subds, descr in src.GetSubDatasets()]
         if subdatasets:
-            compact_index(subdatasets, dst)
+            compact_index(subdatasets, dst, writer)
 
 
-def raster_index(srclist, dst, gcplayer=False, mark_corners=False):
+def raster_index(srclist, dst, gcplayer=False, mark_corners=False,
+                 writer=None):
     if isinstance(dst, basestring):
         dst = create_datasource(dst)
 
@@ -389,7 +518,8 @@ def raster_index(srclist, dst, gcplayer=False, mark_corners=False):
                 continue
 
         try:
-            export_raster(src, dst, None, gcplayer, mark_corners=mark_corners)
+            export_raster(src, dst, None, gcplayer, mark_corners=mark_corners,
+                          writer=writer)
         except ValueError as e:
             if 'no geographic info' in e.message:
                 logging.error(str(e))
@@ -398,30 +528,601 @@ def raster_index(srclist, dst, gcplayer=False, mark_corners=False):
 
         subdatasets = [subds for subds, descr in src.GetSubDatasets()]
         if subdatasets:
-            raster_index(subdatasets, dst, gcplayer, mark_corners)
+            raster_index(subdatasets, dst, gcplayer, mark_corners, writer)
+
+
+### Pre-filter ################################################################
+#: suffixes of auxiliary files that are never probed
+SIDECAR_SUFFIXES = ('.aux.xml', '.ovr', '.msk', '.md5', '.sha1', '.sha256',
+                    '.log', '.bak', '.tmp', '~')
+
+#: magic numbers of common raster formats (file header prefixes)
+MAGIC_NUMBERS = (
+    b'II*\x00', b'MM\x00*',                 # TIFF
+    b'II+\x00', b'MM\x00+',                 # BigTIFF
+    b'\xff\xd8\xff',                        # JPEG
+    b'\x89PNG\r\n\x1a\n',                   # PNG
+    b'GIF87a', b'GIF89a',                   # GIF
+    b'BM',                                  # BMP
+    b'\x00\x00\x00\x0cjP  \r\n\x87\n',      # JPEG2000 (JP2)
+    b'\xff\x4f\xff\x51',                    # JPEG2000 (codestream)
+    b'\x89HDF\r\n\x1a\n',                   # HDF5 (and netCDF4)
+    b'\x0e\x03\x13\x01',                    # HDF4
+    b'CDF\x01', b'CDF\x02',                 # netCDF
+    b'NITF', b'NSIF',                       # NITF
+    b'PRODUCT=',                            # Envisat
+    b'<VRTDataset',                         # GDAL VRT
+    b'GRIB',                                # GRIB
+)
+
+MAGIC_SIZE = max(len(magic) for magic in MAGIC_NUMBERS)
+
+#: generic extensions declared by some raster drivers that are mostly used
+#: by non raster files (they are checked by magic number)
+GENERIC_EXTENSIONS = ('xml', 'json', 'txt')
+
+
+def raster_extensions():
+    '''Return the set of file extensions declared by GDAL raster drivers.
+
+    Extensions are lower case and without the leading dot.
+    Vector only drivers and :data:`GENERIC_EXTENSIONS` are excluded.
+
+    '''
+
+    extensions = set()
+    for index in range(gdal.GetDriverCount()):
+        metadata = gdal.GetDriver(index).GetMetadata() or {}
+
+        # @COMPATIBILITY: capabilities are only declared in GDAL >= 2.0
+        #                 (before all GDAL drivers were raster drivers)
+        if ('DCAP_RASTER' in metadata or 'DCAP_VECTOR' in metadata) and (
+                                    metadata.get('DCAP_RASTER') != 'YES'):
+            continue
+
+        for key in ('DMD_EXTENSION', 'DMD_EXTENSIONS'):
+            extensions.update(ext.lower().lstrip('.')
+                              for ext in metadata.get(key, '').split())
+
+    extensions.difference_update(GENERIC_EXTENSIONS)
+    return extensions
+
+
+class ProbeFilter(object):
+    '''Decide whenever a file is worth a gdal.Open call.
+
+    Checks are performed in the following order:
+
+    * files matching one of the *exclude* glob patterns are rejected
+    * files matching one of the *include* glob patterns are accepted
+    * sidecar files (see :data:`SIDECAR_SUFFIXES`) are rejected
+    * files with an extension declared by a GDAL driver are accepted
+    * files starting with a known magic number (see
+      :data:`MAGIC_NUMBERS`) are accepted, all other files are rejected
+
+    If *sniff* is False the last three checks are disabled and all files
+    not excluded by glob patterns are accepted.
+
+    The :attr:`counters` dictionary keeps track of the number of
+    accepted files and of the files rejected by each check.
+
+    '''
+
+    def __init__(self, include=None, exclude=None, sniff=True,
+                 extensions=None):
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.sniff = sniff
+        if extensions is None and sniff:
+            extensions = raster_extensions()
+        self.extensions = extensions
+        self.counters = {
+            'accepted': 0,
+            'excluded': 0,
+            'extension': 0,
+            'magic': 0,
+        }
+
+    @property
+    def rejected(self):
+        return sum(value for key, value in self.counters.items()
+                   if key != 'accepted')
+
+    @staticmethod
+    def _match(filename, patterns):
+        basename = os.path.basename(filename)
+        for pattern in patterns:
+            if (fnmatch.fnmatch(basename, pattern) or
+                    fnmatch.fnmatch(filename, pattern)):
+                return True
+        return False
+
+    def _check(self, filename):
+        if self.exclude and self._match(filename, self.exclude):
+            return 'excluded'
+        if self.include and self._match(filename, self.include):
+            return 'accepted'
+        if not self.sniff:
+            return 'accepted'
+
+        lowername = filename.lower()
+        if lowername.endswith(SIDECAR_SUFFIXES):
+            return 'extension'
+
+        ext = os.path.splitext(lowername)[1].lstrip('.')
+        if ext and ext in self.extensions:
+            return 'accepted'
+
+        try:
+            with open(filename, 'rb') as fd:
+                header = fd.read(MAGIC_SIZE)
+        except (IOError, OSError):
+            return 'magic'
+        if header.startswith(MAGIC_NUMBERS):
+            return 'accepted'
+
+        return 'magic'
+
+    def __call__(self, filename):
+        result = self._check(filename)
+        self.counters[result] += 1
+        return result == 'accepted'
+
+
+### Parallel tree index #######################################################
+MANIFEST_VERSION = 1
+
+
+def _gcp2tuple(gcp):
+    return (gcp.GCPX, gcp.GCPY, gcp.GCPZ, gcp.GCPPixel, gcp.GCPLine,
+            gcp.Info, gcp.Id)
+
+
+def _tuple2gcp(item):
+    x, y, z, pixel, line, info, id_ = item
+    return gdal.GCP(x, y, z, pixel, line, str(info), str(id_))
+
+
+def _initworker():
+    gdal.PushErrorHandler('CPLQuietErrorHandler')
+
+
+def footprint(args):
+    '''Compute the footprint of a single file.
+
+    *args* is a (filename, srsout) tuple where *srsout* is the target
+    spatial reference system in a format accepted by :func:`makesrs`.
+
+    Return a picklable dictionary containing "corners" and "gcps"
+    (lists of tuples) or None if *filename* is not a georeferenced
+    raster.  The "size" and "mtime" of the file are always included.
+
+    This function is executed by worker processes of
+    :func:`raster_tree_index`.
+
+    '''
+
+    filename, srsout = args
+    record = {
+        'size': None,
+        'mtime': None,
+        'corners': None,
+        'gcps': None,
+    }
+
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return filename, record
+    record['size'] = stat.st_size
+    record['mtime'] = stat.st_mtime
+
+    src = gdal.Open(filename)
+    if src is None:
+        return filename, record
+
+    try:
+        corners, gcps = geographic_info(src, srsout)
+    except (RuntimeError, ValueError):
+        pass
+    else:
+        record['corners'] = [_gcp2tuple(gcp) for gcp in corners]
+        record['gcps'] = [_gcp2tuple(gcp) for gcp in gcps]
+
+    return filename, record
+
+
+def load_manifest(filename, srsout=None):
+    '''Load the index manifest.
+
+    The manifest is a JSON file that stores size, modification time and
+    footprint of each file seen in previous runs (files that are not
+    georeferenced rasters have a null footprint).
+
+    An empty manifest is returned if *filename* does not exist or if it
+    has been generated for a different target spatial reference system.
+
+    '''
+
+    wkt = makesrs(srsout).ExportToWkt()
+    manifest = {'version': MANIFEST_VERSION, 'srs': wkt, 'files': {}}
+
+    if filename and os.path.exists(filename):
+        with open(filename) as fd:
+            data = json.load(fd)
+        if (data.get('version') == MANIFEST_VERSION and
+                data.get('srs') == wkt):
+            manifest = data
+        else:
+            logging.info('manifest "%s" is out of date' % filename)
+
+    return manifest
+
+
+def save_manifest(filename, manifest):
+    # @NOTE: write to a temporary file first to never leave a truncated
+    #        manifest around
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'w') as fd:
+        json.dump(manifest, fd)
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(tmpfile, filename)
 
 
 def raster_tree_index(src, dst, boxlayer=None, gcplayer=None,
-                      mark_corners=False):
+                      mark_corners=False, srsout=None, jobs=None,
+                      manifest=None, prefilter=None, writer=None):
+    '''Index all rasters in the *src* directory tree.
+
+    Candidate files are opened by a pool of *jobs* worker processes
+    (default: the number of CPUs) and footprints are written in *dst*
+    by the calling process.
+
+    If a *manifest* file name is provided, footprints of files not
+    changed (same size and modification time) since the previous run
+    are read from the manifest, without opening the file, and the
+    manifest is updated at the end.
+
+    New and changed files are opened only if accepted by the
+    *prefilter* callable (see :class:`ProbeFilter`).
+
+    '''
+
     assert os.path.isdir(src)
 
     if isinstance(dst, basestring):
         dst = create_datasource(dst)
 
-    gdal.PushErrorHandler('CPLQuietErrorHandler')
-    for root, dirs, files,  in os.walk(src):
-        for filename in files:
+    srsout = makesrs(srsout)
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    data = load_manifest(manifest, srsout)
+    cache = data['files']
+    files = {}
+    counters = {'opened': 0, 'unchanged': 0, 'filtered': 0, 'indexed': 0}
+
+    def export(filename, record):
+        files[filename] = record
+        if record['corners'] is None:
+            logging.info('skip "%s"' % filename)
+            return
+        logging.info('adding "%s"' % filename)
+        corners = [_tuple2gcp(item) for item in record['corners']]
+        gcps = [_tuple2gcp(item) for item in record['gcps']]
+        export_footprint(dst, filename, corners, gcps, boxlayer, gcplayer,
+                         srsout, mark_corners, writer)
+        counters['indexed'] += 1
+
+    # @NOTE: the output file and the manifest (and its temporary copy,
+    #        see save_manifest) can be in the indexed tree
+    skip = set([os.path.abspath(dst.GetName())])
+    if manifest:
+        manifestpath = os.path.abspath(manifest)
+        skip.update((manifestpath, manifestpath + '.tmp'))
+
+    # scan the tree and export footprints of unchanged files
+    candidates = []
+    for root, dirs, filenames in os.walk(src):
+        dirs.sort()
+        for filename in sorted(filenames):
+            filename = os.path.join(root, filename)
+            if os.path.abspath(filename) in skip:
+                continue
             try:
-                filename = os.path.join(root, filename)
-                export_raster(filename, dst, boxlayer, gcplayer,
-                              mark_corners=mark_corners)
-            except (RuntimeError, ValueError):
-                #logging.exception(str(e))
-                logging.info('skip "%s"' % filename)
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            record = cache.get(filename)
+            if (record and record['size'] == stat.st_size and
+                    record['mtime'] == stat.st_mtime):
+                counters['unchanged'] += 1
+                export(filename, record)
+            elif prefilter is None or prefilter(filename):
+                candidates.append(filename)
             else:
-                logging.info('adding "%s"' % filename)
+                counters['filtered'] += 1
+
+    # open new and changed files in parallel
+    wkt = srsout.ExportToWkt()
+    tasks = [(filename, wkt) for filename in candidates]
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(jobs, _initworker)
+        results = pool.imap(footprint, tasks, 16)
+    else:
+        pool = None
+        gdal.PushErrorHandler('CPLQuietErrorHandler')
+        results = (footprint(task) for task in tasks)
+
+    try:
+        # @NOTE: the output data source is only accessed by this process
+        for filename, record in results:
+            counters['opened'] += 1
+            export(filename, record)
+
+        if pool is not None:
+            pool.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+        else:
+            gdal.PopErrorHandler()
+
+    logging.info('%(indexed)d rasters indexed: %(opened)d files opened, '
+                 '%(unchanged)d unchanged, %(filtered)d opens avoided by '
+                 'the pre-filter' % counters)
+    if isinstance(prefilter, ProbeFilter):
+        logging.info('pre-filter: %(excluded)d excluded, %(extension)d '
+                     'rejected by extension, %(magic)d rejected by magic '
+                     'number' % prefilter.counters)
+
+    if manifest:
+        data['files'] = files
+        save_manifest(manifest, data)
+
+    return counters
+
+
+### Index query ###############################################################
+def make_query_geometry(spec):
+    '''Build a query geometry.
+
+    *spec* can be an ogr.Geometry, a WKT string, a (x, y) point or a
+    (xmin, ymin, xmax, ymax) bounding box.
+
+    '''
+
+    if isinstance(spec, ogr.Geometry):
+        return spec
+    elif isinstance(spec, basestring):
+        geom = ogr.CreateGeometryFromWkt(spec)
+        if geom is None:
+            raise ValueError('invalid WKT geometry: "%s"' % spec)
+        return geom
+    elif len(spec) == 2:
+        geom = ogr.Geometry(type=ogr.wkbPoint)
+        geom.SetPoint_2D(0, *spec)
+        return geom
+    elif len(spec) == 4:
+        xmin, ymin, xmax, ymax = spec
+        ring = ogr.Geometry(type=ogr.wkbLinearRing)
+        for x, y in ((xmin, ymin), (xmin, ymax), (xmax, ymax), (xmax, ymin)):
+            ring.AddPoint_2D(x, y)
+        ring.CloseRings()
+        geom = ogr.Geometry(type=ogr.wkbPolygon)
+        geom.AddGeometry(ring)
+        return geom
+    else:
+        raise ValueError('invalid query geometry: %r' % (spec,))
+
+
+class FootprintIndex(object):
+    '''Query interface for footprint indexes generated by ras2vec.
+
+    Queries use the OGR spatial filter so, for formats having a spatial
+    index (e.g. GeoPackage), only footprints whose bounding box
+    intersects the query geometry are read and tested.  The index file
+    is kept open so that multiple queries are cheap.
+
+    Query geometries are expressed in the index spatial reference
+    system (EPSG:4326 by default).
+
+    '''
+
+    def __init__(self, filename, layers=None):
+        self.filename = filename
+        self.datasource = ogr.Open(filename)
+        if self.datasource is None:
+            raise RuntimeError('unable to open index file: "%s"' % filename)
+
+        if layers is None:
+            layers = [self.datasource.GetLayer(index).GetName()
+                      for index in range(self.datasource.GetLayerCount())]
+        elif isinstance(layers, basestring):
+            layers = [layers]
+        self.layers = layers
+
+    def close(self):
+        self.datasource = None
+
+    def query(self, geometry):
+        '''Return descriptions (paths) of products intersecting geometry.
 
-    gdal.PopErrorHandler()
+        Only polygon features (product footprints) are considered.
+
+        '''
+
+        geometry = make_query_geometry(geometry)
+
+        results = []
+        seen = set()
+        for name in self.layers:
+            layer = self.datasource.GetLayerByName(name)
+            if layer is None:
+                raise ValueError('invalid layer name: "%s"' % name)
+
+            layer.SetSpatialFilter(geometry)
+            try:
+                layer.ResetReading()
+                feature = layer.GetNextFeature()
+                while feature is not None:
+                    geom = feature.GetGeometryRef()
+                    if (geom is not None and
+                            ogr.GT_Flatten(geom.GetGeometryType()) ==
+                                                            ogr.wkbPolygon):
+                        description = feature.GetField('Description')
+                        if description not in seen:
+                            seen.add(description)
+                            results.append(description)
+                    feature = layer.GetNextFeature()
+            finally:
+                layer.SetSpatialFilter(None)
+
+        return results
+
+
+def query_index(filename, geometry, layers=None):
+    '''Return products of the *filename* index intersecting geometry.
+
+    See :class:`FootprintIndex` and :func:`make_query_geometry`.
+
+    '''
+
+    index = FootprintIndex(filename, layers)
+    try:
+        return index.query(geometry)
+    finally:
+        index.close()
+
+
+def handlequerycmd(argv):
+    import optparse
+
+    parser = optparse.OptionParser(
+                        usage='%prog query [options] INDEX',
+                        version='%%prog %s' % __version__,
+                        description='Print products of the INDEX file '
+                                    'that intersect the query geometry.')
+    parser.add_option('-p', '--point', nargs=2, type='float',
+                      metavar='X Y', help='query point')
+    parser.add_option('-b', '--bbox', nargs=4, type='float',
+                      metavar='XMIN YMIN XMAX YMAX',
+                      help='query bounding box')
+    parser.add_option('-w', '--wkt', help='query geometry (WKT)')
+    parser.add_option('-l', '--layer', action='append',
+                      help='layer to be queried (default: all layers)')
+
+    options, args = parser.parse_args(argv)
+
+    if len(args) != 1:
+        parser.error('the INDEX file is required.')
+
+    specs = [spec for spec in (options.point, options.bbox, options.wkt)
+             if spec is not None]
+    if len(specs) != 1:
+        parser.error('exactly one of "point", "bbox" and "wkt" options '
+                     'shall be specified.')
+    options.geometry = specs[0]
+
+    return options, args
+
+
+def query_main(argv):
+    options, args = handlequerycmd(argv)
+    for path in query_index(args[0], options.geometry, options.layer):
+        print(path)
+
+
+### Benchmark #################################################################
+def benchmark_writer(filename, drivername, nfeatures,
+                     batchsize=DEFAULT_BATCH_SIZE):
+    '''Write *nfeatures* synthetic GCPs and return features per second.
+
+    The time needed to close the data source (i.e. to flush data to
+    disk) is included.
+
+    '''
+
+    gcps = [gdal.GCP(index % 360 - 180., index % 180 - 90., 0.,
+                     index % 1000, index // 1000, '', str(index))
+            for index in range(nfeatures)]
+
+    t0 = time.time()
+    dst = create_datasource(filename, drivername)
+    layer = create_GCP_layer(dst, 'gcps')
+    writer = FeatureWriter(dst, batchsize)
+    export_gcps(layer, gcps, writer)
+    writer.close()
+    layer = dst = None
+    elapsed = time.time() - t0
+
+    return nfeatures / elapsed
+
+
+def handlebenchmarkcmd(argv):
+    import optparse
+
+    parser = optparse.OptionParser(
+                        usage='%prog benchmark [options]',
+                        version='%%prog %s' % __version__,
+                        description='Measure the write throughput '
+                                    '(features/second) of output formats '
+                                    'with and without batched '
+                                    'transactions.')
+    parser.add_option('-n', '--nfeatures', type='int', default=100000,
+                      help='number of features to be written '
+                           '(default: %default)')
+    parser.add_option('-f', '--format', action='append',
+                      help='output format (can be specified multiple '
+                           'times, default: %s)' % ', '.join(sorted(FORMATS)))
+    parser.add_option('-s', '--batch-size', type='int',
+                      default=DEFAULT_BATCH_SIZE,
+                      help='number of features written in each transaction '
+                           '(default: %default)')
+
+    options, args = parser.parse_args(argv)
+
+    if args:
+        parser.error('no argument expected.')
+    if options.nfeatures < 1 or options.batch_size < 1:
+        parser.error('"nfeatures" and "batch-size" shall be positive '
+                     'integers.')
+    if not options.format:
+        options.format = sorted(FORMATS)
+
+    return options, args
+
+
+def benchmark_main(argv):
+    import shutil
+    import tempfile
+
+    options, args = handlebenchmarkcmd(argv)
+    extensions = dict((driver, ext)
+                      for ext, driver in OGRDRIVER_EXTENSIONS.items())
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name in options.format:
+            drivername = FORMATS.get(name, name)
+            if ogr.GetDriverByName(drivername) is None:
+                logging.warning('"%s" driver not available' % drivername)
+                continue
+
+            for batchsize in sorted(set((1, options.batch_size))):
+                filename = os.path.join(tmpdir, 'benchmark_%d%s' % (
+                                batchsize, extensions.get(drivername, '')))
+                rate = benchmark_writer(filename, drivername,
+                                        options.nfeatures, batchsize)
+                logging.info('%-12s batch size %6d: %10.0f features/s' % (
+                                                    name, batchsize, rate))
+    finally:
+        shutil.rmtree(tmpdir)
 
 
 ### Command line tool #########################################################
@@ -442,6 +1143,14 @@ def handlecmd(argv=None):
     #parser.add_option('-s', '--t_srs', type='str', default='EPSG:4326'
     #                  help='target spatial reference system '
     #                       '(default: %default)')
+    parser.add_option('-f', '--format',
+                      help='output format: %s or any OGR driver name '
+                           '(default: guessed from the OUTPUT extension, '
+                           'KML if unknown)' % ', '.join(sorted(FORMATS)))
+    parser.add_option('-s', '--batch-size', type='int',
+                      default=DEFAULT_BATCH_SIZE,
+                      help='number of features written in each transaction '
+                           '(default: %default)')
     parser.add_option('-g', '--gcps', action='store_true', default=False,
                       help='generate an additional layer for GCPs '
                            '(default: %default)')
@@ -451,11 +1160,46 @@ def handlecmd(argv=None):
     parser.add_option('-a', '--abspath', action='store_true', default=False,
                       help='store absolute path in bounding box feature '
                            'description (default: %default)')
+    parser.add_option('-j', '--jobs', type='int', default=None,
+                      help='number of worker processes used to scan '
+                           'directories (default: number of CPUs)')
+    parser.add_option('-i', '--include', metavar='GLOB', action='append',
+                      help='always open files matching GLOB when scanning '
+                           'directories (can be specified multiple times)')
+    parser.add_option('-x', '--exclude', metavar='GLOB', action='append',
+                      help='never open files matching GLOB when scanning '
+                           'directories (can be specified multiple times)')
+    parser.add_option('--no-prefilter', dest='prefilter',
+                      action='store_false', default=True,
+                      help='disable extension and magic number based '
+                           'pre-filtering of files when scanning '
+                           'directories')
+    parser.add_option('-m', '--manifest', metavar='FILE',
+                      help='manifest file used to skip unchanged files when '
+                           'a directory is re-indexed (created if it does '
+                           'not exist)')
 
     options, args = parser.parse_args()
 
     if len(args) < 2:
         parser.error('at least two arguments are required.')
+    if options.batch_size < 1:
+        parser.error('the "batch-size" parameter shall be a positive '
+                     'integer.')
+
+    if options.format:
+        options.format = FORMATS.get(options.format, options.format)
+    else:
+        options.format = guess_driver(args[0])
+    if options.format in SINGLE_LAYER_FORMATS:
+        multilayer = options.corners and (len(args) > 2 or
+                                          os.path.isdir(args[1]))
+        if options.gcps or multilayer:
+            parser.error('the "%s" format only supports a single layer: '
+                         '"gcps" and "corners" options are not allowed.' %
+                         options.format)
+    if options.jobs is not None and options.jobs < 1:
+        parser.error('the "jobs" parameter shall be a positive integer.')
 
     #~ if options.t_srs and options.format in ('KML', 'LIBKML'):
         #~ epsg4326 = osr.SpatialReference()
@@ -482,21 +1226,30 @@ def main(*argv):
         if not argv:
             argv = sys.argv
 
+        if len(argv) > 1 and argv[1] == 'query':
+            query_main(list(argv[2:]))
+            return
+        elif len(argv) > 1 and argv[1] == 'benchmark':
+            benchmark_main(list(argv[2:]))
+            return
+
         options, args = handlecmd(argv)
         outfile = args.pop(0)
         if os.path.exists(outfile):
             logging.error('the output file ("%s") already exists.' % outfile)
             sys.exit(EX_USAGE)
-        dst = create_datasource(outfile)    # , options.format)
+        dst = create_datasource(outfile, options.format)
+        writer = FeatureWriter(dst, options.batch_size)
 
         if len(args) > 1:
             if options.abspath:
                 args = [os.path.abspath(name) for name in args]
 
             if options.gcps or options.corners:
-                raster_index(args, dst, options.gcps, options.corners)
+                raster_index(args, dst, options.gcps, options.corners,
+                             writer)
             else:
-                compact_index(args, dst)
+                compact_index(args, dst, writer)
         else:
             inputpath = args[0]
             if options.abspath:
@@ -514,11 +1267,20 @@ def main(*argv):
                     boxlayer = os.path.basename(os.path.normpath(inputpath))
                 raster_tree_index(inputpath, dst,
                                   boxlayer=boxlayer, gcplayer=options.gcps,
-                                  mark_corners=options.corners)
+                                  mark_corners=options.corners,
+                                  jobs=options.jobs,
+                                  manifest=options.manifest,
+                                  prefilter=ProbeFilter(options.include,
+                                                        options.exclude,
+                                                        options.prefilter),
+                                  writer=writer)
             else:
                 export_raster(inputpath, dst,
                               boxlayer='box', gcplayer=gcplayer,
-                              mark_corners=options.corners)
+                              mark_corners=options.corners, writer=writer)
+
+        writer.close()
+        dst = None
 
     except Exception as e:
         logging.error(str(e), exc_info=True)
@@ -23,8 +23,15 @@
 '''Compute statistics and histograms of geo-spatial data.'''
 
 
+import os
 import sys
+import math
+import time
+import json
 import logging
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 try:
     from collections import namedtuple
@@ -33,7 +40,9 @@ except ImportError:
 else:
     Statistics = namedtuple('Statistics', 'min max mean stddev')
 
+import numpy as np
 from osgeo import gdal
+from osgeo.gdal_array import GDALTypeCodeToNumericTypeCode
 
 
 __author__ = 'Antonio Valentino <a_valentino@users.sf.net>'
@@ -44,6 +53,10 @@ __version__ = '1.0'
 GDAL_STATS_KEYS = ('STATISTICS_MINIMUM', 'STATISTICS_MAXIMUM',
                    'STATISTICS_MEAN', 'STATISTICS_STDDEV')
 
+PERCENTILE_KEY_TEMPLATE = 'STATISTICS_PERCENTILE_%g'
+
+DEFAULT_PERCENTILES = (1, 2, 5, 95, 98, 99)
+
 
 # @NOTE: the band.GetStatistics method called with the second argument
 #        set to False (no image rescanning) has been fixed in
@@ -157,8 +170,8 @@ def copy_dataset_subwin(dataset, srcwin, bands=None, vrtfile=''):
                                'virtual file.')
 
         nodata = srcband.GetNoDataValue()
-        if nodata:
-            dstband.SetNoDataValue()
+        if nodata is not None:
+            dstband.SetNoDataValue(nodata)
 
         sourcexml = SOURCE_TEMPLATE % locals()
         dstband.SetMetadataItem('source_0', sourcexml, 'new_vrt_sources')
@@ -208,8 +221,593 @@ class HistogramRequest(object):
                             for val in (self.hmin, self.hmax, self.nbuckets))
 
 
-def computestats(dataset, bands=None, computestats=True, histreq=None,
-                 approxok=False, minmax_only=False, callback=None):
+### Numpy backend #############################################################
+#: approximate number of pixels processed for each band if the *approxok*
+#: flag is set
+APPROX_SAMPLE_SIZE = 4 * 1024 ** 2
+
+#: number of tasks (block ranges) for each band and for each worker thread
+TASKS_PER_JOB = 4
+
+
+def _validdata(data, nodata=None):
+    '''Return a flat array of valid (not nodata and finite) values.'''
+
+    data = data.ravel()
+    if np.iscomplexobj(data):
+        data = np.abs(data)
+    if nodata is not None:
+        if math.isnan(nodata):
+            data = data[~np.isnan(data)]
+        else:
+            data = data[data != nodata]
+    if data.dtype.kind == 'f':
+        data = data[np.isfinite(data)]
+    return data
+
+
+class PartialStats(object):
+    '''Partial statistics and histogram of a raster band.
+
+    Partial results computed on different blocks can be merged exactly:
+    counts, sums, sums of squares, min, max and histogram counts are
+    additive (or idempotent).
+
+    Sums are computed on data shifted by *shift* (a value close to the
+    data mean) to limit precision loss in the variance computation.
+    For integer data up to 16 bits sums are exact (int64).
+
+    '''
+
+    def __init__(self, dtype, shift=0, nodata=None, hrange=None,
+                 nbuckets=None, include_out_of_range=False):
+        dtype = np.dtype(dtype)
+        if dtype.kind in 'iu' and dtype.itemsize <= 2:
+            self.sumtype = np.dtype('int64')
+            shift = int(shift)
+        else:
+            self.sumtype = np.dtype('float64')
+
+        self.shift = shift
+        self.nodata = nodata
+        self.hrange = hrange
+        self.nbuckets = nbuckets
+        self.include_out_of_range = include_out_of_range
+
+        self.count = 0
+        self.sum = self.sumtype.type(0)
+        self.sumsq = self.sumtype.type(0)
+        self.min = None
+        self.max = None
+        if hrange is not None:
+            self.hist = np.zeros(nbuckets, dtype='int64')
+        else:
+            self.hist = None
+
+    def update(self, data):
+        data = _validdata(data, self.nodata)
+        if data.size == 0:
+            return
+
+        shifted = np.subtract(data, self.shift, dtype=self.sumtype)
+        self.count += data.size
+        self.sum += shifted.sum()
+        self.sumsq += np.dot(shifted, shifted)
+
+        vmin, vmax = data.min(), data.max()
+        self.min = vmin if self.min is None else min(self.min, vmin)
+        self.max = vmax if self.max is None else max(self.max, vmax)
+
+        if self.hist is not None:
+            hmin, hmax = self.hrange
+            scale = self.nbuckets / float(hmax - hmin)
+            indices = np.floor((data - hmin) * scale).astype('int64')
+            if self.include_out_of_range:
+                indices = indices.clip(0, self.nbuckets - 1)
+            else:
+                indices = indices[(indices >= 0) & (indices < self.nbuckets)]
+            self.hist += np.bincount(indices, minlength=self.nbuckets)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        self.count += other.count
+        self.sum += other.sum
+        self.sumsq += other.sumsq
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        if self.hist is not None:
+            self.hist += other.hist
+
+    def stats(self):
+        if self.count == 0:
+            stats = (None, None, None, None)
+        else:
+            n = self.count
+            if self.sumtype.kind == 'i':
+                # exact integer arithmetic
+                s, ss = int(self.sum), int(self.sumsq)
+                variance = (n * ss - s * s) / float(n * n)
+            else:
+                variance = self.sumsq / n - (self.sum / n) ** 2
+            mean = self.shift + self.sum / float(n)
+            stddev = math.sqrt(max(variance, 0.))
+            stats = (float(self.min), float(self.max), float(mean), stddev)
+
+        if Statistics:
+            stats = Statistics(*stats)
+
+        return stats
+
+
+def _blockwindows(band, srcwin=None, approxok=False):
+    '''Return the list of native block windows (rows) to be processed.
+
+    Each item of the list is the list of (x, y, w, h) windows of a row
+    of blocks.  If *approxok* is set blocks are sampled on a regular
+    grid so that about :data:`APPROX_SAMPLE_SIZE` pixels are processed.
+
+    '''
+
+    if srcwin is None:
+        srcwin = (0, 0, band.XSize, band.YSize)
+    xoff, yoff, xsize, ysize = srcwin
+    bxsize, bysize = band.GetBlockSize()
+
+    # block indices of the source window
+    bx0, by0 = xoff // bxsize, yoff // bysize
+    bx1 = (xoff + xsize + bxsize - 1) // bxsize
+    by1 = (yoff + ysize + bysize - 1) // bysize
+
+    xstride = ystride = 1
+    if approxok:
+        factor = xsize * ysize / float(APPROX_SAMPLE_SIZE)
+        if factor > 1:
+            if bx1 - bx0 == 1:
+                ystride = int(math.ceil(factor))
+            elif by1 - by0 == 1:
+                xstride = int(math.ceil(factor))
+            else:
+                xstride = ystride = int(math.ceil(math.sqrt(factor)))
+
+    rows = []
+    for by in range(by0, by1, ystride):
+        y = max(by * bysize, yoff)
+        h = min((by + 1) * bysize, yoff + ysize) - y
+        row = []
+        for bx in range(bx0, bx1, xstride):
+            x = max(bx * bxsize, xoff)
+            w = min((bx + 1) * bxsize, xoff + xsize) - x
+            row.append((x, y, w, h))
+        rows.append(row)
+
+    return rows
+
+
+class _DatasetPool(object):
+    '''Provide a private GDAL dataset handle to each thread.
+
+    GDAL dataset handles can't be shared between threads so each worker
+    re-opens the dataset.  Datasets that can't be re-opened (e.g. MEM
+    or anonymous VRT datasets) are shared and accesses are serialized.
+
+    '''
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.filename = dataset.GetDescription()
+        self._local = threading.local()
+        self.lock = None
+
+        handle = None
+        if self.filename:
+            handle = gdal.Open(self.filename)
+        if handle is None:
+            self.lock = threading.Lock()
+
+    def band(self, bandno):
+        if self.lock is not None:
+            return self.dataset.GetRasterBand(bandno)
+
+        handle = getattr(self._local, 'dataset', None)
+        if handle is None:
+            handle = gdal.Open(self.filename)
+            self._local.dataset = handle
+        return handle.GetRasterBand(bandno)
+
+    def read(self, band, x, y, w, h):
+        if self.lock is not None:
+            with self.lock:
+                return band.ReadAsArray(x, y, w, h)
+        return band.ReadAsArray(x, y, w, h)
+
+
+def _shift(band, windows):
+    '''Return a value close to the band mean (from the central block).'''
+
+    x, y, w, h = windows[len(windows) // 2][0]
+    data = band.ReadAsArray(x, y, w, h).ravel()
+    if np.iscomplexobj(data):
+        data = np.abs(data)
+    data = data[np.isfinite(data)] if data.dtype.kind == 'f' else data
+    if data.size == 0:
+        return 0
+    return np.median(data)
+
+
+def _numpypass(dataset, bands, srcwin, approxok, jobs, callback, factories):
+    '''Run a parallel pass over blocks of *bands*.
+
+    *factories* maps band numbers to functions returning empty
+    :class:`PartialStats` objects.  Return merged results.
+
+    '''
+
+    datasets = _DatasetPool(dataset)
+    results = {}
+    tasks = []
+    for bandno in bands:
+        band = dataset.GetRasterBand(bandno)
+        rows = _blockwindows(band, srcwin, approxok)
+        results[bandno] = factories[bandno]()
+
+        ntasks = max(1, min(len(rows), jobs * TASKS_PER_JOB))
+        step = int(math.ceil(len(rows) / float(ntasks)))
+        for index in range(0, len(rows), step):
+            windows = [w for row in rows[index:index + step] for w in row]
+            tasks.append((bandno, windows))
+
+    def work(task):
+        bandno, windows = task
+        band = datasets.band(bandno)
+        partial = factories[bandno]()
+        for x, y, w, h in windows:
+            data = datasets.read(band, x, y, w, h)
+            if data is None:
+                raise RuntimeError('unable to read band n. %d (%s)' % (
+                                            bandno, gdal.GetLastErrorMsg()))
+            partial.update(data)
+        return bandno, partial
+
+    pool = ThreadPool(jobs)
+    try:
+        for count, (bandno, partial) in enumerate(
+                                        pool.imap_unordered(work, tasks), 1):
+            results[bandno].merge(partial)
+            if callback:
+                callback(count / float(len(tasks)), '', None)
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+
+def _defaulthistrange(dtype, vmin, vmax, nbuckets=256):
+    '''Histogram range computed as in gdal.Band.GetDefaultHistogram.'''
+
+    if np.dtype(dtype) == np.uint8:
+        return -0.5, 255.5
+    halfbucket = (vmax - vmin) / (2. * (nbuckets - 1))
+    return vmin - halfbucket, vmax + halfbucket
+
+
+def numpystats(dataset, bands=None, computestats=True, histreq=None,
+               approxok=False, srcwin=None, jobs=None, callback=None):
+    '''Compute statistics and histograms using numpy.
+
+    Native blocks are processed in parallel by *jobs* threads (default:
+    the number of CPUs), each one using a private GDAL dataset handle.
+    Partial results are merged exactly.
+
+    Nodata values are ignored, *srcwin* (xoffset, yoffset, xsize,
+    ysize) restricts computation to a window of the image and, if
+    *approxok* is set, only a regular grid of blocks is processed.
+
+    If a default histogram is requested for non Byte bands data are
+    processed twice: the histogram range depends on data min and max.
+
+    Return (statistics, histograms) dictionaries indexed by band number.
+
+    '''
+
+    if bands is None:
+        bands = range(1, dataset.RasterCount + 1)
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    statistics = {}
+    histograms = {}
+
+    info = {}
+    for bandno in bands:
+        band = dataset.GetRasterBand(bandno)
+        if not band:
+            raise RuntimeError('unable to open band n. %d' % bandno)
+        dtype = np.dtype(GDALTypeCodeToNumericTypeCode(band.DataType))
+        shift = _shift(band, _blockwindows(band, srcwin, approxok))
+        info[bandno] = (dtype, shift, band.GetNoDataValue())
+
+    def factory(bandno, hrange=None, nbuckets=None):
+        dtype, shift, nodata = info[bandno]
+        include = bool(histreq and histreq.include_out_of_range)
+        return lambda: PartialStats(dtype, shift, nodata, hrange, nbuckets,
+                                    include)
+
+    # first pass: statistics (and custom histograms)
+    hranges = {}
+    if histreq and histreq.iscustom():
+        hmin, hmax, nbuckets = histreq.values()
+        for bandno in bands:
+            hranges[bandno] = (hmin, hmax, int(nbuckets))
+    elif histreq:
+        for bandno in bands:
+            if info[bandno][0] == np.uint8:
+                hranges[bandno] = _defaulthistrange(np.uint8, 0, 255) + (256,)
+
+    needstats = computestats or (histreq and len(hranges) < len(bands))
+    if needstats:
+        factories = dict((bandno, factory(bandno, *(
+                            ((hranges[bandno][:2], hranges[bandno][2])
+                             if bandno in hranges else ()))))
+                         for bandno in bands)
+        results = _numpypass(dataset, bands, srcwin, approxok, jobs,
+                             callback, factories)
+        for bandno in bands:
+            statistics[bandno] = results[bandno].stats()
+            if bandno in hranges:
+                hmin, hmax, nbuckets = hranges[bandno]
+                histograms[bandno] = (hmin, hmax, nbuckets,
+                                      results[bandno].hist.tolist())
+
+    # second pass: default histograms (range from data min and max)
+    if histreq:
+        todo = [bandno for bandno in bands if bandno not in histograms]
+        factories = {}
+        for bandno in todo:
+            vmin, vmax = statistics[bandno][:2]
+            if vmin is None:
+                continue
+            hmin, hmax = _defaulthistrange(info[bandno][0], vmin, vmax)
+            hranges[bandno] = (hmin, hmax, 256)
+            factories[bandno] = factory(bandno, (hmin, hmax), 256)
+        if factories:
+            results = _numpypass(dataset, sorted(factories), srcwin,
+                                 approxok, jobs, callback, factories)
+            for bandno in factories:
+                hmin, hmax, nbuckets = hranges[bandno]
+                histograms[bandno] = (hmin, hmax, nbuckets,
+                                      results[bandno].hist.tolist())
+
+    if not computestats:
+        statistics = {}
+
+    return statistics, histograms
+
+
+### Percentiles ###############################################################
+#: number of buckets of histograms used for percentiles refinement
+PERCENTILE_BUCKETS = 4096
+
+#: max number of values collected in memory to compute a percentile exactly
+PERCENTILE_EXACT_LIMIT = 1024 ** 2
+
+#: max number of refinement passes
+PERCENTILE_MAX_PASSES = 8
+
+
+class PartialSelect(object):
+    '''Partial results of a percentile refinement pass.
+
+    For each (lower, upper, closed, nbuckets) interval the object counts
+    values falling in *nbuckets* equally spaced buckets or, if
+    *nbuckets* is None, collects values falling in the interval.
+    Intervals are half-open unless *closed* is set.
+
+    '''
+
+    def __init__(self, intervals, nodata=None):
+        self.intervals = intervals
+        self.nodata = nodata
+        self.edges = []
+        self.results = []
+        for lower, upper, closed, nbuckets in intervals:
+            if nbuckets is None:
+                self.edges.append(None)
+                self.results.append([])
+            else:
+                self.edges.append(np.linspace(lower, upper, nbuckets + 1))
+                self.results.append(np.zeros(nbuckets, dtype='int64'))
+
+    def update(self, data):
+        data = _validdata(data, self.nodata)
+        if data.size == 0:
+            return
+
+        for index, (lower, upper, closed, nbuckets) in enumerate(
+                                                            self.intervals):
+            if closed:
+                values = data[(data >= lower) & (data <= upper)]
+            else:
+                values = data[(data >= lower) & (data < upper)]
+
+            if nbuckets is None:
+                self.results[index].append(values)
+            else:
+                indices = self.edges[index].searchsorted(values, 'right') - 1
+                indices = indices.clip(0, nbuckets - 1)
+                self.results[index] += np.bincount(indices,
+                                                   minlength=nbuckets)
+
+    def merge(self, other):
+        for index, nbuckets in enumerate(item[-1] for item in self.intervals):
+            if nbuckets is None:
+                self.results[index].extend(other.results[index])
+            else:
+                self.results[index] += other.results[index]
+
+
+def _isunique(lower, upper, closed, isint):
+    '''Return True if the interval contains a single possible value.'''
+
+    if isint:
+        last = math.floor(upper) if closed else math.ceil(upper) - 1
+        return last <= math.ceil(lower)
+    elif closed:
+        return lower >= upper
+    else:
+        return np.nextafter(lower, np.inf) >= upper
+
+
+def numpypercentiles(dataset, bands=None, percentiles=DEFAULT_PERCENTILES,
+                     srcwin=None, approxok=False, jobs=None, callback=None):
+    '''Compute exact percentiles with bounded memory.
+
+    Percentiles are computed by iterative histogram refinement: the
+    first pass counts valid values and computes the data range, then
+    each pass computes a :data:`PERCENTILE_BUCKETS` buckets histogram
+    of the interval containing the requested rank.  Refinement stops
+    when the interval contains at most :data:`PERCENTILE_EXACT_LIMIT`
+    values (that are collected and selected exactly) or a single
+    possible value.  Passes are performed block-wise and in parallel
+    as in :func:`numpystats`.
+
+    The *q*-th percentile is the smallest value *v* such that at least
+    *q* percent of valid values are lower or equal to *v*.
+
+    Return a dictionary of {percentile: value} dictionaries indexed by
+    band number.
+
+    '''
+
+    if bands is None:
+        bands = range(1, dataset.RasterCount + 1)
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    isint = {}
+    nodata = {}
+    for bandno in bands:
+        band = dataset.GetRasterBand(bandno)
+        if not band:
+            raise RuntimeError('unable to open band n. %d' % bandno)
+        dtype = np.dtype(GDALTypeCodeToNumericTypeCode(band.DataType))
+        isint[bandno] = dtype.kind in 'iu'
+        nodata[bandno] = band.GetNoDataValue()
+
+    def statsfactory(bandno):
+        return lambda: PartialStats('float64', nodata=nodata[bandno])
+
+    def selectfactory(bandno, intervals):
+        return lambda: PartialSelect(intervals, nodata[bandno])
+
+    # first pass: number of valid values and data range
+    factories = dict((bandno, statsfactory(bandno)) for bandno in bands)
+    results = _numpypass(dataset, bands, srcwin, approxok, jobs, callback,
+                         factories)
+
+    # pending[bandno][q] = (rank, lower, upper, closed, size)
+    # where rank (1-based) is relative to the [lower, upper) interval and
+    # size is the number of values falling in the interval
+    output = {}
+    pending = {}
+    for bandno in bands:
+        partial = results[bandno]
+        output[bandno] = {}
+        pending[bandno] = {}
+        for q in percentiles:
+            if partial.count == 0:
+                output[bandno][q] = None
+                continue
+            rank = int(math.ceil(q / 100. * partial.count))
+            rank = min(max(rank, 1), partial.count)
+            pending[bandno][q] = (rank, float(partial.min),
+                                  float(partial.max), True, partial.count)
+
+    npass = 0
+    while any(pending.values()):
+        npass += 1
+
+        keys = {}
+        factories = {}
+        for bandno, items in pending.items():
+            if not items:
+                continue
+            intervals = []
+            for q, (rank, lower, upper, closed, size) in items.items():
+                if (size <= PERCENTILE_EXACT_LIMIT or
+                        npass >= PERCENTILE_MAX_PASSES):
+                    key = (lower, upper, closed, None)
+                else:
+                    key = (lower, upper, closed, PERCENTILE_BUCKETS)
+                if key not in intervals:
+                    intervals.append(key)
+                keys[bandno, q] = intervals.index(key)
+            factories[bandno] = selectfactory(bandno, intervals)
+
+        results = _numpypass(dataset, sorted(factories), srcwin, approxok,
+                             jobs, callback, factories)
+
+        for bandno in factories:
+            partial = results[bandno]
+            selected = {}
+            for q, (rank, lower, upper, closed, size) in list(
+                                                    pending[bandno].items()):
+                index = keys[bandno, q]
+                nbuckets = partial.intervals[index][-1]
+
+                if nbuckets is None:
+                    # exact selection
+                    if index not in selected:
+                        values = partial.results[index]
+                        values = (np.concatenate(values) if values
+                                  else np.empty(0))
+                        selected[index] = np.sort(values)
+                    output[bandno][q] = float(selected[index][rank - 1])
+                    del pending[bandno][q]
+                    continue
+
+                # refinement
+                hist = partial.results[index]
+                edges = partial.edges[index]
+                cumhist = hist.cumsum()
+                bucket = int(cumhist.searchsorted(rank))
+                if bucket > 0:
+                    rank -= int(cumhist[bucket - 1])
+                lower, upper = float(edges[bucket]), float(edges[bucket + 1])
+                closed = closed and (bucket == nbuckets - 1)
+
+                if _isunique(lower, upper, closed, isint[bandno]):
+                    if isint[bandno]:
+                        lower = float(math.ceil(lower))
+                    output[bandno][q] = lower
+                    del pending[bandno][q]
+                else:
+                    pending[bandno][q] = (rank, lower, upper, closed,
+                                          int(hist[bucket]))
+
+    return output
+
+
+def storepercentiles(band, percentiles):
+    '''Store percentiles in the band metadata.
+
+    Each {percentile: value} item is stored in the
+    STATISTICS_PERCENTILE_<percentile> metadata item (the default domain
+    is used, so values are persisted in the PAM .aux.xml file like
+    other statistics).
+
+    '''
+
+    for q, value in percentiles.items():
+        if value is not None:
+            band.SetMetadataItem(PERCENTILE_KEY_TEMPLATE % q, repr(value))
+
+
+### GDAL backend ##############################################################
+def gdalstats(dataset, bands=None, computestats=True, histreq=None,
+              approxok=False, srcwin=None, callback=None):
+    '''Compute statistics and histograms using GDAL.'''
 
     statistics = {}
     histograms = {}
@@ -217,6 +815,9 @@ def computestats(dataset, bands=None, computestats=True, histreq=None,
     if bands is None:
         bands = range(1, dataset.RasterCount + 1)
 
+    if srcwin:
+        dataset = copy_dataset_subwin(dataset, srcwin)
+
     for bandno in bands:
         band = dataset.GetRasterBand(bandno)
         if not band:
@@ -236,20 +837,6 @@ def computestats(dataset, bands=None, computestats=True, histreq=None,
 
             statistics[bandno] = stats
 
-            vmin, vmax, mean, stddev = stats
-
-            if minmax_only:
-                logging.info('%f %f' % (vmin, vmax))
-            else:
-                logging.info('Statistics for band n. %d' % bandno)
-                logging.info('Min:    %f' % vmin)
-                logging.info('Max:    %f' % vmax)
-                logging.info('Mean:   %f' % mean)
-                logging.info('Stddev: %f' % stddev)
-
-            if computestats and histreq:
-                logging.info('')
-
         if histreq:
             if not histreq.iscustom():
                 hmin, hmax, nbuckets, hist = band.GetDefaultHistogram(
@@ -263,16 +850,334 @@ def computestats(dataset, bands=None, computestats=True, histreq=None,
 
             histograms[bandno] = (hmin, hmax, nbuckets, hist)
 
+    return statistics, histograms
+
+
+BACKENDS = ('gdal', 'numpy')
+
+
+def bandstats(dataset, bands=None, computestats=True, histreq=None,
+              approxok=False, callback=None, backend='gdal', srcwin=None,
+              jobs=None, percentiles=None):
+    '''Compute statistics, histograms and percentiles of raster bands.
+
+    Results of exact computations on entire bands are stored in the
+    band metadata.
+
+    Return (statistics, histograms, percentiles) dictionaries indexed
+    by band number.
+
+    '''
+
+    if bands is None:
+        bands = range(1, dataset.RasterCount + 1)
+
+    if backend == 'numpy':
+        statistics, histograms = numpystats(dataset, bands, computestats,
+                                            histreq, approxok, srcwin, jobs,
+                                            callback)
+    elif backend == 'gdal':
+        statistics, histograms = gdalstats(dataset, bands, computestats,
+                                           histreq, approxok, srcwin,
+                                           callback)
+    else:
+        raise ValueError('invalid backend: "%s"' % backend)
+
+    # @NOTE: GDAL stores statistics computed by ComputeStatistics
+    if backend == 'numpy' and not srcwin and not approxok:
+        for bandno, stats in statistics.items():
+            if None not in stats:
+                dataset.GetRasterBand(bandno).SetStatistics(*stats)
+
+    # @NOTE: percentiles are always computed using the numpy machinery
+    #        (GDAL does not provide an API for percentiles)
+    if percentiles:
+        percentiles = numpypercentiles(dataset, bands, percentiles, srcwin,
+                                       approxok, jobs, callback)
+
+        # only store exact percentiles of the entire band
+        if not srcwin and not approxok:
+            for bandno in bands:
+                storepercentiles(dataset.GetRasterBand(bandno),
+                                 percentiles[bandno])
+    else:
+        percentiles = {}
+
+    return statistics, histograms, percentiles
+
+
+def computestats(dataset, bands=None, computestats=True, histreq=None,
+                 approxok=False, minmax_only=False, callback=None,
+                 backend='gdal', srcwin=None, jobs=None, percentiles=None):
+
+    if bands is None:
+        bands = range(1, dataset.RasterCount + 1)
+
+    statistics, histograms, percentiles = bandstats(
+                            dataset, bands, computestats, histreq, approxok,
+                            callback, backend, srcwin, jobs, percentiles)
+
+    for bandno in bands:
+        if computestats:
+            vmin, vmax, mean, stddev = statistics[bandno]
+
+            if minmax_only:
+                logging.info('%s %s' % (vmin, vmax))
+            else:
+                logging.info('Statistics for band n. %d' % bandno)
+                logging.info('Min:    %s' % vmin)
+                logging.info('Max:    %s' % vmax)
+                logging.info('Mean:   %s' % mean)
+                logging.info('Stddev: %s' % stddev)
+
+            if computestats and histreq:
+                logging.info('')
+
+        if histreq and bandno in histograms:
+            hmin, hmax, nbuckets, hist = histograms[bandno]
+
             logging.info('Histogram for band n. %d' % bandno)
             logging.info('Hist. min: %f' % hmin)
             logging.info('Hist. max: %f' % hmax)
             logging.info('Nuckets:   %d' % nbuckets)
             logging.info('Histogram: %s' % hist)
 
+        if percentiles:
+            if computestats or histreq:
+                logging.info('')
+            logging.info('Percentiles for band n. %d' % bandno)
+            for q, value in sorted(percentiles[bandno].items()):
+                logging.info('%-7s %s' % ('%g%%:' % q, value))
+
         if len(bands) > 1:
             logging.info('')
 
-    return statistics, histograms
+    return statistics, histograms, percentiles
+
+
+def benchmark(filename, bands=None, approxok=False, srcwin=None, jobs=None):
+    '''Compare timings of the GDAL and numpy backends.
+
+    Statistics computation is performed on *filename* with both
+    backends and timings, throughput and maximum differences of
+    results are logged.
+
+    '''
+
+    results = {}
+    for backend in BACKENDS:
+        # @NOTE: re-open the dataset to avoid cached statistics
+        dataset = gdal.Open(filename)
+        if not dataset:
+            raise RuntimeError('unable to open "%s"' % filename)
+        if bands is None:
+            bands = range(1, dataset.RasterCount + 1)
+
+        if srcwin:
+            xsize, ysize = srcwin[2:]
+        else:
+            xsize, ysize = dataset.RasterXSize, dataset.RasterYSize
+        nbytes = 0
+        for bandno in bands:
+            band = dataset.GetRasterBand(bandno)
+            nbytes += xsize * ysize * gdal.GetDataTypeSize(band.DataType) // 8
+
+        t0 = time.time()
+        if backend == 'numpy':
+            stats, hist = numpystats(dataset, bands, True, None, approxok,
+                                     srcwin, jobs)
+        else:
+            stats, hist = gdalstats(dataset, bands, True, None, approxok,
+                                    srcwin)
+        elapsed = time.time() - t0
+        dataset = None
+
+        results[backend] = stats
+        logging.info('%-6s backend: %8.3f s  %9.1f MB/s' % (
+                        backend, elapsed, nbytes / 1024. ** 2 / elapsed))
+
+    for bandno in bands:
+        diff = [abs(a - b) for a, b in zip(results['gdal'][bandno],
+                                           results['numpy'][bandno])
+                                                if None not in (a, b)]
+        logging.info('band n. %d: max difference %g' % (bandno,
+                                                        max(diff or [0])))
+
+
+### Batch mode ################################################################
+#: extensions of sidecar files skipped when directories are scanned
+SIDECAR_EXTENSIONS = ('.aux.xml', '.ovr', '.msk', '.xml', '.json')
+
+
+def expandpaths(paths):
+    '''Expand directories in *paths* recursively.
+
+    Sidecar files (see :data:`SIDECAR_EXTENSIONS`) found in directories
+    are skipped.
+
+    '''
+
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.lower().endswith(SIDECAR_EXTENSIONS):
+                    continue
+                yield os.path.join(dirpath, name)
+
+
+def isuptodate(filename, dataset, bands, percentiles=None):
+    '''Return True if cached statistics are newer than *filename*.
+
+    Statistics (and *percentiles*, if requested) of all *bands* shall
+    be available in the band metadata and the PAM .aux.xml file shall
+    be newer than *filename*.
+
+    '''
+
+    auxfile = filename + '.aux.xml'
+    if not os.path.exists(auxfile):
+        return False
+    if os.path.getmtime(auxfile) < os.path.getmtime(filename):
+        return False
+
+    for bandno in bands:
+        band = dataset.GetRasterBand(bandno)
+        if None in GetStatisticsFromMetadata(band):
+            return False
+        for q in (percentiles or []):
+            if band.GetMetadataItem(PERCENTILE_KEY_TEMPLATE % q) is None:
+                return False
+
+    return True
+
+
+def _batchrecord(filename, bands, statistics, histograms, percentiles):
+    record = {'filename': filename, 'bands': []}
+    for bandno in bands:
+        item = {'band': bandno}
+        if bandno in statistics:
+            item.update(zip(('min', 'max', 'mean', 'stddev'),
+                            statistics[bandno]))
+        if bandno in histograms:
+            item['histogram'] = dict(zip(('min', 'max', 'nbuckets', 'counts'),
+                                         histograms[bandno]))
+        if bandno in percentiles:
+            item['percentiles'] = dict(('%g' % q, value) for q, value in
+                                       percentiles[bandno].items())
+        record['bands'].append(item)
+    return record
+
+
+def processfile(filename, bandno=None, computestats=True, histreq=None,
+                approxok=False, backend='gdal', srcwin=None, jobs=1,
+                percentiles=None, force=False):
+    '''Compute statistics of a single file in batch mode.
+
+    Return a record (dictionary) including results or, in case of
+    failure, the error message.  Files with up to date statistics
+    (see :func:`isuptodate`) are skipped unless *force* is set and
+    cached statistics are returned.
+
+    '''
+
+    t0 = time.time()
+    try:
+        dataset = gdal.Open(filename)
+        if not dataset:
+            raise RuntimeError('unable to open "%s"' % filename)
+
+        if bandno is None:
+            bands = range(1, dataset.RasterCount + 1)
+        elif bandno > dataset.RasterCount:
+            raise ValueError('band %d requested, but only bands 1 to %d '
+                             'are available.' % (bandno, dataset.RasterCount))
+        else:
+            bands = [bandno]
+
+        # @NOTE: only statistics of entire bands are cached
+        cacheable = not (srcwin or approxok or histreq) and computestats
+        if cacheable and not force and isuptodate(filename, dataset, bands,
+                                                  percentiles):
+            statistics = {}
+            cached = {}
+            for n in bands:
+                band = dataset.GetRasterBand(n)
+                statistics[n] = tuple(GetStatisticsFromMetadata(band))
+                if percentiles:
+                    cached[n] = dict(
+                        (q, float(band.GetMetadataItem(
+                                            PERCENTILE_KEY_TEMPLATE % q)))
+                        for q in percentiles)
+            record = _batchrecord(filename, bands, statistics, {}, cached)
+            record['status'] = 'skipped'
+        else:
+            results = bandstats(dataset, bands, computestats, histreq,
+                                approxok, None, backend, srcwin, jobs,
+                                percentiles)
+            record = _batchrecord(filename, bands, *results)
+            record['status'] = 'ok'
+
+        dataset = None
+    except Exception as e:
+        record = {'filename': filename, 'status': 'error', 'error': str(e)}
+
+    record['elapsed'] = time.time() - t0
+
+    return record
+
+
+def _processfile(args):
+    filename, kwargs = args
+    return processfile(filename, **kwargs)
+
+
+def _jsonvalue(obj):
+    # numpy scalars
+    if hasattr(obj, 'item'):
+        return obj.item()
+    raise TypeError('%r is not JSON serializable' % obj)
+
+
+def batch(filenames, outfile=None, workers=None, **kwargs):
+    '''Compute statistics of many files using a pool of processes.
+
+    Files are spread across *workers* processes (default: the number of
+    CPUs) and results are written to *outfile* (default: stdout) as
+    JSON lines as soon as they are available.  Extra keyword arguments
+    are passed to :func:`processfile`.
+
+    Return a dictionary containing the number of records for each
+    status ('ok', 'skipped' and 'error').
+
+    '''
+
+    if outfile is None:
+        outfile = sys.stdout
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    counters = {'ok': 0, 'skipped': 0, 'error': 0}
+    tasks = ((filename, kwargs) for filename in filenames)
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        for record in pool.imap_unordered(_processfile, tasks):
+            counters[record['status']] += 1
+            outfile.write(json.dumps(record, default=_jsonvalue) + '\n')
+            outfile.flush()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return counters
 
 
 ### Command line tool #########################################################
@@ -285,7 +1190,7 @@ def handlecmd(argv=None):
     argv = gdal.GeneralCmdLineProcessor(argv)
 
     parser = optparse.OptionParser(
-                        usage='%prog [options] FILENAME',
+                        usage='%prog [options] FILENAME|DIRECTORY [...]',
                         version='%%prog %s' % __version__,
                         description=__doc__)
     parser.add_option('--no-stats', dest='stats', action='store_false',
@@ -313,10 +1218,34 @@ def handlecmd(argv=None):
                            'be mapped into the first bucket, and values above '
                            'will be mapped into last one. '
                            'Otherwise out of range values are discarded.')
+    parser.add_option('-p', '--percentiles', action='store_true',
+                      default=False,
+                      help='compute exact percentiles (stored in the band '
+                           'metadata if the entire band is processed '
+                           'without "approxok")')
+    parser.add_option('--percentile-values', metavar='Q1,Q2,...',
+                      default=','.join('%g' % q for q in DEFAULT_PERCENTILES),
+                      help='comma separated list of percentiles to be '
+                           'computed (default: %default)')
     parser.add_option('--srcwin', nargs=4, type='int',
                       metavar='XOFFSET YOFFSET XSIZE YSIZE',
                       help='specify source window in image coordinates: '
                            '(default: the entire image is processed)')
+    parser.add_option('--backend', choices=BACKENDS, default='gdal',
+                      help='computation backend: %s (default: %%default)' %
+                           ', '.join(BACKENDS))
+    parser.add_option('-j', '--jobs', type='int', default=None,
+                      help='number of worker threads used by the numpy '
+                           'backend (default: number of CPUs)')
+    parser.add_option('--benchmark', action='store_true', default=False,
+                      help='compare timings of the GDAL and numpy '
+                           'backends on FILENAME')
+    parser.add_option('-w', '--workers', type='int', default=None,
+                      help='number of worker processes used in batch mode '
+                           '(default: number of CPUs)')
+    parser.add_option('-f', '--force', action='store_true', default=False,
+                      help='in batch mode re-compute statistics even if '
+                           'cached ones are up to date (default: %default)')
     parser.add_option('-o', '--outfile', metavar='FILE',
                       help='write results to FILE (default: stdout)', )
     parser.add_option('-q', '--quiet', action='store_true',
@@ -329,19 +1258,36 @@ def handlecmd(argv=None):
         #parser.error('"histreq" option requires "hist"')
     if options.include_out_of_range and not options.hist:
         parser.error('"include_out_of_range" option requires "hist"')
+    if options.jobs is not None and options.jobs < 1:
+        parser.error('the "jobs" parameter shoulb be a not null positive '
+                     'integer.')
     if options.band is not None and options.band < 1:
         parser.error('the "band" parameter shoulb be a not null positive '
                      'integer.')
+    try:
+        options.percentile_values = [
+            float(q) for q in options.percentile_values.split(',')]
+    except ValueError:
+        parser.error('invalid "percentile-values": "%s"' %
+                     options.percentile_values)
+    if [q for q in options.percentile_values if not 0 <= q <= 100]:
+        parser.error('percentiles shall be in the [0, 100] range.')
     histonly = bool(options.hist and not options.stats)
     if histonly and options.approxok and not options.histreq:
         logging.warning('the "approxok" option is ignored if "histreq" '
                         'is not set.')
 
-    if not options.stats and not options.hist:
-        parser.error('nothing to compute: '
-                     'please check "--hist" and "--no-stats" optoions.')
-    if len(args) != 1:
+    if not options.stats and not options.hist and not options.percentiles:
+        parser.error('nothing to compute: please check "--hist", '
+                     '"--percentiles" and "--no-stats" optoions.')
+    if not args:
         parser.error('at least one argument is required.')
+    if options.workers is not None and options.workers < 1:
+        parser.error('the "workers" parameter shoulb be a not null positive '
+                     'integer.')
+    options.batch = len(args) > 1 or os.path.isdir(args[0])
+    if options.batch and options.benchmark:
+        parser.error('"benchmark" requires a single FILENAME.')
 
     return options, args
 
@@ -356,7 +1302,7 @@ def main(*argv):
 
         options, args = handlecmd(argv)
 
-        if options.outfile:
+        if options.outfile and not options.batch:
             logger = logging.getLogger()
 
             streamhandler = logger.handlers[0]
@@ -370,8 +1316,6 @@ def main(*argv):
 
             logger.addHandler(filehandler)
 
-        filename = args[0]
-
         if options.quiet:
             progressfunc = None
         else:
@@ -386,6 +1330,35 @@ def main(*argv):
         else:
             histreq = None
 
+        percentiles = options.percentiles and options.percentile_values
+
+        if options.batch:
+            if options.outfile:
+                outfile = open(options.outfile, 'w')
+            else:
+                outfile = sys.stdout
+            try:
+                counters = batch(expandpaths(args), outfile, options.workers,
+                                 bandno=options.band,
+                                 computestats=options.stats, histreq=histreq,
+                                 approxok=options.approxok,
+                                 backend=options.backend,
+                                 srcwin=options.srcwin,
+                                 jobs=options.jobs or 1,
+                                 percentiles=percentiles,
+                                 force=options.force)
+            finally:
+                if outfile is not sys.stdout:
+                    outfile.close()
+
+            if not options.quiet:
+                logging.warning('%(ok)d processed, %(skipped)d skipped, '
+                                '%(error)d failed' % counters)
+            if counters['error']:
+                sys.exit(1)
+            return
+
+        filename = args[0]
         ds = gdal.Open(filename)
         if not ds:
             raise RuntimeError('unable to open "%s"' % filename)
@@ -399,12 +1372,16 @@ def main(*argv):
         else:
             bands = range(1, ds.RasterCount + 1)
 
-        if options.srcwin:
-            ds = copy_dataset_subwin(ds, options.srcwin)
+        if options.benchmark:
+            ds = None
+            benchmark(filename, bands, options.approxok, options.srcwin,
+                      options.jobs)
+            return
 
         # core
         computestats(ds, bands, options.stats, histreq, options.approxok,
-                     options.minmax_only, progressfunc)
+                     options.minmax_only, progressfunc, options.backend,
+                     options.srcwin, options.jobs, percentiles)
 
         ds = None
 
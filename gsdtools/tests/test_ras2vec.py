@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+### Copyright (C) 2008-2012 Antonio Valentino <a_valentino@users.sf.net>
+
+### This file is part of GSDView.
+
+### GSDView is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; either version 2 of the License, or
+### (at your option) any later version.
+
+### GSDView is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+
+### You should have received a copy of the GNU General Public License
+### along with GSDView; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from osgeo import gdal, ogr, osr
+
+# Fix sys path
+from os.path import abspath, dirname
+GSDVIEWROOT = abspath(os.path.join(dirname(__file__), os.pardir, os.pardir))
+sys.path.insert(0, GSDVIEWROOT)
+
+from gsdtools import ras2vec
+
+
+def _createraster(filename, geotransform=(10., .1, 0., 45., 0., -.1)):
+    '''Create a small GeoTIFF in geographic coordinates (WGS84).'''
+
+    srs = osr.SpatialReference()
+    srs.SetWellKnownGeogCS('WGS84')
+    driver = gdal.GetDriverByName('GTiff')
+    dataset = driver.Create(filename, 10, 10, 1, gdal.GDT_Byte)
+    dataset.SetProjection(srs.ExportToWkt())
+    dataset.SetGeoTransform(geotransform)
+    dataset = None
+
+
+class TempDirTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def makefile(self, name, data=b''):
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, 'wb') as fd:
+            fd.write(data)
+        return filename
+
+
+class TestRasterExtensions(unittest.TestCase):
+    def test_extensions(self):
+        extensions = ras2vec.raster_extensions()
+        self.assertTrue('tif' in extensions)
+        self.assertFalse('shp' in extensions)   # vector only driver
+        for ext in ras2vec.GENERIC_EXTENSIONS:
+            self.assertFalse(ext in extensions)
+
+
+class TestProbeFilter(TempDirTestCase):
+    def setUp(self):
+        super(TestProbeFilter, self).setUp()
+        self.tiff = self.makefile('noext', b'II*\x00' + b'\x00' * 16)
+        self.vrt = self.makefile('dataset.xml', b'<VRTDataset>')
+        self.text = self.makefile('notes.xml', b'<notes/>')
+
+    def _filter(self, **kwargs):
+        return ras2vec.ProbeFilter(extensions=set(['tif', 'ovr']), **kwargs)
+
+    def test_rule_order(self):
+        prefilter = self._filter(include=['*.aux.xml'],
+                                 exclude=['excluded.*'])
+        self.assertFalse(prefilter('excluded.tif'))     # exclude first
+        self.assertTrue(prefilter('a.tif.aux.xml'))     # then include
+        self.assertFalse(prefilter('a.tif.ovr'))        # then sidecars
+        self.assertTrue(prefilter('missing.tif'))       # then extension
+        self.assertTrue(prefilter(self.tiff))           # then magic
+        self.assertTrue(prefilter(self.vrt))
+        self.assertFalse(prefilter(self.text))
+        self.assertFalse(prefilter('missing.dat'))
+
+        self.assertEqual(prefilter.counters, {
+            'accepted': 4,
+            'excluded': 1,
+            'extension': 1,
+            'magic': 2,
+        })
+        self.assertEqual(prefilter.rejected, 4)
+
+    def test_no_sniff(self):
+        prefilter = self._filter(exclude=['*.xml'], sniff=False)
+        self.assertFalse(prefilter(self.vrt))
+        self.assertTrue(prefilter('a.tif.ovr'))
+        self.assertTrue(prefilter('missing.dat'))
+        self.assertEqual(prefilter.counters['accepted'], 2)
+        self.assertEqual(prefilter.rejected, 1)
+
+
+class TestManifest(TempDirTestCase):
+    def setUp(self):
+        super(TestManifest, self).setUp()
+        # @NOTE: the output file and the manifest are in the indexed tree
+        self.raster = os.path.join(self.tmpdir, 'a.tif')
+        _createraster(self.raster)
+        self.makefile('notes.txt', b'not a raster')
+        self.manifest = os.path.join(self.tmpdir, 'manifest.json')
+        self.dst = os.path.join(self.tmpdir, 'index.gpkg')
+
+    def _index(self, srsout=None):
+        if os.path.exists(self.dst):
+            os.remove(self.dst)
+        return ras2vec.raster_tree_index(self.tmpdir, self.dst, 'footprints',
+                                         False, srsout=srsout, jobs=1,
+                                         manifest=self.manifest)
+
+    def _check(self, counters, opened, unchanged):
+        self.assertEqual(counters['opened'], opened)
+        self.assertEqual(counters['unchanged'], unchanged)
+        self.assertEqual(counters['indexed'], 1)
+
+    def test_hit(self):
+        self._check(self._index(), 2, 0)
+        self._check(self._index(), 0, 2)
+
+        manifest = ras2vec.load_manifest(self.manifest)
+        self.assertEqual(sorted(manifest['files']),
+                         sorted([self.raster,
+                                 os.path.join(self.tmpdir, 'notes.txt')]))
+
+    def test_miss(self):
+        self._index()
+        stat = os.stat(self.raster)
+        os.utime(self.raster, (stat.st_atime, stat.st_mtime + 10))
+        self._check(self._index(), 1, 1)
+
+    def test_srs(self):
+        self._index()
+        manifest = ras2vec.load_manifest(self.manifest, 'EPSG:3857')
+        self.assertEqual(manifest['files'], {})
+        self._check(self._index('EPSG:3857'), 2, 0)
+
+
+class IndexTestCase(TempDirTestCase):
+    NRASTERS = 5
+
+    def setUp(self):
+        super(IndexTestCase, self).setUp()
+        # 1x1 degree rasters from (10 + i, 44) to (11 + i, 45)
+        self.rasters = []
+        for index in range(self.NRASTERS):
+            filename = os.path.join(self.tmpdir, 'r%d.tif' % index)
+            _createraster(filename, (10. + index, .1, 0., 45., 0., -.1))
+            self.rasters.append(filename)
+        self.dst = os.path.join(self.tmpdir, 'index.gpkg')
+
+    def writeindex(self, batchsize=2):
+        datasource = ras2vec.create_datasource(self.dst)
+        writer = ras2vec.FeatureWriter(datasource, batchsize)
+        ras2vec.compact_index(self.rasters, datasource, writer)
+        writer.close()
+        self.assertEqual(writer._pending, 0)
+
+        # @NOTE: the data source is closed when the writer is released
+        return writer.count
+
+
+class TestFeatureWriter(IndexTestCase):
+    def test_round_trip(self):
+        self.assertEqual(self.writeindex(), self.NRASTERS)
+
+        datasource = ogr.Open(self.dst)
+        layer = datasource.GetLayerByName('index')
+        self.assertEqual(layer.GetFeatureCount(), self.NRASTERS)
+        self.assertEqual(sorted(feature.GetField('Description')
+                                for feature in layer),
+                         sorted(self.rasters))
+
+
+class TestQueryIndex(IndexTestCase):
+    def setUp(self):
+        super(TestQueryIndex, self).setUp()
+        self.writeindex()
+
+    def _query(self, geometry):
+        return sorted(ras2vec.query_index(self.dst, geometry))
+
+    def test_point(self):
+        self.assertEqual(self._query((10.5, 44.5)), self.rasters[:1])
+        self.assertEqual(self._query((0., 0.)), [])
+
+    def test_bbox(self):
+        self.assertEqual(self._query((10.5, 44.5, 12.5, 44.6)),
+                         self.rasters[:3])
+
+    def test_wkt(self):
+        wkt = 'POLYGON ((13.5 44.2,14.5 44.2,14.5 44.8,13.5 44.8,13.5 44.2))'
+        self.assertEqual(self._query(wkt), self.rasters[3:])
+
+    def test_index(self):
+        index = ras2vec.FootprintIndex(self.dst, 'index')
+        try:
+            self.assertEqual(sorted(index.query((11.5, 44.5))),
+                             self.rasters[1:2])
+            self.assertEqual(sorted(index.query((14.5, 44.5))),
+                             self.rasters[4:])
+        finally:
+            index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+### Copyright (C) 2008-2012 Antonio Valentino <a_valentino@users.sf.net>
+
+### This file is part of GSDView.
+
+### GSDView is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; either version 2 of the License, or
+### (at your option) any later version.
+
+### GSDView is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+
+### You should have received a copy of the GNU General Public License
+### along with GSDView; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA.
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import tempfile
+import unittest
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import numpy as np
+from osgeo import gdal
+from osgeo import gdal_array
+
+# Fix sys path
+from os.path import abspath, dirname
+GSDVIEWROOT = abspath(os.path.join(dirname(__file__), os.pardir, os.pardir))
+sys.path.insert(0, GSDVIEWROOT)
+
+from gsdtools import stats
+
+
+def _createraster(filename, data, nodata=None, blocksize=16):
+    '''Create a tiled GeoTIFF (i.e. with multiple blocks) with *data*.'''
+
+    ysize, xsize = data.shape
+    gdaltype = gdal_array.NumericTypeCodeToGDALTypeCode(data.dtype.type)
+    driver = gdal.GetDriverByName('GTiff')
+    dataset = driver.Create(filename, xsize, ysize, 1, gdaltype,
+                            ['TILED=YES', 'BLOCKXSIZE=%d' % blocksize,
+                             'BLOCKYSIZE=%d' % blocksize])
+    band = dataset.GetRasterBand(1)
+    if nodata is not None:
+        band.SetNoDataValue(nodata)
+    band.WriteArray(data)
+    band = None
+    dataset = None
+
+
+class RasterTestCase(unittest.TestCase):
+    SHAPE = (100, 70)   # not a multiple of the block size
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rng = np.random.RandomState(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def raster(self, data, nodata=None, name='test.tif'):
+        filename = os.path.join(self.tmpdir, name)
+        _createraster(filename, data, nodata)
+        dataset = gdal.Open(filename)
+        self.assertTrue(dataset is not None)
+        return dataset
+
+
+class TestPartialStats(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.data = rng.normal(1000., 5., (64, 48))
+        self.idata = rng.randint(0, 200, (64, 48)).astype('int16')
+
+    def _check(self, partial, values):
+        vmin, vmax, mean, stddev = partial.stats()
+        self.assertEqual(partial.count, values.size)
+        self.assertEqual(vmin, values.min())
+        self.assertEqual(vmax, values.max())
+        self.assertAlmostEqual(mean, np.mean(values), 9)
+        self.assertAlmostEqual(stddev, np.std(values), 9)
+
+    def test_merge(self):
+        shift = np.median(self.data[:8])
+        total = stats.PartialStats(self.data.dtype, shift)
+        for block in np.array_split(self.data, 7):
+            partial = stats.PartialStats(self.data.dtype, shift)
+            partial.update(block)
+            total.merge(partial)
+        self._check(total, self.data)
+
+    def test_merge_empty(self):
+        total = stats.PartialStats(self.data.dtype)
+        total.merge(stats.PartialStats(self.data.dtype))
+        self.assertEqual(total.stats(), (None, None, None, None))
+
+        partial = stats.PartialStats(self.data.dtype)
+        partial.update(self.data)
+        total.merge(partial)
+        total.merge(stats.PartialStats(self.data.dtype))
+        self._check(total, self.data)
+
+    def test_nodata(self):
+        data = self.idata.copy()
+        data[::3, ::5] = -9999
+        total = stats.PartialStats(data.dtype, 100, nodata=-9999)
+        for block in np.array_split(data, 5, axis=1):
+            partial = stats.PartialStats(data.dtype, 100, nodata=-9999)
+            partial.update(block)
+            total.merge(partial)
+        self._check(total, data[data != -9999])
+
+    def test_nan_nodata(self):
+        data = self.data.astype('float32')
+        data[::4] = np.nan
+        total = stats.PartialStats(data.dtype, nodata=float('nan'))
+        total.update(data)
+        self._check(total, data[~np.isnan(data)].astype('float64'))
+
+    def test_histogram(self):
+        data = self.idata.astype('uint8')
+        hrange = (-0.5, 255.5)
+        total = stats.PartialStats(data.dtype, 0, None, hrange, 256)
+        for block in np.array_split(data, 3):
+            partial = stats.PartialStats(data.dtype, 0, None, hrange, 256)
+            partial.update(block)
+            total.merge(partial)
+        self.assertEqual(total.hist.tolist(),
+                         np.bincount(data.ravel(), minlength=256).tolist())
+
+
+class TestNumpyStats(RasterTestCase):
+    def _check(self, result, values):
+        vmin, vmax, mean, stddev = result
+        values = values.astype('float64')
+        self.assertEqual(vmin, values.min())
+        self.assertEqual(vmax, values.max())
+        self.assertAlmostEqual(mean, np.mean(values), 6)
+        self.assertAlmostEqual(stddev, np.std(values), 6)
+
+    def test_float32(self):
+        data = self.rng.normal(500., 20., self.SHAPE).astype('float32')
+        dataset = self.raster(data)
+        for jobs in (1, 4):
+            statistics, histograms = stats.numpystats(dataset, jobs=jobs)
+            self._check(statistics[1], data)
+            self.assertEqual(histograms, {})
+
+    def test_nodata(self):
+        data = self.rng.randint(-1000, 1000, self.SHAPE).astype('int16')
+        data[self.rng.uniform(size=self.SHAPE) < 0.2] = -9999
+        dataset = self.raster(data, nodata=-9999)
+        statistics, histograms = stats.numpystats(dataset, jobs=4)
+        self._check(statistics[1], data[data != -9999])
+
+    def test_nan_nodata(self):
+        data = self.rng.normal(0., 1., self.SHAPE).astype('float32')
+        data[:, ::3] = np.nan
+        dataset = self.raster(data, nodata=float('nan'))
+        statistics, histograms = stats.numpystats(dataset, jobs=4)
+        self._check(statistics[1], data[~np.isnan(data)])
+
+    def test_srcwin(self):
+        data = self.rng.randint(0, 1000, self.SHAPE).astype('uint16')
+        dataset = self.raster(data)
+        srcwin = (5, 7, 40, 60)
+        statistics, histograms = stats.numpystats(dataset, srcwin=srcwin,
+                                                  jobs=4)
+        xoff, yoff, xsize, ysize = srcwin
+        self._check(statistics[1], data[yoff:yoff + ysize, xoff:xoff + xsize])
+
+    def test_byte_histogram(self):
+        data = self.rng.randint(0, 256, self.SHAPE).astype('uint8')
+        dataset = self.raster(data)
+        histreq = stats.HistogramRequest()
+        statistics, histograms = stats.numpystats(dataset, histreq=histreq,
+                                                  jobs=4)
+        hmin, hmax, nbuckets, hist = histograms[1]
+        self.assertEqual((hmin, hmax, nbuckets), (-0.5, 255.5, 256))
+        self.assertEqual(hist,
+                         np.bincount(data.ravel(), minlength=256).tolist())
+
+    def test_compare_gdal(self):
+        data = self.rng.normal(500., 20., self.SHAPE).astype('float32')
+        dataset = self.raster(data)
+        numpyresults = stats.numpystats(dataset, jobs=4)[0][1]
+        gdalresults = stats.gdalstats(dataset)[0][1]
+        self.assertTrue(np.allclose(numpyresults, gdalresults))
+
+
+
+def _percentile(values, q):
+    # @COMPATIBILITY: the "method" parameter requires numpy >= 1.22
+    try:
+        return float(np.percentile(values, q, method='inverted_cdf'))
+    except TypeError:
+        # smallest value such that at least q% of values are lower or equal
+        values = np.sort(values, axis=None)
+        rank = max(int(math.ceil(q / 100. * values.size)), 1)
+        return float(values[rank - 1])
+
+
+class TestPartialSelect(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.data = rng.randint(0, 100, (64, 48)).astype('int16')
+        self.data[::7] = -1
+        self.intervals = [(10, 20, False, None), (0, 99, True, 9)]
+
+    def test_merge(self):
+        total = stats.PartialSelect(self.intervals, nodata=-1)
+        for block in np.array_split(self.data, 5):
+            partial = stats.PartialSelect(self.intervals, nodata=-1)
+            partial.update(block)
+            total.merge(partial)
+
+        values = self.data[self.data != -1]
+        selected = np.sort(np.concatenate(total.results[0]))
+        expected = np.sort(values[(values >= 10) & (values < 20)])
+        self.assertTrue(np.all(selected == expected))
+
+        # the last bucket is closed
+        hist, edges = np.histogram(values, 9, (0, 99))
+        self.assertEqual(total.results[1].tolist(), hist.tolist())
+
+
+class TestNumpyPercentiles(RasterTestCase):
+    PERCENTILES = (0, 0.1, 1, 2, 5, 25, 50, 95, 98, 99, 100)
+
+    def setUp(self):
+        super(TestNumpyPercentiles, self).setUp()
+
+        # force refinement passes on small rasters
+        self._limits = (stats.PERCENTILE_BUCKETS,
+                        stats.PERCENTILE_EXACT_LIMIT)
+        stats.PERCENTILE_BUCKETS = 16
+        stats.PERCENTILE_EXACT_LIMIT = 50
+
+    def tearDown(self):
+        stats.PERCENTILE_BUCKETS, stats.PERCENTILE_EXACT_LIMIT = self._limits
+        super(TestNumpyPercentiles, self).tearDown()
+
+    def _check(self, dataset, values):
+        result = stats.numpypercentiles(dataset, None, self.PERCENTILES,
+                                        jobs=4)[1]
+        self.assertEqual(sorted(result), sorted(self.PERCENTILES))
+        for q in self.PERCENTILES:
+            self.assertEqual(result[q], _percentile(values, q),
+                             'percentile %g' % q)
+
+    def test_float32(self):
+        data = self.rng.normal(500., 20., self.SHAPE).astype('float32')
+        self._check(self.raster(data), data)
+
+    def test_integer_ties(self):
+        data = self.rng.randint(0, 5, self.SHAPE).astype('int16')
+        self._check(self.raster(data), data)
+
+    def test_float_ties(self):
+        data = self.rng.normal(0., 1., self.SHAPE).round(1).astype('float64')
+        self._check(self.raster(data), data)
+
+    def test_constant(self):
+        data = np.ones(self.SHAPE, dtype='uint8')
+        self._check(self.raster(data), data)
+
+    def test_nodata(self):
+        data = self.rng.randint(-1000, 1000, self.SHAPE).astype('int32')
+        data[self.rng.uniform(size=self.SHAPE) < 0.3] = -9999
+        self._check(self.raster(data, nodata=-9999), data[data != -9999])
+
+    def test_nan_nodata(self):
+        data = self.rng.exponential(10., self.SHAPE).astype('float32')
+        data[::2, ::3] = np.nan
+        self._check(self.raster(data, nodata=float('nan')),
+                    data[~np.isnan(data)])
+
+    def test_all_nodata(self):
+        data = np.zeros(self.SHAPE, dtype='int16')
+        result = stats.numpypercentiles(self.raster(data, nodata=0))[1]
+        self.assertEqual(result, dict((q, None) for q in
+                                      stats.DEFAULT_PERCENTILES))
+
+    def test_exact(self):
+        # no refinement
+        stats.PERCENTILE_EXACT_LIMIT = np.prod(self.SHAPE)
+        data = self.rng.normal(500., 20., self.SHAPE).astype('float32')
+        self._check(self.raster(data), data)
+
+
+
+class TestBatch(RasterTestCase):
+    PERCENTILES = (5, 95)
+
+    def setUp(self):
+        super(TestBatch, self).setUp()
+        self.data = self.rng.normal(500., 20., self.SHAPE).astype('float32')
+        self.filename = os.path.join(self.tmpdir, 'test.tif')
+        _createraster(self.filename, self.data)
+
+    def _setmtime(self, filename, delta):
+        mtime = time.time() + delta
+        os.utime(filename, (mtime, mtime))
+
+    def _process(self, **kwargs):
+        return stats.processfile(self.filename, backend='numpy',
+                                 percentiles=self.PERCENTILES, **kwargs)
+
+    def test_skip_uptodate(self):
+        record = self._process()
+        self.assertEqual(record['status'], 'ok')
+        self.assertTrue(os.path.exists(self.filename + '.aux.xml'))
+        self._setmtime(self.filename, -100)
+
+        cached = self._process()
+        self.assertEqual(cached['status'], 'skipped')
+        self.assertEqual(cached['bands'], record['bands'])
+
+    def test_force(self):
+        self._process()
+        self._setmtime(self.filename, -100)
+        self.assertEqual(self._process(force=True)['status'], 'ok')
+
+    def test_modified(self):
+        self._process()
+        self._setmtime(self.filename, 100)
+        self.assertEqual(self._process()['status'], 'ok')
+
+    def test_isuptodate(self):
+        dataset = gdal.Open(self.filename)
+        self.assertFalse(stats.isuptodate(self.filename, dataset, [1]))
+        dataset = None
+
+        self._process()
+        self._setmtime(self.filename, -100)
+
+        dataset = gdal.Open(self.filename)
+        self.assertTrue(stats.isuptodate(self.filename, dataset, [1],
+                                         self.PERCENTILES))
+        # percentiles not computed
+        self.assertFalse(stats.isuptodate(self.filename, dataset, [1],
+                                          (50,)))
+
+    def test_not_cacheable(self):
+        self._process()
+        self._setmtime(self.filename, -100)
+        record = self._process(srcwin=(0, 0, 10, 10))
+        self.assertEqual(record['status'], 'ok')
+
+    def test_batch(self):
+        filenames = [self.filename]
+        for name in ('a.tif', 'b.tif'):
+            filename = os.path.join(self.tmpdir, name)
+            _createraster(filename, self.data)
+            filenames.append(filename)
+        filenames.append(os.path.join(self.tmpdir, 'missing.tif'))
+
+        self._process()
+        self._setmtime(self.filename, -100)
+
+        outfile = StringIO()
+        counters = stats.batch(filenames, outfile, workers=2,
+                               backend='numpy')
+        self.assertEqual(counters, {'ok': 2, 'skipped': 1, 'error': 1})
+
+        records = [json.loads(line)
+                   for line in outfile.getvalue().splitlines()]
+        self.assertEqual(sorted(record['filename'] for record in records),
+                         sorted(filenames))
+        for record in records:
+            if record['status'] == 'ok':
+                band = record['bands'][0]
+                self.assertAlmostEqual(band['mean'],
+                                       np.mean(self.data, dtype='float64'),
+                                       6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -32,6 +32,7 @@ from .. import qt4support
 
 from . import widgets
 from . import helpers
+from . import gdalqt4
 from . import modelitems
 from . import gdalsupport
 from . import gdalexectools
@@ -82,6 +83,9 @@ class GDALBackend(QtCore.QObject):
         self._tools = self._setupExternalTools()
         self._helpers = self._setupHelpers(self._tools)
 
+        #: background loading of tiles likely to become visible
+        self.prefetcher = gdalqt4.TilePrefetcher(app.monitor, self)
+
     def _setupExternalTools(self):
         tools = {}
 
@@ -89,10 +93,6 @@ class GDALBackend(QtCore.QObject):
         handler = gdalexectools.GdalOutputHandler(app.logger, app.statusBar(),
                                                   app.progressbar)
 
-        # gdaladdo
-        tool = gdalexectools.GdalAddOverviewDescriptor(stdout_handler=handler)
-        tools['addo'] = tool
-
         # gdalinfo for statistics computation
         tool = gdalexectools.GdalInfoDescriptor(stdout_handler=handler)
         tool.stats = True
@@ -116,11 +116,10 @@ class GDALBackend(QtCore.QObject):
 
         app = self._app
 
-        hmap['addo'] = helpers.AddoHelper(app, tools['addo'])
-        hmap['stats'] = helpers.StatsHelper(app, tools['stats'])
+        hmap['addo'] = helpers.AddoHelper(app)
         hmap['statsdialog'] = helpers.StatsDialogHelper(app, tools['stats'])
         hmap['histdialog'] = helpers.HistDialogHelper(app, tools['hist'])
-        hmap['ovrdialog'] = helpers.AddoDialogHelper(app, tools['addo'])
+        hmap['ovrdialog'] = helpers.AddoDialogHelper(app)
 
         return hmap
 
@@ -592,12 +591,10 @@ class GDALBackend(QtCore.QObject):
             return
 
         # only open a new view if there is no other on the item selected
+        # @NOTE: statistics are computed together with overviews (in the
+        #        same pass over data) so there is no need to wait for them
         if len(item.scene.views()) == 0:
-            stats = gdalsupport.GetCachedStatistics(item)
-            if None in stats:
-                self._helpers['stats'].start(item)
-            else:
-                self.newImageView(item)
+            self.newImageView(item)
 
     def newImageView(self, item=None):
         if item is None:
@@ -693,6 +690,11 @@ class GDALBackend(QtCore.QObject):
 
             modelitems.VISIBLE_OVERVIEW_ITEMS = value
             # @TODO: reload all items
+
+            # memory budget (MB) for the cache of rendered tiles
+            value = settings.value('tile_cache_size')
+            if value is not None:
+                gdalqt4.tilecache.maxsize = int(value) * 1024 ** 2
         finally:
             settings.endGroup()
 
@@ -704,6 +706,10 @@ class GDALBackend(QtCore.QObject):
             # show overviews in the treeview
             settings.setValue('visible_overview_items',
                               modelitems.VISIBLE_OVERVIEW_ITEMS)
+
+            # memory budget (MB) for the cache of rendered tiles
+            settings.setValue('tile_cache_size',
+                              gdalqt4.tilecache.maxsize // 1024 ** 2)
         finally:
             settings.endGroup()
 
@@ -22,7 +22,12 @@
 '''Helper tools and custom components for binding GDAL and Qt4.'''
 
 
+import copy
+import time
+import weakref
 import logging
+import itertools
+import threading
 
 import numpy as np
 from numpy import ma
@@ -32,8 +37,9 @@ from osgeo.gdal_array import GDALTypeCodeToNumericTypeCode
 
 from qt import QtCore, QtGui
 
+from .. import utils
 from .. import imgutils
-from ..qt4support import numpy2qimage
+from ..qt4support import numpy2qimage, bufferpool
 from ..gdalbackend import gdalsupport
 
 
@@ -72,12 +78,472 @@ def safeDataStats(data, nodata=None):
     return stats
 
 
+### Tile cache ################################################################
+#: size (in pixels) of the side of tiles used for rendering
+TILE_SIZE = 256
+
+#: default memory budget (in bytes) for the cache of rendered tiles
+TILE_CACHE_SIZE = 64 * 1024 ** 2
+
+
+class TileCache(utils.LRUCache):
+    '''LRU cache for ready-to-draw image tiles.
+
+    Tiles are QImages indexed by (owner, ovrlevel, tx, ty, stretchkey)
+    tuples where *owner* is the ID of the graphics item the tile
+    belongs to, *ovrlevel* is the overview level (decimation factor) of
+    the tile and (tx, ty) are the tile indices in the overview grid.
+    The *stretchkey* identifies the stretching parameters used to
+    render the tile.
+
+    The cache size is expressed in bytes.
+
+    Pixel buffers of tiles removed from the cache are given back to the
+    shared buffer pool, and re-used for new tiles, as soon as the tile
+    images are no longer referenced.
+
+    '''
+
+    def __init__(self, maxsize=TILE_CACHE_SIZE):
+        super(TileCache, self).__init__(maxsize,
+                                        sizefunc=lambda img: img.byteCount(),
+                                        callback=self._release)
+        self._released = set()
+
+    def _release(self, key, image):
+        # @NOTE: tiles can be removed by the tile loader thread while the
+        #        GUI thread is still drawing an image obtained from the
+        #        cache so the buffer is only re-used when the image is
+        #        garbage collected
+        data = getattr(image, 'ndarray', None)
+        if data is None:
+            return
+
+        released = self._released
+
+        def callback(ref, data=data):
+            released.discard(ref)
+            bufferpool.release(data)
+
+        try:
+            released.add(weakref.ref(image, callback))
+        except TypeError:
+            # no weak reference support: the buffer is not re-used
+            pass
+
+    def invalidate(self, owner):
+        '''Remove all tiles of the specified owner.'''
+
+        self.discard(lambda key: key[0] == owner)
+
+
+#: tile cache shared by all GDAL graphics items
+tilecache = TileCache()
+
+
+#: default memory budget (in bytes) for the cache of raw data blocks
+BLOCK_CACHE_SIZE = 64 * 1024 ** 2
+
+#: maximum ratio between the size of an expanded (block aligned) read
+#: and the size of the requested box
+MAX_BLOCK_EXPANSION = 16
+
+
+class BlockCache(utils.LRUCache):
+    '''LRU cache for raw data read from native GDAL blocks.
+
+    Data are numpy arrays indexed by (owner, levelkey, x0, y0, x1, y1)
+    tuples where *owner* is the ID of the graphics item, *levelkey*
+    identifies the overview level and (x0, y0, x1, y1) is the block
+    aligned box in overview coordinates.
+
+    It is used to avoid decoding the same (compressed) blocks many
+    times when native blocks are larger than tiles (e.g. strips).
+
+    The cache size is expressed in bytes.
+
+    '''
+
+    def __init__(self, maxsize=BLOCK_CACHE_SIZE):
+        super(BlockCache, self).__init__(maxsize,
+                                         sizefunc=lambda data: data.nbytes)
+
+    def invalidate(self, owner):
+        '''Remove all blocks of the specified owner.'''
+
+        self.discard(lambda key: key[0] == owner)
+
+
+#: raw block cache shared by all GDAL graphics items
+blockcache = BlockCache()
+
+_cacheids = itertools.count()
+
+
+### Asynchronous tile loading #################################################
+#: maximum number of tile requests waiting to be processed
+MAX_PENDING_TILES = 256
+
+#: maximum number of tiles requested by a single prefetch
+MAX_PREFETCH_TILES = 64
+
+#: maximum number of pixels read for a single paint
+READ_THRESHOLD = 1600 * 1600
+
+#: resampling algorithm used for decimated reads (requires GDAL >= 2.0)
+DECIMATION_RESAMPLING = getattr(gdal, 'GRIORA_Average', None)
+
+#: percentiles used for the default (auto) stretch
+DEFAULT_PERCENTILES = (2., 98.)
+
+
+class TileLoader(QtCore.QThread):
+    '''Worker thread that reads and renders tiles off the GUI thread.
+
+    Tiles are rendered using a private GDAL handle for each dataset so
+    that GDAL objects owned by the GUI thread are never accessed
+    concurrently.
+    Rendered tiles are stored in the shared tile cache and the
+    :attr:`tileReady` signal is emitted with the graphics item and the
+    (item coordinates) rectangle that needs to be repainted.
+
+    Requests are processed in priority order (lower values first) and,
+    among requests with the same priority, the most recent ones are
+    served first so that tiles that are currently visible are loaded
+    before tiles that have been scrolled away.
+
+    Histograms for the default stretch of items are computed in the
+    worker thread too, before any tile (see :meth:`requestHistogram`),
+    and the :attr:`histogramReady` signal is emitted when done.
+
+    '''
+
+    tileReady = QtCore.Signal(object, QtCore.QRectF)
+    histogramReady = QtCore.Signal(object)
+
+    def __init__(self, parent=None):
+        super(TileLoader, self).__init__(parent)
+        self._condition = threading.Condition()
+        self._requests = {}
+        self._serial = itertools.count()
+        self._stopped = False
+
+        # @NOTE: handles are only accessed in the worker thread
+        self._handles = {}
+        self._stale = set()
+
+        self.tileReady.connect(self._onTileReady)
+        self.histogramReady.connect(self._onHistogramReady)
+
+    @staticmethod
+    def sourceArgs(gdalobj):
+        '''Return (filename, bandnumber) to re-open *gdalobj*.
+
+        None is returned if *gdalobj* cannot be re-opened (e.g.
+        in-memory datasets).
+
+        '''
+
+        try:
+            dataset = gdalobj.GetDataset()
+            bandnumber = gdalobj.GetBand()
+        except AttributeError:
+            dataset = gdalobj
+            bandnumber = None
+
+        if dataset is None:
+            return None
+
+        filename = getattr(dataset, 'vrtfilename', None)
+        if not filename:
+            filename = dataset.GetDescription()
+            driver = dataset.GetDriver()
+            if driver is None or driver.ShortName == 'MEM':
+                return None
+
+        if not filename:
+            return None
+
+        return filename, bandnumber
+
+    def request(self, item, ovrindex, ovrlevel, tx, ty, priority=0,
+                decimation=1):
+        '''Schedule rendering of a tile of *item*.'''
+
+        # @NOTE: the worker thread only uses a snapshot of the stretch
+        #        parameters taken here (in the GUI thread)
+        stretchkey, stretch = item._stretchSnapshot()
+
+        key = (item.cacheid, ovrlevel, tx, ty, stretchkey)
+        with self._condition:
+            if self._stopped:
+                return
+
+            entry = self._requests.get(key)
+            if entry is not None and entry[0][0] <= priority:
+                # already scheduled with higher priority
+                return
+
+            order = (priority, -next(self._serial))
+            self._requests[key] = (order, (item, item.sourceargs, ovrindex,
+                                           ovrlevel, tx, ty, decimation,
+                                           stretchkey, stretch))
+
+            if len(self._requests) > MAX_PENDING_TILES:
+                worst = max(self._requests,
+                            key=lambda k: self._requests[k][0])
+                del self._requests[worst]
+
+            self._condition.notify()
+
+    def requestHistogram(self, item):
+        '''Schedule the computation of the histogram of *item*.
+
+        Histograms are computed before any pending tile.
+
+        '''
+
+        key = (item.cacheid, 'histogram')
+        with self._condition:
+            if self._stopped or key in self._requests:
+                return
+
+            order = (-1, -next(self._serial))
+            self._requests[key] = (order, (item, item.sourceargs,
+                                           item.cacheid))
+            self._condition.notify()
+
+    def cancel(self, item):
+        '''Drop all pending requests of *item*.
+
+        Private GDAL handles associated to *item* are also released so
+        that they are re-opened (and updated) when needed.
+
+        '''
+
+        with self._condition:
+            for key in list(self._requests):
+                if key[0] == item.cacheid:
+                    del self._requests[key]
+            if item.sourceargs is not None:
+                self._stale.add(item.sourceargs[0])
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._requests.clear()
+            self._condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._requests and not self._stopped:
+                    self._condition.wait()
+
+                if self._stopped:
+                    break
+
+                key = min(self._requests, key=lambda k: self._requests[k][0])
+                order, request = self._requests.pop(key)
+
+                stale = self._stale
+                self._stale = set()
+
+            for filename in stale:
+                self._handles.pop(filename, None)
+
+            try:
+                if key[1] == 'histogram':
+                    self._loadHistogram(*request)
+                else:
+                    self._load(*request)
+            except Exception as e:
+                logging.warning('unable to load tile %s: %s' % (key, e))
+
+        self._handles.clear()
+
+    def _handle(self, sourceargs):
+        filename, bandnumber = sourceargs
+        dataset = self._handles.get(filename)
+        if dataset is None:
+            dataset = gdal.Open(filename)
+            if dataset is None:
+                raise IOError('unable to open "%s"' % filename)
+            self._handles[filename] = dataset
+
+        if bandnumber is None:
+            return dataset
+        else:
+            return dataset.GetRasterBand(bandnumber)
+
+    def _load(self, item, sourceargs, ovrindex, ovrlevel, tx, ty,
+              decimation, stretchkey, stretch):
+        cacheid = item.cacheid
+        gdalobj = self._handle(sourceargs)
+        ovrband = item._levelBand(gdalobj, ovrindex, decimation)
+        x, y, w, h = item._tileRect(ovrband, tx, ty)
+
+        image = item._renderTile(gdalobj, ovrindex, x, y, w, h, decimation,
+                                 stretch)
+
+        # @NOTE: if stretch parameters changed during rendering the tile
+        #        is simply not used (a new one is requested at next paint)
+        tilecache.put((cacheid, ovrlevel, tx, ty, stretchkey), image)
+
+        self.tileReady.emit(item, QtCore.QRectF(
+                                item._targetRect(x, y, w, h, ovrlevel)))
+
+    def _loadHistogram(self, item, sourceargs, cacheid):
+        try:
+            band = item._referenceBand(self._handle(sourceargs))
+            hist = item._computeHistogram(band)
+        except Exception as e:
+            # @NOTE: the failure is recorded anyway (hist is None) so that
+            #        the item falls back to statistics based stretching
+            logging.warning('unable to compute the histogram: %s' % e)
+            hist = None
+
+        item._setHistogram(hist, cacheid)
+        self.histogramReady.emit(item)
+
+    def _onTileReady(self, item, rect):
+        try:
+            if item.scene() is not None:
+                item.update(rect)
+        except RuntimeError:
+            # the underlying C++ object has been deleted
+            pass
+
+    def _onHistogramReady(self, item):
+        try:
+            if item.scene() is not None:
+                item.update()
+        except RuntimeError:
+            # the underlying C++ object has been deleted
+            pass
+
+
+_tileloader = None
+
+
+def tileLoader():
+    '''Return the shared tile loader (None if no application is running).'''
+
+    global _tileloader
+
+    if _tileloader is None:
+        app = QtCore.QCoreApplication.instance()
+        if app is None:
+            return None
+
+        _tileloader = TileLoader(app)
+        app.aboutToQuit.connect(_tileloader.stop)
+        _tileloader.start(QtCore.QThread.LowPriority)
+
+    return _tileloader
+
+
+### Tile prefetching ##########################################################
+class TilePrefetcher(QtCore.QObject):
+    '''Prefetch tiles that are likely to become visible.
+
+    The prefetcher tracks scroll velocity and zoom trend of graphics
+    views and predicts the viewport that will be visible in
+    :attr:`lookahead` seconds.
+    Tiles of GDAL graphics items intersecting the predicted viewport
+    are scheduled for background loading at the current overview
+    level and at the next finer and coarser ones.
+
+    '''
+
+    #: time (in seconds) after which motion history is discarded
+    IDLE_TIME = 0.5
+
+    #: smoothing factor for velocity and zoom rate estimates
+    SMOOTHING = 0.5
+
+    def __init__(self, monitor=None, parent=None, lookahead=0.5, **kwargs):
+        super(TilePrefetcher, self).__init__(parent, **kwargs)
+
+        #: how far in the future (in seconds) the viewport is predicted
+        self.lookahead = lookahead
+
+        #: view -> (time, center, scale, velocity, zoomrate)
+        self._history = {}
+
+        if monitor is not None:
+            monitor.scrolled.connect(self.onViewChanged)
+            monitor.resized.connect(self.onViewChanged)
+
+    @staticmethod
+    def _viewState(graphicsview):
+        viewport = graphicsview.viewport().rect()
+        rect = graphicsview.mapToScene(viewport).boundingRect()
+        scale = BaseGdalGraphicsItem._levelOfDetailFromTransform(
+                                                graphicsview.transform())
+        return rect, scale
+
+    def predictedRect(self, graphicsview):
+        '''Return the predicted viewport (scene coordinates).'''
+
+        rect, scale = self._viewState(graphicsview)
+        now = time.time()
+        center = rect.center()
+
+        velocity = QtCore.QPointF(0, 0)
+        zoomrate = 0.
+        last = self._history.get(graphicsview)
+        if last is not None:
+            t0, center0, scale0, velocity0, zoomrate0 = last
+            dt = now - t0
+            if 0 < dt < self.IDLE_TIME and scale0 > 0 and scale > 0:
+                alpha = self.SMOOTHING
+                velocity = (center - center0) * (alpha / dt) + \
+                                                    velocity0 * (1 - alpha)
+                zoomrate = np.log(scale / scale0) * (alpha / dt) + \
+                                                    zoomrate0 * (1 - alpha)
+
+        # discard history of idle (or destroyed) views
+        for view in list(self._history):
+            if now - self._history[view][0] > self.IDLE_TIME:
+                del self._history[view]
+        self._history[graphicsview] = (now, center, scale, velocity, zoomrate)
+
+        # zooming in (zoomrate > 0) shrinks the visible scene area
+        factor = np.exp(-zoomrate * self.lookahead)
+        width = rect.width() * factor
+        height = rect.height() * factor
+        center = center + velocity * self.lookahead
+
+        predicted = QtCore.QRectF(0, 0, width, height)
+        predicted.moveCenter(center)
+
+        return predicted, scale * np.exp(zoomrate * self.lookahead), zoomrate
+
+    @QtCore.Slot(QtGui.QGraphicsView)
+    @QtCore.Slot(QtGui.QGraphicsView, QtCore.QSize)
+    def onViewChanged(self, graphicsview, size=None):
+        scene = graphicsview.scene()
+        if scene is None:
+            return
+
+        rect, levelOfDetail, zoomrate = self.predictedRect(graphicsview)
+        for item in scene.items(rect):
+            if isinstance(item, BaseGdalGraphicsItem):
+                itemrect = item.mapRectFromScene(rect)
+                item.prefetch(itemrect, levelOfDetail, zoomin=(zoomrate > 0))
+
+
 # @TODO: move GraphicsView here
 
 
 class BaseGdalGraphicsItem(QtGui.QGraphicsItem):
     Type = QtGui.QStandardItem.UserType + 1
 
+    #: resampling algorithm used for decimated reads
+    resampling = DECIMATION_RESAMPLING
+
     def __init__(self, gdalobj, parent=None, scene=None, **kwargs):
         super(BaseGdalGraphicsItem, self).__init__(parent, scene, **kwargs)
 
@@ -103,10 +569,21 @@ class BaseGdalGraphicsItem(QtGui.QGraphicsItem):
         self._boundingRect = QtCore.QRectF(0, 0, w, h)
         #self.read_threshold = 1600*1200
 
+        #: ID used to identify tiles of the item in the tile cache
+        self.cacheid = next(_cacheids)
+
+        #: arguments for re-opening gdalobj in the tile loader thread
+        self.sourceargs = TileLoader.sourceArgs(gdalobj)
+
+        self._histogram = None
+        self._histogramComputed = False
+        self._histogramlock = threading.Lock()
+
         self.stretch = imgutils.LinearStretcher()
         # @TODO: use lazy gaphicsitem inirialization
         # @TODO: initilize stretching explicitly
         self._stretch_initialized = False
+        self._stretch_snapshot = None
 
     def type(self):
         return self.Type
@@ -140,6 +617,419 @@ class BaseGdalGraphicsItem(QtGui.QGraphicsItem):
                             w * ovrlevel,
                             h * ovrlevel)
 
+    ### Tiles handling ########################################################
+    @staticmethod
+    def _tileSize(ovrband):
+        '''Return the tile size for *ovrband*.
+
+        Tile sides are multiple of the native block size, if blocks are
+        smaller than TILE_SIZE, so that reads never straddle block
+        boundaries.
+
+        '''
+
+        def align(blocksize):
+            if blocksize >= TILE_SIZE:
+                # blocks larger than tiles are handled by the block cache
+                return TILE_SIZE
+            return max(1, int(round(TILE_SIZE / float(blocksize)))) * blocksize
+
+        bw, bh = ovrband.GetBlockSize()
+        return align(bw), align(bh)
+
+    def _blockRead(self, read, ovrband, levelkey, x, y, w, h, out=None):
+        '''Read a box of data expanding it to native block boundaries.
+
+        The *read* callable is used to actually read the block aligned
+        box: it is called as read(x, y, w, h, out) and it is expected
+        to store data into the *out* array if it is not None.
+        Expanded boxes are stored in the block cache so that following
+        reads from the same blocks do not need to decode them again.
+
+        '''
+
+        bw, bh = ovrband.GetBlockSize()
+        x0 = x // bw * bw
+        y0 = y // bh * bh
+        x1 = min((x + w + bw - 1) // bw * bw, ovrband.XSize)
+        y1 = min((y + h + bh - 1) // bh * bh, ovrband.YSize)
+
+        if (x0, y0, x1, y1) == (x, y, x + w, y + h):
+            return read(x, y, w, h, out)
+
+        if (x1 - x0) * (y1 - y0) > MAX_BLOCK_EXPANSION * w * h:
+            # @NOTE: huge blocks (e.g. untiled single block images):
+            #        rely on the GDAL block cache
+            return read(x, y, w, h, out)
+
+        key = (self.cacheid, levelkey, x0, y0, x1, y1)
+        data = blockcache.get(key)
+        if data is None:
+            data = read(x0, y0, x1 - x0, y1 - y0)
+            blockcache.put(key, data)
+
+        # @NOTE: stretchers can modify data in place so cached blocks are
+        #        never returned directly
+        data = data[y - y0:y - y0 + h, x - x0:x - x0 + w]
+        if out is None:
+            return data.copy()
+        out[...] = data
+        return out
+
+    def _tiles(self, ovrband, rect, ovrlevel):
+        '''Return indices of tiles intersecting *rect* (item coordinates).'''
+
+        tw, th = self._tileSize(ovrband)
+        x, y, w, h = self._clipRect(ovrband, rect, ovrlevel)
+        xlast = min(x + w, ovrband.XSize) - 1
+        ylast = min(y + h, ovrband.YSize) - 1
+
+        return [(tx, ty) for ty in range(y // th, ylast // th + 1)
+                                    for tx in range(x // tw, xlast // tw + 1)]
+
+    def _tileRect(self, ovrband, tx, ty):
+        '''Return the tile box in overview coordinates.'''
+
+        tw, th = self._tileSize(ovrband)
+        x = tx * tw
+        y = ty * th
+        w = min(tw, ovrband.XSize - x)
+        h = min(th, ovrband.YSize - y)
+
+        return x, y, w, h
+
+    def _stretchKey(self):
+        stretch = self.stretch
+        if stretch is None:
+            return None
+
+        return (stretch.stretchtype, tuple(stretch.range), stretch.min,
+                stretch.max, str(stretch.dtype),
+                getattr(stretch, 'curve', None))
+
+    def _initStretch(self, loader=None):
+        '''Set the default stretch if not initialized (GUI thread only).
+
+        If the histogram is needed for the default stretch (see
+        :meth:`setDefaultStretch`) and a tile *loader* is provided the
+        histogram is computed in the loader thread: False is returned
+        until it is available (the item is updated when ready).
+
+        '''
+
+        if self.stretch is None or self._stretch_initialized:
+            return True
+
+        band = self._referenceBand()
+        if loader is not None and self._cachedPercentiles(band) is None:
+            with self._histogramlock:
+                computed = self._histogramComputed
+            if not computed:
+                loader.requestHistogram(self)
+                return False
+
+        self.setDefaultStretch(band)
+        return True
+
+    def _stretchSnapshot(self):
+        '''Return a (stretchkey, stretch) pair for rendering in background.
+
+        The stretch is a private copy of the current one so that it
+        can be safely used in the tile loader thread while the item
+        stretch is modified in the GUI thread.
+
+        '''
+
+        stretchkey = self._stretchKey()
+        snapshot = self._stretch_snapshot
+        if snapshot is None or snapshot[0] != stretchkey:
+            snapshot = (stretchkey, copy.deepcopy(self.stretch))
+            self._stretch_snapshot = snapshot
+        return snapshot
+
+    def _referenceBand(self, gdalobj=None):
+        if gdalobj is None:
+            gdalobj = self.gdalobj
+        return gdalobj
+
+    def _levelBand(self, gdalobj, ovrindex, decimation=1):
+        '''Return the (possibly decimated) band of the specified level.'''
+
+        band = self._referenceBand(gdalobj)
+        if ovrindex is not None:
+            band = band.GetOverview(ovrindex)
+        if decimation > 1:
+            band = gdalsupport.DecimatedBand(band, decimation,
+                                             self.resampling)
+        return band
+
+    def _levels(self):
+        '''Return the list of available (ovrlevel, ovrindex) pairs.
+
+        The list is sorted by ovrlevel and always includes the full
+        resolution level (1, None).
+
+        '''
+
+        band = self._referenceBand()
+        levels = [(1, None)]
+        levels.extend(sorted(zip(gdalsupport.ovrLevels(band),
+                                 range(band.GetOverviewCount()))))
+        return levels
+
+    def _readLevel(self, levelOfDetail, rect=None):
+        '''Return the level to be used for reading data.
+
+        Return a (ovrband, ovrlevel, ovrindex, decimation) tuple.
+        If no overview is close enough to the requested level of
+        detail data are read from the best available overview (or
+        from the full resolution band) using a power of 2 *decimation*
+        factor.
+        The decimation factor is also increased as needed to keep the
+        number of pixels to be read for the *rect* area (item
+        coordinates) below READ_THRESHOLD.
+
+        '''
+
+        ovrband, ovrlevel, ovrindex = self._bestOvrLevel(
+                                        self._referenceBand(), levelOfDetail)
+
+        if levelOfDetail <= 0:
+            reqlevel = 1.
+        else:
+            reqlevel = 1. / levelOfDetail
+
+        decimation = 1
+        while ovrlevel * decimation * 2 <= reqlevel:
+            decimation *= 2
+
+        # hard cap on the number of pixels read per paint
+        if rect is not None:
+            npixels = rect.width() * rect.height()
+            while npixels > READ_THRESHOLD * (ovrlevel * decimation) ** 2:
+                decimation *= 2
+
+        if decimation > 1:
+            ovrband = gdalsupport.DecimatedBand(ovrband, decimation,
+                                                self.resampling)
+
+        return ovrband, ovrlevel * decimation, ovrindex, decimation
+
+    def _coarserLevel(self, levels, ovrindex, decimation):
+        '''Return the (ovrindex, decimation) pair of the next coarser level.
+
+        None is returned if the current level already fits a single
+        tile.
+
+        '''
+
+        band = self._levelBand(None, ovrindex, decimation)
+        if max(band.XSize, band.YSize) <= max(self._tileSize(band)):
+            return None
+
+        indices = [index for level, index in levels]
+        pos = indices.index(ovrindex)
+        if decimation == 1 and pos + 1 < len(levels):
+            return indices[pos + 1], 1
+        else:
+            return ovrindex, decimation * 2
+
+    def _finerLevel(self, levels, ovrindex, decimation):
+        '''Return the (ovrindex, decimation) pair of the next finer level.
+
+        None is returned at full resolution.
+
+        '''
+
+        if decimation > 1:
+            return ovrindex, decimation // 2
+
+        indices = [index for level, index in levels]
+        pos = indices.index(ovrindex)
+        if pos > 0:
+            return indices[pos - 1], 1
+        else:
+            return None
+
+    def _readData(self, gdalobj, ovrindex, x, y, w, h, decimation=1):
+        '''Read tile data into a buffer of the shared buffer pool.'''
+
+        ovrband = self._levelBand(gdalobj, ovrindex, decimation)
+        dtype = GDALTypeCodeToNumericTypeCode(ovrband.DataType)
+        out = bufferpool.acquire((h, w), dtype)
+
+        def read(x, y, w, h, out=None):
+            return ovrband.ReadAsArray(x, y, w, h, buf_obj=out)
+
+        return self._blockRead(read, ovrband, (ovrindex, decimation),
+                               x, y, w, h, out)
+
+    def _renderTile(self, gdalobj, ovrindex, x, y, w, h, decimation, stretch):
+        '''Read and render a tile.
+
+        The *gdalobj* argument is the GDAL object data are read from:
+        it can be self.gdalobj or a private copy of it owned by the
+        tile loader thread.
+        The *stretch* argument is the stretcher to be used (the item
+        stretch or a snapshot of it, see :meth:`_stretchSnapshot`).
+
+        '''
+
+        data = self._readData(gdalobj, ovrindex, x, y, w, h, decimation)
+        if stretch is not None:
+            # @NOTE: stretched data are written into an aligned pool buffer
+            #        that is wrapped (not copied) by the QImage and given
+            #        back to the pool when the tile is evicted from the cache
+            out = bufferpool.acquire(data.shape, stretch.dtype or data.dtype)
+            out = stretch(data, out)
+            bufferpool.release(data)
+            data = out
+        return numpy2qimage(data)
+
+    def _paintPlaceholder(self, painter, rect, ovrindex, decimation,
+                          stretchkey):
+        '''Draw the best already cached coarser tiles covering *rect*.
+
+        Return True if *rect* has been fully covered.
+
+        '''
+
+        levels = self._levels()
+        baselevels = dict((index, level) for level, index in levels)
+
+        coarser = self._coarserLevel(levels, ovrindex, decimation)
+        while coarser is not None:
+            ovrindex, decimation = coarser
+            ovrlevel = baselevels[ovrindex] * decimation
+            ovrband = self._levelBand(None, ovrindex, decimation)
+            images = []
+            for tx, ty in self._tiles(ovrband, rect, ovrlevel):
+                key = (self.cacheid, ovrlevel, tx, ty, stretchkey)
+                image = tilecache.get(key)
+                if image is None:
+                    break
+                x, y, w, h = self._tileRect(ovrband, tx, ty)
+                images.append((self._targetRect(x, y, w, h, ovrlevel),
+                               image))
+            else:
+                painter.save()
+                painter.setClipRect(rect, QtCore.Qt.IntersectClip)
+                for target, image in images:
+                    painter.drawImage(target, image)
+                painter.restore()
+                return True
+
+            coarser = self._coarserLevel(levels, ovrindex, decimation)
+
+        return False
+
+    def prefetch(self, rect, levelOfDetail, zoomin=False):
+        '''Schedule background loading of tiles intersecting *rect*.
+
+        Tiles are requested at the level that best fits
+        *levelOfDetail* (high priority) and at the next coarser and
+        finer levels.
+        If *zoomin* is True finer tiles are requested before coarser
+        ones.
+
+        '''
+
+        if self.sourceargs is None:
+            return
+
+        loader = tileLoader()
+        if loader is None or not self._initStretch(loader):
+            return
+
+        rect = rect.intersected(self._boundingRect).toAlignedRect()
+        if rect.isEmpty():
+            return
+
+        levels = self._levels()
+        baselevels = dict((index, level) for level, index in levels)
+
+        ovrband, ovrlevel, ovrindex, decimation = self._readLevel(
+                                                        levelOfDetail, rect)
+        finer, coarser = (3, 2) if not zoomin else (2, 3)
+
+        candidates = [(1, (ovrindex, decimation))]
+        level = self._coarserLevel(levels, ovrindex, decimation)
+        if level is not None:
+            candidates.append((coarser, level))
+        level = self._finerLevel(levels, ovrindex, decimation)
+        if level is not None:
+            candidates.append((finer, level))
+
+        stretchkey = self._stretchKey()
+        count = 0
+        for priority, (ovrindex, decimation) in candidates:
+            ovrlevel = baselevels[ovrindex] * decimation
+            ovrband = self._levelBand(None, ovrindex, decimation)
+
+            for tx, ty in self._tiles(ovrband, rect, ovrlevel):
+                key = (self.cacheid, ovrlevel, tx, ty, stretchkey)
+                if key in tilecache:
+                    continue
+
+                loader.request(self, ovrindex, ovrlevel, tx, ty, priority,
+                               decimation)
+                count += 1
+                if count >= MAX_PREFETCH_TILES:
+                    return
+
+    def clearCache(self):
+        '''Remove all tiles and raw blocks of the item from caches.
+
+        Pending requests in the tile loader are cancelled too and a
+        new cache ID is assigned to the item so that tiles still being
+        rendered in background are never used.
+
+        '''
+
+        if _tileloader is not None:
+            _tileloader.cancel(self)
+        tilecache.invalidate(self.cacheid)
+        blockcache.invalidate(self.cacheid)
+        self.cacheid = next(_cacheids)
+        with self._histogramlock:
+            self._histogram = None
+            self._histogramComputed = False
+
+    def paint(self, painter, option, widget):
+        levelOfDetail = self._levelOfDetail(option, painter)
+        rect = option.exposedRect.toAlignedRect()
+        ovrband, ovrlevel, ovrindex, decimation = self._readLevel(
+                                                        levelOfDetail, rect)
+
+        # @NOTE: tiles are loaded in background only for on-screen
+        #        rendering (widget is None e.g. when printing or exporting)
+        loader = None
+        if widget is not None and self.sourceargs is not None:
+            loader = tileLoader()
+
+        if not self._initStretch(loader):
+            # tiles are painted as soon as the histogram is ready
+            return
+
+        stretchkey = self._stretchKey()
+        for tx, ty in self._tiles(ovrband, rect, ovrlevel):
+            x, y, w, h = self._tileRect(ovrband, tx, ty)
+            key = (self.cacheid, ovrlevel, tx, ty, stretchkey)
+            target = self._targetRect(x, y, w, h, ovrlevel)
+            image = tilecache.get(key)
+            if image is None and loader is not None:
+                loader.request(self, ovrindex, ovrlevel, tx, ty,
+                               decimation=decimation)
+                self._paintPlaceholder(painter, target, ovrindex, decimation,
+                                       stretchkey)
+                continue
+            elif image is None:
+                image = self._renderTile(self.gdalobj, ovrindex, x, y, w, h,
+                                         decimation, self.stretch)
+                tilecache.put(key, image)
+
+            painter.drawImage(target, image)
+
     @staticmethod
     def _levelOfDetailFromTransform(worldTransform):
         # @COMPATIBILITY: since Qt v. 4.6.0 the levelOfDetail attribute of
@@ -198,19 +1088,116 @@ class BaseGdalGraphicsItem(QtGui.QGraphicsItem):
                     band = band.GetOverview(ovrindex)
         return band, ovrlevel, ovrindex
 
+    def _histogramData(self, band):
+        '''Return a data sample for histogram computation.'''
+
+        return gdalsupport.sampleData(band)
+
+    def histogram(self, band=None):
+        '''Return the histogram of the item data.
+
+        The histogram is computed only once, from the coarsest suitable
+        overview or from a strided sample of native blocks (see
+        :func:`gdalsupport.sampleData`), and cached on the item.
+        Return None if the histogram can't be computed (e.g. no valid
+        data in the sample).
+
+        '''
+
+        with self._histogramlock:
+            if not self._histogramComputed:
+                if band is None:
+                    band = self._referenceBand()
+                self._histogram = self._computeHistogram(band)
+                self._histogramComputed = True
+            return self._histogram
+
+    def _computeHistogram(self, band):
+        data = self._histogramData(band)
+        return imgutils.Histogram.fromdata(data, nodata=band.GetNoDataValue())
+
+    def _setHistogram(self, hist, cacheid):
+        # store a histogram computed in background for *cacheid*
+        with self._histogramlock:
+            # @NOTE: the histogram is discarded if the cache has been
+            #        cleared in the meanwhile (see clearCache)
+            if cacheid == self.cacheid and not self._histogramComputed:
+                self._histogram = hist
+                self._histogramComputed = True
+
+    def setAutoStretch(self, method='percentile', band=None, **kwargs):
+        '''Set stretching parameters from the data histogram.
+
+        Available methods are:
+
+        :percentile: clip data at *lower* and *upper* percentiles
+                     (default: 2 and 98)
+        :sigma: clip data at mean +/- *nsigma* standard deviations
+                (default: 3)
+        :equalize: histogram equalization of data between *lower* and
+                   *upper* percentiles (default: 0 and 100). Only
+                   available for items using a LUT stretcher
+
+        Return False if the histogram is not available.
+
+        '''
+
+        hist = self.histogram(band)
+        if hist is None:
+            return False
+
+        curve = 'linear'
+        if method == 'percentile':
+            lower, upper = hist.percentile_range(
+                                kwargs.get('lower', DEFAULT_PERCENTILES[0]),
+                                kwargs.get('upper', DEFAULT_PERCENTILES[1]))
+        elif method == 'sigma':
+            lower, upper = hist.sigma_range(kwargs.get('nsigma', 3))
+        elif method == 'equalize':
+            if not hasattr(self.stretch, 'curve'):
+                raise ValueError('equalization is not supported by "%s" '
+                                 'stretchers' % self.stretch.stretchtype)
+            lower, upper = hist.percentile_range(kwargs.get('lower', 0),
+                                                 kwargs.get('upper', 100))
+            curve = hist.equalization(lower, upper)
+        else:
+            raise ValueError('invalid auto-stretch method: "%s"' % method)
+
+        if hasattr(self.stretch, 'curve'):
+            self.stretch.curve = curve
+        self.stretch.set_range(lower, upper)
+        self._stretch_initialized = True
+
+        return True
+
     @staticmethod
-    def _defaultStretch(band, data=None, nsigma=5):
-        # @NOTE: statistics computation is potentially slow so first check
-        #        if fast statistics retriewing is possible
+    def _cachedPercentiles(band):
+        # pre-computed exact percentiles (e.g. by gsdtools.stats)
+        if band:
+            values = gdalsupport.GetCachedPercentiles(band,
+                                                      DEFAULT_PERCENTILES)
+            if values is not None and values[0] < values[1]:
+                return tuple(values)
+        return None
+
+    def _defaultStretch(self, band, nsigma=5):
+        values = self._cachedPercentiles(band)
+        if values is not None:
+            return values
+
+        # @NOTE: the histogram is computed from a small data sample so it
+        #        is cheap and independent from the tile painted first
+        hist = self.histogram(band)
+        if hist is not None:
+            lower, upper = hist.percentile_range(*DEFAULT_PERCENTILES)
+            if lower < upper:
+                return lower, upper
 
         stats = (None, None, None, None)
 
         if band and gdalsupport.hasFastStats(band):
             stats = gdalsupport.SafeGetStatistics(band, True, True)
 
-        if None in stats and data is not None and data.size <= 4 * 1024 ** 2:
-            stats = safeDataStats(data, band.GetNoDataValue())
-
         if None in stats:
             if band and band.DataType == gdal.GDT_Byte:
                 return 0, 255
@@ -219,13 +1206,15 @@ class BaseGdalGraphicsItem(QtGui.QGraphicsItem):
 
         vmin, vmax, mean, stddev = stats
 
-        lower = max(mean - nsigma * stddev, 0)
+        lower = max(mean - nsigma * stddev, vmin)
         upper = min(mean + nsigma * stddev, vmax)
 
         return lower, upper
 
-    def setDefaultStretch(self, data=None):
-        lower, upper = self._defaultStretch(self.gdalobj, data)
+    def setDefaultStretch(self, band=None):
+        if band is None:
+            band = self._referenceBand()
+        lower, upper = self._defaultStretch(band)
 
         if None in (lower, upper) or (lower == upper):
             self._stretch_initialized = False
@@ -270,9 +1259,10 @@ class BaseGdalGraphicsItem(QtGui.QGraphicsItem):
 
 
 class UIntGdalGraphicsItem(BaseGdalGraphicsItem):
-    '''GDAL graphics item specialized for 8 and 16 it unsigned integers.
+    '''GDAL graphics item specialized for 8 and 16 bit integers.
 
-    Uses an unchecked LUT for transformations.
+    Uses a LUT, directly indexed by samples, for transformations.
+    Signed 16 bit integers are supported too.
 
     '''
 
@@ -283,7 +1273,8 @@ class UIntGdalGraphicsItem(BaseGdalGraphicsItem):
                                                    **kwargs)
 
         # @TODO: maybe it is batter to use a custo mexception: ItemTypeError
-        if band.DataType not in (gdal.GDT_Byte, gdal.GDT_UInt16):
+        if band.DataType not in (gdal.GDT_Byte, gdal.GDT_UInt16,
+                                 gdal.GDT_Int16):
             typename = gdal.GetDataTypeName(band.DataType)
             raise ValueError('invalid data type: "%s"' % typename)
 
@@ -294,32 +1285,6 @@ class UIntGdalGraphicsItem(BaseGdalGraphicsItem):
     def dataRange(self, data=None):
         return self._dataRange(self.gdalobj, data)
 
-    def paint(self, painter, option, widget):
-        levelOfDetail = self._levelOfDetail(option, painter)
-        ovrband, ovrlevel, ovrindex = self._bestOvrLevel(self.gdalobj,
-                                                         levelOfDetail)
-        x, y, w, h = self._clipRect(ovrband,
-                                    option.exposedRect.toAlignedRect(),
-                                    ovrlevel)
-
-        # @TODO: threshold check
-        # @WARNING: option.levelOfDetail is no more usable
-        #threshold = 1600*1600
-        #if w * h > threshold:
-        #    newoption = QtGui.QStyleOptionGraphicsItem(option)
-        #    newoption.levelOfDetail = option.levelOfDetail*threshold/(w*h)
-        #    return self.paint(painter, newoption, widget)
-
-        data = ovrband.ReadAsArray(x, y, w, h)
-
-        if not self._stretch_initialized:
-            self.setDefaultStretch(data)
-        data = self.stretch(data)
-        image = numpy2qimage(data)
-
-        rect = self._targetRect(x, y, w, h, ovrlevel)
-        painter.drawImage(rect, image)
-
 
 class GdalGraphicsItem(BaseGdalGraphicsItem):
 
@@ -337,38 +1302,14 @@ class GdalGraphicsItem(BaseGdalGraphicsItem):
     def dataRange(self, data=None):
         return self._dataRange(self.gdalobj, data)
 
-    def paint(self, painter, option, widget):
-        levelOfDetail = self._levelOfDetail(option, painter)
-        ovrband, ovrlevel, ovrindex = self._bestOvrLevel(self.gdalobj,
-                                                         levelOfDetail)
-        x, y, w, h = self._clipRect(ovrband,
-                                    option.exposedRect.toAlignedRect(),
-                                    ovrlevel)
-
-        # @TODO: threshold check
-        # @WARNING: option.levelOfDetail is no more usable
-        #threshold = 1600*1600
-        #if w * h > threshold:
-        #    newoption = QtGui.QStyleOptionGraphicsItem(option)
-        #    newoption.levelOfDetail = (option.levelOfDetail *
-        #                                               threshold / (w * h))
-        #    return self.paint(painter, newoption, widget)
-
-        data = ovrband.ReadAsArray(x, y, w, h)
-
-        if not self._stretch_initialized:
-            self.setDefaultStretch(data)
-        data = self.stretch(data)
-
-        rect = self._targetRect(x, y, w, h, ovrlevel)
-        image = numpy2qimage(data)
-        painter.drawImage(rect, image)
-
 
 class GdalComplexGraphicsItem(GdalGraphicsItem):
 
     Type = GdalGraphicsItem.Type + 1
 
+    # @NOTE: averaging complex samples mixes up phases
+    resampling = None
+
     def __init__(self, band, parent=None, scene=None, **kwargs):
         # @NOTE: skip GdalGraphicsItem __init__
         BaseGdalGraphicsItem.__init__(self, band, parent, scene, **kwargs)
@@ -378,33 +1319,16 @@ class GdalComplexGraphicsItem(GdalGraphicsItem):
             data = np.abs(data)
         return self._dataRange(self.gdalobj, data)
 
-    def paint(self, painter, option, widget):
-        levelOfDetail = self._levelOfDetail(option, painter)
-        ovrband, ovrlevel, ovrindex = self._bestOvrLevel(self.gdalobj,
-                                                         levelOfDetail)
-        x, y, w, h = self._clipRect(ovrband,
-                                    option.exposedRect.toAlignedRect(),
-                                    ovrlevel)
-
-        # @TODO: threshold check
-        #threshold = 1600*1600
-        #if w * h > threshold:
-        #    newoption = QtGui.QStyleOptionGraphicsItem(option)
-        #    newoption.levelOfDetail = (option.levelOfDetail *
-        #                                               threshold / (w * h))
-        #    return self.paint(painter, newoption, widget)
+    def _readData(self, gdalobj, ovrindex, x, y, w, h, decimation=1):
+        data = super(GdalComplexGraphicsItem, self)._readData(
+                                gdalobj, ovrindex, x, y, w, h, decimation)
+        out = bufferpool.acquire(data.shape, data.real.dtype)
+        np.abs(data, out=out)
+        bufferpool.release(data)
+        return out
 
-        data = ovrband.ReadAsArray(x, y, w, h)
-
-        data = np.abs(data)
-        if not self._stretch_initialized:
-            self.setDefaultStretch(data)
-
-        data = self.stretch(data)
-
-        rect = self._targetRect(x, y, w, h, ovrlevel)
-        image = numpy2qimage(data)
-        painter.drawImage(rect, image)
+    def _histogramData(self, band):
+        return np.abs(gdalsupport.sampleData(band))
 
 
 class GdalRgbGraphicsItem(BaseGdalGraphicsItem):
@@ -418,19 +1342,22 @@ class GdalRgbGraphicsItem(BaseGdalGraphicsItem):
                                                   **kwargs)
         self.stretch = None
 
-    def paint(self, painter, option, widget):
-        band = self.gdalobj.GetRasterBand(1)
-        levelOfDetail = self._levelOfDetail(option, painter)
-        ovrband, ovrlevel, ovrindex = self._bestOvrLevel(band, levelOfDetail)
-        x, y, w, h = self._clipRect(ovrband,
-                                    option.exposedRect.toAlignedRect(),
-                                    ovrlevel)
+    def _referenceBand(self, gdalobj=None):
+        if gdalobj is None:
+            gdalobj = self.gdalobj
+        return gdalobj.GetRasterBand(1)
+
+    def _readData(self, gdalobj, ovrindex, x, y, w, h, decimation=1):
+        def read(x, y, w, h, out=None):
+            return gdalsupport.ovrReadBGRA(gdalobj, x, y, w, h, ovrindex,
+                                           decimation=decimation,
+                                           resampling=self.resampling,
+                                           out=out)
 
-        dataset = self.gdalobj
-        data = gdalsupport.ovrRead(dataset, x, y, w, h, ovrindex)
-        rect = self._targetRect(x, y, w, h, ovrlevel)
-        image = numpy2qimage(data)
-        painter.drawImage(rect, image)
+        ovrband = self._levelBand(gdalobj, ovrindex, decimation)
+        out = bufferpool.acquire((h, w, 4), np.uint8)
+        return self._blockRead(read, ovrband, (ovrindex, decimation),
+                               x, y, w, h, out)
 
 
 def graphicsItemFactory(gdalobj, parent=None, scene=None):
@@ -444,7 +1371,8 @@ def graphicsItemFactory(gdalobj, parent=None, scene=None):
     if gdalsupport.isRGB(gdalobj):
         logging.debug('new GdalRgbGraphicsItem')
         return GdalRgbGraphicsItem(gdalobj, parent, scene)
-    elif gdalobj.DataType in (gdal.GDT_Byte, gdal.GDT_UInt16):
+    elif gdalobj.DataType in (gdal.GDT_Byte, gdal.GDT_UInt16,
+                              gdal.GDT_Int16):
         logging.debug('new GdalUIntGraphicsItem')
         return UIntGdalGraphicsItem(gdalobj, parent, scene)
     elif gdal.DataTypeIsComplex(gdalobj.DataType):
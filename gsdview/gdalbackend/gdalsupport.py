@@ -24,11 +24,15 @@
 
 import os
 import logging
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 
 from osgeo import gdal
 from osgeo import osr
+from osgeo.gdal_array import GDALTypeCodeToNumericTypeCode
 
 
 __author__ = 'Antonio Valentino <a_valentino@users.sf.net>'
@@ -396,6 +400,31 @@ def GetCachedStatistics(band):
     return stats
 
 
+PERCENTILE_KEY_TEMPLATE = 'STATISTICS_PERCENTILE_%g'
+
+
+def GetCachedPercentiles(band, percentiles):
+    '''Retrieve cached percentiles from a raster band.
+
+    Percentiles can be pre-computed by the gsdtools.stats tool that
+    stores them in the STATISTICS_PERCENTILE_<percentile> metadata items.
+
+    Return the list of requested percentile values or None if any of
+    them is not available.
+
+    '''
+
+    values = [band.GetMetadataItem(PERCENTILE_KEY_TEMPLATE % q)
+                                                        for q in percentiles]
+    if None in values:
+        return None
+
+    try:
+        return [float(value) for value in values]
+    except ValueError:
+        return None
+
+
 def SafeGetStatistics(band, approx_ok=False, force=True):
     '''Safe replacement of gdal.Band.GetSrtatistics.
 
@@ -488,6 +517,224 @@ def hasFastStats(band, approx_ok=True):
 
     return result
 
+
+#: number of bins of the auto-ranging histogram used by
+#: :class:`StatsAccumulator` for non 8/16 bit integer data
+STATS_HIST_BINS = 4096
+
+
+class StatsAccumulator(object):
+    '''Single pass statistics and histogram of raster data.
+
+    Data are fed block by block using the :meth:`update` method.
+    Mean and variance of each block are merged into the running ones
+    using the parallel formulation (Chan et al.) of Welford's algorithm
+    so that results are numerically stable.
+
+    Samples equal to *nodata*, NaNs and infinite values are ignored.
+
+    The histogram of 8 and 16 bit integer data is exact.  For other
+    data types a fixed number of bins is used whose range is doubled
+    (merging pairs of adjacent bins) when new data fall out of it.
+
+    '''
+
+    def __init__(self, dtype, nodata=None, nbins=STATS_HIST_BINS):
+        self.dtype = np.dtype(dtype)
+        self.nodata = nodata
+        self.nbins = nbins
+
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.vmin = None
+        self.vmax = None
+
+        if self.dtype.kind in 'iu' and self.dtype.itemsize <= 2:
+            # exact histogram
+            info = np.iinfo(self.dtype)
+            self._offset = -int(info.min)
+            self._counts = np.zeros(int(info.max) + self._offset + 1,
+                                    dtype='int64')
+            self._exact = True
+        else:
+            self._counts = np.zeros(nbins, dtype='int64')
+            self._exact = False
+            self._lo = None
+            self._width = None
+
+    def _valid(self, data):
+        data = np.ravel(data)
+        if np.iscomplexobj(data):
+            data = np.abs(data)
+        if self.nodata is not None:
+            if np.isnan(self.nodata):
+                data = data[~np.isnan(data)]
+            else:
+                data = data[data != self.nodata]
+        if data.dtype.kind in 'fc':
+            data = data[np.isfinite(data)]
+        return data
+
+    def update(self, data):
+        data = self._valid(data)
+        n = data.size
+        if n == 0:
+            return
+
+        vmin, vmax = data.min(), data.max()
+        mean = data.mean(dtype='float64')
+        m2 = np.square(data - mean, dtype='float64').sum()
+
+        # Chan et al. parallel update
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / float(total)
+        self.m2 += m2 + delta ** 2 * self.count * n / float(total)
+        self.count = total
+
+        if self.vmin is None:
+            self.vmin, self.vmax = vmin, vmax
+        else:
+            self.vmin = min(self.vmin, vmin)
+            self.vmax = max(self.vmax, vmax)
+
+        if self._exact:
+            counts = np.bincount(data.astype('int64') + self._offset)
+            self._counts[:len(counts)] += counts
+        else:
+            self._updateHistogram(data, float(vmin), float(vmax))
+
+    def _updateHistogram(self, data, vmin, vmax):
+        nbins = self.nbins
+        if self._lo is None:
+            self._lo = vmin
+            self._width = ((vmax - vmin) or 1.) / nbins
+
+        # grow the range merging pairs of adjacent bins
+        while vmin < self._lo or vmax >= self._lo + nbins * self._width:
+            counts = self._counts.reshape(-1, 2).sum(axis=1)
+            self._counts[:] = 0
+            if vmin < self._lo:
+                self._counts[nbins // 2:] = counts
+                self._lo -= nbins * self._width
+            else:
+                self._counts[:nbins // 2] = counts
+            self._width *= 2
+
+        indices = ((data - self._lo) / self._width).astype('int64')
+        self._counts += np.bincount(indices.clip(0, nbins - 1),
+                                    minlength=nbins)
+
+    def stats(self):
+        '''Return (min, max, mean, stddev) or four None.'''
+
+        if self.count == 0:
+            return (None, None, None, None)
+
+        stddev = np.sqrt(self.m2 / self.count)
+        return (float(self.vmin), float(self.vmax), float(self.mean),
+                float(stddev))
+
+    def histogram(self, nbuckets=256):
+        '''Return the (hmin, hmax, counts) histogram with *nbuckets*.
+
+        The returned histogram covers the [min, max] data range (with
+        a half unit margin for integer data) like GDAL default
+        histograms.
+
+        '''
+
+        if self.count == 0:
+            return None
+
+        if self._exact:
+            values = np.arange(len(self._counts)) - self._offset
+            hmin, hmax = self.vmin - 0.5, self.vmax + 0.5
+            mask = self._counts > 0
+            indices = (values[mask] - hmin) * nbuckets / (hmax - hmin)
+            indices = indices.astype('int64').clip(0, nbuckets - 1)
+            counts = np.bincount(indices, self._counts[mask],
+                                 minlength=nbuckets)
+        else:
+            hmin, hmax = float(self.vmin), float(self.vmax)
+            if hmax == hmin:
+                hmin, hmax = hmin - 0.5, hmax + 0.5
+
+            # linear interpolation of the cumulative distribution
+            edges = self._lo + np.arange(self.nbins + 1) * self._width
+            cdf = np.zeros(self.nbins + 1)
+            np.cumsum(self._counts, out=cdf[1:])
+            cdf = np.interp(np.linspace(hmin, hmax, nbuckets + 1), edges, cdf)
+            cdf[0], cdf[-1] = 0, self.count
+            counts = np.diff(np.round(cdf))
+
+        return float(hmin), float(hmax), [int(c) for c in counts]
+
+
+#: maximum number of pixels read by :func:`sampleData`
+SAMPLE_SIZE = 1024 * 1024
+
+
+def sampleData(band, maxsize=SAMPLE_SIZE):
+    '''Read a representative sample of band data.
+
+    The sample is intended for histogram and statistics estimation and
+    it is read from the largest overview (or the band itself) having
+    at most *maxsize* pixels.
+    If no such overview exists a regular grid of native blocks, with
+    at most *maxsize* pixels overall, is sampled so that only a small
+    fraction of the image has to be read.
+    Images with blocks larger than *maxsize* pixels are read with
+    decimation instead.
+
+    Return a 1D array.
+
+    '''
+
+    candidates = [band.GetOverview(index)
+                                for index in range(band.GetOverviewCount())]
+    candidates.append(band)
+    candidates = [ovrband for ovrband in candidates
+                            if ovrband.XSize * ovrband.YSize <= maxsize]
+    if candidates:
+        ovrband = max(candidates, key=lambda b: b.XSize * b.YSize)
+        return ovrband.ReadAsArray().ravel()
+
+    bxsize, bysize = band.GetBlockSize()
+    if bxsize * bysize > maxsize:
+        # @NOTE: native blocks are too large to be sampled (e.g. a single
+        #        block image): a decimated read is performed so that at
+        #        most *maxsize* pixels are returned
+        factor = np.sqrt(band.XSize * band.YSize / float(maxsize))
+        xsize = max(1, int(band.XSize / factor))
+        ysize = max(1, int(band.YSize / factor))
+        return band.ReadAsArray(0, 0, band.XSize, band.YSize,
+                                xsize, ysize).ravel()
+
+    # strided sample of native blocks
+    nbx = (band.XSize + bxsize - 1) // bxsize
+    nby = (band.YSize + bysize - 1) // bysize
+    factor = band.XSize * band.YSize / float(maxsize)
+    if nbx == 1:
+        xstride, ystride = 1, int(np.ceil(factor))
+    elif nby == 1:
+        xstride, ystride = int(np.ceil(factor)), 1
+    else:
+        xstride = ystride = int(np.ceil(np.sqrt(factor)))
+
+    samples = []
+    for by in range(min(ystride // 2, nby - 1), nby, ystride):
+        y = by * bysize
+        h = min(bysize, band.YSize - y)
+        for bx in range(min(xstride // 2, nbx - 1), nbx, xstride):
+            x = bx * bxsize
+            w = min(bxsize, band.XSize - x)
+            samples.append(band.ReadAsArray(x, y, w, h).ravel())
+
+    return np.concatenate(samples)
+
+
 ### Color table helpers #####################################################
 colorinterpretations = {
     gdal.GPI_Gray: {
@@ -629,6 +876,7 @@ class CoordinateMapper(object):
         #sref = osr.SpatialReference(projection) # do not work for Pymod API
         sref = osr.SpatialReference()
         sref.ImportFromWkt(projection)
+        self.sref = sref    # spatial reference of the geotransform
 
         if not sref.IsGeographic():
             sref_target = osr.SpatialReference()
@@ -926,8 +1174,131 @@ def ovrComputeLevels(gdalobj, ovrsize=OVRMEMSIE, estep=3, threshold=0.1):
     return missinglevels
 
 
+def bufferedRead(band, x, y, w, h, buf_xsize, buf_ysize, resampling=None,
+                 buf_obj=None):
+    '''Read a box of *band* into a (buf_ysize, buf_xsize) array.
+
+    GDAL resamples data on the fly using overviews, when available.
+    The *resampling* algorithm (one of the gdal.GRIORA_* constants)
+    is only used with GDAL >= 2.0, otherwise nearest neighbour
+    resampling is performed.
+    If *buf_obj* is provided data are stored into it.
+
+    '''
+
+    if resampling is not None:
+        try:
+            return band.ReadAsArray(x, y, w, h, buf_xsize=buf_xsize,
+                                    buf_ysize=buf_ysize, buf_obj=buf_obj,
+                                    resample_alg=resampling)
+        except TypeError:
+            # @COMPATIBILITY: resample_alg requires GDAL >= 2.0
+            pass
+
+    return band.ReadAsArray(x, y, w, h, buf_xsize=buf_xsize,
+                            buf_ysize=buf_ysize, buf_obj=buf_obj)
+
+
+class DecimatedBand(object):
+    '''Decimated view of a raster band.
+
+    The object behaves like a raster band (or overview) *decimation*
+    times smaller than the original one.
+    Data are read from the original band using GDAL buffered reads
+    so that only the requested number of pixels is transferred.
+
+    '''
+
+    def __init__(self, band, decimation, resampling=None):
+        self._band = band
+        self.decimation = decimation
+        self.resampling = resampling
+        self.XSize = (band.XSize + decimation - 1) // decimation
+        self.YSize = (band.YSize + decimation - 1) // decimation
+
+    def __getattr__(self, name):
+        return getattr(self._band, name)
+
+    def GetBlockSize(self):
+        '''Return the native block size in decimated coordinates.'''
+
+        d = self.decimation
+        return [max(1, size // d) for size in self._band.GetBlockSize()]
+
+    def ReadAsArray(self, xoff=0, yoff=0, win_xsize=None, win_ysize=None,
+                    buf_obj=None):
+        if win_xsize is None:
+            win_xsize = self.XSize - xoff
+        if win_ysize is None:
+            win_ysize = self.YSize - yoff
+
+        band = self._band
+        d = self.decimation
+        x = xoff * d
+        y = yoff * d
+        w = min(win_xsize * d, band.XSize - x)
+        h = min(win_ysize * d, band.YSize - y)
+
+        return bufferedRead(band, x, y, w, h, win_xsize, win_ysize,
+                            self.resampling, buf_obj)
+
+
+def _readBands(dataset, out, x, y, ovrindex, bandlist, decimation=1,
+               resampling=None):
+    '''Read raster bands into the (h, w, len(bandlist)) *out* array.
+
+    The *out* array can be a non contiguous view (e.g. some channels
+    of a larger pixel interleaved buffer): data are read directly into
+    it with no intermediate copy whenever possible.
+
+    '''
+
+    h, w = out.shape[:2]
+
+    if ovrindex is None:
+        # single dataset level read using the buffer strides as spacing
+        d = decimation
+        xsize = min(w * d, dataset.RasterXSize - x * d)
+        ysize = min(h * d, dataset.RasterYSize - y * d)
+        kwargs = {}
+        if d > 1 and resampling is not None:
+            kwargs['resample_alg'] = resampling
+        try:
+            dataset.ReadAsArray(x * d, y * d, xsize, ysize,
+                                buf_obj=out.transpose(2, 0, 1),
+                                buf_xsize=w, buf_ysize=h,
+                                band_list=bandlist, **kwargs)
+            return out
+        except TypeError:
+            # @COMPATIBILITY: Dataset.ReadAsArray of older GDAL Python
+            #                 bindings has no band_list (or buf_obj,
+            #                 resample_alg) keyword argument and raises a
+            #                 TypeError: fall back to band level reads
+            pass
+
+    for channel, bandindex in enumerate(bandlist):
+        band = dataset.GetRasterBand(bandindex)
+        if ovrindex is not None:
+            band = band.GetOverview(ovrindex)
+        if decimation > 1:
+            band = DecimatedBand(band, decimation, resampling)
+        band.ReadAsArray(x, y, w, h, buf_obj=out[..., channel])
+
+    return out
+
+
+def _ovrSize(dataset, ovrindex=None, decimation=1):
+    band = dataset.GetRasterBand(1)
+    if ovrindex is not None:
+        band = band.GetOverview(ovrindex)
+    xsize = (band.XSize + decimation - 1) // decimation
+    ysize = (band.YSize + decimation - 1) // decimation
+    return xsize, ysize
+
+
 def ovrRead(dataset, x=0, y=0, w=None, h=None, ovrindex=None,
-            bstart=1, bcount=None, dtype=None):
+            bstart=1, bcount=None, dtype=None, decimation=1,
+            resampling=None):
     '''Read an image block from overviews of all spacified bands.
 
     This function read a data block from the overview corresponding to
@@ -950,6 +1321,16 @@ def ovrRead(dataset, x=0, y=0, w=None, h=None, ovrindex=None,
         raster band start index (default 1).
     bcount: int or None
         raster band count (defaut all starting from *bstart*)
+    dtype: numpy dtype or None
+        data type of the output array (default: the data type of the
+        first raster band)
+    decimation: int
+        decimation factor (default 1).
+        If greater than 1, *x*, *y*, *w* and *h* are expressed in
+        decimated overview coordinates and data are read using
+        :class:`DecimatedBand`.
+    resampling: int or None
+        resampling algorithm used for decimated reads
 
     Returns:
 
@@ -966,19 +1347,422 @@ def ovrRead(dataset, x=0, y=0, w=None, h=None, ovrindex=None,
     assert bstart > 0
     assert bstart - 1 + bcount <= dataset.RasterCount
 
-    #data = np.zeros((h, w, dataset.RasterCount), np.ubyte)
-    channels = []
-    for bandindex in range(bstart, bstart + bcount):
-        band = dataset.GetRasterBand(bandindex)
-        if ovrindex is not None:
-            band = band.GetOverview(ovrindex)
-        channels.append(band.ReadAsArray(x, y, w, h))
+    xsize, ysize = _ovrSize(dataset, ovrindex, decimation)
+    if w is None:
+        w = xsize - x
+    if h is None:
+        h = ysize - y
+
+    if dtype is None:
+        datatype = dataset.GetRasterBand(bstart).DataType
+        dtype = GDALTypeCodeToNumericTypeCode(datatype)
+
+    data = np.empty((h, w, bcount), dtype)
+    bandlist = list(range(bstart, bstart + bcount))
+
+    return _readBands(dataset, data, x, y, ovrindex, bandlist,
+                      decimation, resampling)
 
-    data = np.dstack(channels)
-    if dtype and dtype != data.dtype:
-        return np.astype(data)
+
+def ovrReadBGRA(dataset, x=0, y=0, w=None, h=None, ovrindex=None,
+                decimation=1, resampling=None, out=None):
+    '''Read an RGB(A) image block into a BGRA pixel interleaved buffer.
+
+    The returned (h, w, 4) uint8 array has the same memory layout of
+    QImage.Format_ARGB32 images (on little endian machines) so it can
+    be wrapped by a QImage without copies.
+    Raster bands are read directly into the channels of the output
+    buffer using a single dataset level request when possible.
+
+    Parameters have the same meaning of :func:`ovrRead`.
+    If *out* is provided it must be a (h, w, 4) uint8 array.
+    If the dataset has no alpha band the alpha channel is set to 255.
+
+    '''
+
+    xsize, ysize = _ovrSize(dataset, ovrindex, decimation)
+    if w is None:
+        w = xsize - x
+    if h is None:
+        h = ysize - y
+
+    if out is None:
+        out = np.empty((h, w, 4), np.uint8)
     else:
-        return data
+        assert out.shape == (h, w, 4) and out.dtype == np.uint8
+
+    if dataset.RasterCount > 3:
+        bandlist = [3, 2, 1, 4]
+        channels = out
+    else:
+        bandlist = [3, 2, 1]
+        channels = out[..., :3]
+        out[..., 3] = 255
+
+    _readBands(dataset, channels, x, y, ovrindex, bandlist,
+               decimation, resampling)
+
+    return out
+
+
+### Overviews computation ####################################################
+#: approximate number of full resolution pixels read at once by the
+#: overview builder (for each band)
+OVR_STRIP_PIXELS = 4 * 1024 ** 2
+
+
+def _blockAverage(data, factor, nodata=None, weights=None):
+    h, w = data.shape
+    yindices = np.arange(0, h, factor)
+    xindices = np.arange(0, w, factor)
+
+    def blocksum(a, dtype):
+        a = np.add.reduceat(a, yindices, axis=0, dtype=dtype)
+        return np.add.reduceat(a, xindices, axis=1)
+
+    if weights is not None:
+        counts = blocksum(weights, 'float64')
+        data = data * weights
+    elif nodata is not None:
+        if np.isnan(nodata):
+            valid = ~np.isnan(data)
+        else:
+            valid = data != nodata
+        counts = blocksum(valid, 'float64')
+        data = np.where(valid, data, 0)
+    else:
+        counts = np.outer(np.diff(np.append(yindices, h)),
+                          np.diff(np.append(xindices, w))).astype('float64')
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if np.iscomplexobj(data):
+            magnitude = blocksum(np.abs(data), 'float64') / counts
+            phase = np.angle(blocksum(data, 'complex128'))
+            result = magnitude * np.exp(1j * phase)
+        else:
+            result = blocksum(data, 'float64') / counts
+
+    if nodata is not None:
+        result[counts == 0] = nodata
+
+    return result, counts
+
+
+def blockAverage(data, factor, nodata=None):
+    '''Average 2D *data* on (factor x factor) blocks.
+
+    Partial blocks at the right and bottom edges are averaged on the
+    available samples.
+    Samples equal to *nodata* are not taken into account and blocks
+    only containing nodata samples are set to *nodata*.
+    Complex data are averaged in magnitude/phase space: the magnitude
+    is the mean of magnitudes and the phase is the one of the mean of
+    complex samples.
+
+    Return a float64 (or complex128) array.
+
+    '''
+
+    return _blockAverage(data, factor, nodata)[0]
+
+
+class _OvrLevelWriter(object):
+    '''Compute and write an overview level from rows of a finer level.
+
+    Rows of the source level are accumulated until complete blocks of
+    *factor* rows are available, then they are averaged and written to
+    *ovrband*.  Averaged rows, and the number of samples each of them
+    has been computed from, are fed to cascaded (coarser) levels so
+    that partial edge blocks are correctly weighted.
+
+    '''
+
+    def __init__(self, ovrband, factor, nodata=None, iolock=None):
+        self.ovrband = ovrband
+        self.factor = factor
+        self.nodata = nodata
+        self.iolock = iolock or threading.Lock()
+        self.children = []
+        self.dtype = np.dtype(
+                        GDALTypeCodeToNumericTypeCode(ovrband.DataType))
+        self._carry = None
+        self._yoff = 0
+
+    def feed(self, rows=None, weights=None, final=False):
+        if self._carry is not None:
+            if rows is None:
+                rows, weights = self._carry
+            else:
+                carry_rows, carry_weights = self._carry
+                rows = np.concatenate((carry_rows, rows))
+                if weights is not None:
+                    weights = np.concatenate((carry_weights, weights))
+            self._carry = None
+
+        out = counts = None
+        if rows is not None:
+            nrows = len(rows)
+            if not final:
+                nrows = (nrows // self.factor) * self.factor
+                if nrows < len(rows):
+                    self._carry = (rows[nrows:],
+                                   None if weights is None
+                                        else weights[nrows:])
+            if nrows:
+                if weights is not None:
+                    weights = weights[:nrows]
+                out, counts = _blockAverage(rows[:nrows], self.factor,
+                                            self.nodata, weights)
+                self._write(out)
+
+        for child in self.children:
+            child.feed(out, counts, final)
+
+    def _write(self, data):
+        ovrband = self.ovrband
+        h = min(len(data), ovrband.YSize - self._yoff)
+        if h <= 0:
+            return
+
+        data = data[:h, :ovrband.XSize]
+        if self.dtype.kind in 'iu':
+            info = np.iinfo(self.dtype)
+            data = np.round(data).clip(info.min, info.max)
+        data = data.astype(self.dtype)
+
+        with self.iolock:
+            ovrband.WriteArray(data, 0, self._yoff)
+        self._yoff += h
+
+
+class OverviewBuilder(object):
+    '''In-process computation of dataset overviews.
+
+    Overviews are computed by numpy block averaging (in magnitude/phase
+    space for complex bands).
+    The full resolution data of each band are read only once, in
+    strips, and all levels are computed from them: when possible
+    coarser levels are cascaded from finer ones.
+
+    Bands are processed in parallel by a pool of worker threads while
+    GDAL I/O calls are serialized.
+
+    Full resolution blocks are also fed to a :class:`StatsAccumulator`
+    for each band so that, at the end of the computation, band
+    statistics and histograms are available in the :attr:`statistics`
+    list without any further read.
+
+    If *strided* is True levels are not averaged but directly computed
+    by decimated (nearest neighbour) reads of the full resolution data,
+    so that only the rows (and, depending on the format, the blocks)
+    needed by each level are read.  It is intended for quick looks of
+    coarse levels to be completed later by properly averaged overviews.
+    In this case statistics are not computed.
+
+    The *callback* function, if provided, is called with the fraction
+    of processed data as argument (possibly from worker threads).
+    The computation can be stopped (from any thread) using the
+    :meth:`cancel` method.
+
+    '''
+
+    def __init__(self, dataset, levels, nthreads=None, callback=None,
+                 strided=False):
+        self.dataset = dataset
+        self.levels = sorted(set(int(level) for level in levels))
+        self.strided = strided
+
+        #: (stats, histogram) pairs for each band (see
+        #: :meth:`StatsAccumulator.stats` and
+        #: :meth:`StatsAccumulator.histogram`)
+        self.statistics = None
+        if nthreads is None:
+            nthreads = min(dataset.RasterCount, multiprocessing.cpu_count())
+        self.nthreads = max(1, nthreads)
+        self.callback = callback
+
+        self._iolock = threading.Lock()
+        self._progresslock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._done = 0
+        self._total = 0
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _progress(self, nrows):
+        with self._progresslock:
+            self._done += nrows
+            fract = self._done / float(self._total)
+        if self.callback:
+            self.callback(fract)
+
+    @staticmethod
+    def _ovrBand(band, level):
+        xsize = (band.XSize + level - 1) // level
+        ysize = (band.YSize + level - 1) // level
+        for index in range(band.GetOverviewCount()):
+            ovrband = band.GetOverview(index)
+            if ovrband.XSize == xsize and ovrband.YSize == ysize:
+                return ovrband
+        raise RuntimeError('overview level %d not found' % level)
+
+    def _writers(self, band):
+        '''Setup the (cascaded) level writers for *band*.'''
+
+        nodata = band.GetNoDataValue()
+
+        # @NOTE: magnitude/phase averages can't be cascaded and nodata
+        #        samples are only handled at the finest level
+        cascade = nodata is None and not gdal.DataTypeIsComplex(band.DataType)
+
+        writers = {}
+        roots = []
+        for level in self.levels:
+            ovrband = self._ovrBand(band, level)
+            parents = [parent for parent in writers if level % parent == 0]
+            if cascade and parents:
+                parent = max(parents)
+                writer = _OvrLevelWriter(ovrband, level // parent, None,
+                                         self._iolock)
+                writers[parent].children.append(writer)
+            else:
+                writer = _OvrLevelWriter(ovrband, level, nodata,
+                                         self._iolock)
+                roots.append(writer)
+            writers[level] = writer
+
+        return roots
+
+    @staticmethod
+    def _stripRows(band):
+        itemsize = gdal.GetDataTypeSize(band.DataType) // 8
+        blockysize = band.GetBlockSize()[1]
+        nrows = max(1, OVR_STRIP_PIXELS // band.XSize)
+        nrows = max(blockysize, nrows // blockysize * blockysize)
+        logging.debug('overviews computation: strip size %d bytes' %
+                                        (nrows * band.XSize * itemsize))
+        return nrows
+
+    def _stridedRead(self, band):
+        '''Decimated read of *band* for each level.
+
+        Return a list of (level, chunks) where chunks is a list of
+        (yoffset, data) strips of the level.
+
+        '''
+
+        # @NOTE: GDAL reads only the rows needed by a downsampled read
+        #        (with nearest neighbour resampling)
+        nrows = self._stripRows(band)
+        results = []
+        for level in self.levels:
+            xsize = (band.XSize + level - 1) // level
+            step = max(level, nrows // level * level)
+            chunks = []
+            for y in range(0, band.YSize, step):
+                if self.cancelled:
+                    return results
+                h = min(step, band.YSize - y)
+                with self._iolock:
+                    data = band.ReadAsArray(0, y, band.XSize, h,
+                                            xsize, (h + level - 1) // level)
+                if data is None:
+                    raise RuntimeError('unable to read data: %s' %
+                                                    gdal.GetLastErrorMsg())
+                chunks.append((y // level, data))
+                self._progress(h / float(len(self.levels)))
+            results.append((level, chunks))
+
+        return results
+
+    def _buildBand(self, band, accumulator=None):
+        roots = self._writers(band)
+        nrows = self._stripRows(band)
+
+        for y in range(0, band.YSize, nrows):
+            if self.cancelled:
+                return
+            h = min(nrows, band.YSize - y)
+            with self._iolock:
+                data = band.ReadAsArray(0, y, band.XSize, h)
+            if data is None:
+                raise RuntimeError('unable to read data: %s' %
+                                                    gdal.GetLastErrorMsg())
+            for writer in roots:
+                writer.feed(data)
+            if accumulator is not None:
+                accumulator.update(data)
+            self._progress(h)
+
+        for writer in roots:
+            writer.feed(final=True)
+
+    def run(self):
+        '''Compute overviews.
+
+        Return False if the computation has been cancelled.
+
+        '''
+
+        dataset = self.dataset
+
+        bands = [dataset.GetRasterBand(index)
+                                for index in range(1, dataset.RasterCount + 1)]
+        self._done = 0
+        self._total = sum(band.YSize for band in bands)
+        self.statistics = None
+
+        if self.strided:
+            # @NOTE: decimated reads are performed before the (empty)
+            #        overviews are created otherwise GDAL would serve
+            #        them from the overviews themselves
+            quicklooks = []
+            for band in bands:
+                quicklooks.append(self._stridedRead(band))
+                if self.cancelled:
+                    return False
+
+        # create (empty) overviews
+        gdal.ErrorReset()
+        if dataset.BuildOverviews('NONE', self.levels) != gdal.CE_None:
+            raise RuntimeError('unable to create overviews: %s' %
+                                                    gdal.GetLastErrorMsg())
+
+        if self.strided:
+            for band, levels in zip(bands, quicklooks):
+                for level, chunks in levels:
+                    ovrband = self._ovrBand(band, level)
+                    for y, data in chunks:
+                        ovrband.WriteArray(data, 0, y)
+        else:
+            accumulators = [
+                StatsAccumulator(GDALTypeCodeToNumericTypeCode(band.DataType),
+                                 band.GetNoDataValue())
+                for band in bands]
+
+            pool = ThreadPool(min(self.nthreads, len(bands)))
+            try:
+                pool.map(lambda args: self._buildBand(*args),
+                         zip(bands, accumulators))
+            finally:
+                pool.close()
+                pool.join()
+
+            if self.cancelled:
+                return False
+
+            self.statistics = [(acc.stats(), acc.histogram())
+                                                    for acc in accumulators]
+
+        with self._iolock:
+            dataset.FlushCache()
+
+        return True
 
 
 ### Misc helpers ##############################################################
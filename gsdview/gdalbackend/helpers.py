@@ -25,11 +25,12 @@
 import os
 import glob
 import shutil
+import logging
 import tempfile
 
 from osgeo import gdal
 
-from qt import QtGui
+from qt import QtCore, QtGui
 
 from ..gdalbackend import modelitems
 from ..gdalbackend import gdalsupport
@@ -144,16 +145,27 @@ class GdalHelper(object):
                                                 self.progressdialog.setValue)
             self.progressdialog.canceled.disconnect(self.controller.stop_tool)
 
+    def isbusy(self):
+        # @NOTE: the in-process overview builder and the subprocess
+        #        controller are shared by all helpers
+        builder = _overviewbuilder
+        if builder is not None and builder.isRunning():
+            return True
+        return self.controller.isbusy
+
+    def userstop(self):
+        return self.controller.userstop
+
     def do_start(self, *args, **kwargs):
         raise NotImplementedError(self.__class__.__name__ + '.do_start')
 
     def start(self, *args, **kwargs):
-        if self.controller.isbusy:
+        if self.isbusy():
             self.logger.warning('unable to perform overview computation: '
                                 'the subprocess controller is currently '
                                 'busy.')
             return
-        else:
+        elif self.tool is not None:
             self.logger.debug('run the "%s" subprocess.' %
                                     os.path.basename(self.tool.executable))
 
@@ -195,7 +207,7 @@ class GdalHelper(object):
             self._disconnect_signals()
 
             # only call do_finalize if processing finished successfully
-            if returncode == 0 and not self.controller.userstop:
+            if returncode == 0 and not self.userstop():
                 self.do_finalize()
             else:
                 self.do_finalize_on_error()
@@ -204,38 +216,128 @@ class GdalHelper(object):
             self._reset_progress()
 
 
-class AddoHelper(GdalHelper):
-    '''Helper class for gdaladdo execution on live datasets.
+class OverviewBuilderThread(QtCore.QThread):
+    '''Thread running the in-process overview builder.
+
+    .. seealso:: :class:`gdalsupport.OverviewBuilder`
+
+    '''
+
+    #: progress of the computation (fraction of processed data)
+    progressChanged = QtCore.Signal(float)
+
+    #: emitted at the end of the computation with the return code
+    #: (0 on success or if stopped by the user)
+    done = QtCore.Signal(int)
+
+    def __init__(self, parent=None):
+        super(OverviewBuilderThread, self).__init__(parent)
+        self.filename = None
+        self.levels = []
+        self.strided = False
+        self.userstop = False
+        self._builder = None
+
+        #: statistics and histograms computed by the last run
+        #: (see :attr:`gdalsupport.OverviewBuilder.statistics`)
+        self.statistics = None
+
+    def setup(self, filename, levels, strided=False):
+        self.filename = filename
+        self.levels = levels
+        self.strided = strided
+        self.userstop = False
+        self.statistics = None
+
+    @QtCore.Slot()
+    def stop(self):
+        if not self.isRunning():
+            return
+        self.userstop = True
+        builder = self._builder
+        if builder is not None:
+            builder.cancel()
+
+    @QtCore.Slot()
+    def shutdown(self):
+        self.stop()
+        self.wait()
+
+    def run(self):
+        returncode = 0
+        dataset = None
+        try:
+            dataset = gdal.Open(self.filename)
+            if dataset is None:
+                raise RuntimeError('unable to open "%s": %s' % (
+                                self.filename, gdal.GetLastErrorMsg()))
+
+            builder = gdalsupport.OverviewBuilder(
+                                dataset, self.levels,
+                                callback=self.progressChanged.emit,
+                                strided=self.strided)
+            self._builder = builder
+            if self.userstop:
+                builder.cancel()
+            if builder.run():
+                self.statistics = builder.statistics
+        except Exception as e:
+            logging.error('overviews computation failed: %s' % e,
+                          exc_info=True)
+            returncode = 1
+        finally:
+            self._builder = None
+            # @NOTE: close the dataset (and ovr files) before finalization
+            del dataset
+
+        self.done.emit(returncode)
+
+
+_overviewbuilder = None
+
+
+def overviewBuilder(app):
+    '''Return the overview builder thread shared by all helpers.'''
 
-    In GSDView an external process running the gdaladdo is used to add
-    oveviews to (virtual) dataset that are already open in GSDView
-    itself.
+    global _overviewbuilder
 
-    Unfortunately, as far as I know, there is no way to safely handle
-    two dataset objects (pointing at the same vrt file) in two different
-    processes.
+    if _overviewbuilder is None:
+        _overviewbuilder = OverviewBuilderThread(app)
+        _overviewbuilder.done.connect(app.processingDone)
+        QtCore.QCoreApplication.instance().aboutToQuit.connect(
+                                                _overviewbuilder.shutdown)
 
-    This helper class provides functions to perform overview
-    computation on a private environment and then move the ovr/aux
-    file back to the main cache folder of the dataset.
+    return _overviewbuilder
+
+
+class AddoHelper(GdalHelper):
+    '''Helper class for overviews computation on live datasets.
+
+    In GSDView overviews of (virtual) datasets that are already open in
+    GSDView itself are computed in-process, by a separate thread (see
+    :class:`gdalsupport.OverviewBuilder`), using a private dataset
+    object.
+
+    Two dataset objects (pointing at the same vrt file) can't safely
+    modify the same overview file so this helper class provides
+    functions to perform overview computation on a private environment
+    and then move the ovr/aux file back to the main cache folder of the
+    dataset.
     After that the dataset is re-opened an all changes are safely
     reflected to the GUI.
 
     In case the overview computation is stopped before completion then
-    the private gdaladdo environment is simply cleaned and no side
-    effect arises.
+    the private environment is simply cleaned and no side effect
+    arises.
 
     .. note:: if one wants to add overviews to a vrt dataset that
               already has overviews (i.e. the ovr/aux file already
               exists) then the ovr/aux file should be copyed in the
-              private gdaladdo environment before starting computation.
+              private environment before starting computation.
 
               In this way the pre-existing overview are preserved but
               the copy operation could be heavy weight.
 
-              Maybe some suggestion can be asked on the GDAL
-              mailing-list.
-
               An alternative solution, the one currently implemented,
               is to force recomputation of all overview levels (exixting
               ones and newly selected) and then replace the ol overview
@@ -244,13 +346,54 @@ class AddoHelper(GdalHelper):
               This solution is not efficient since it doesn't re-use
               existing overviews but ensure no data loss in case the
               operation is stopped by the user.
+              Anyway the full resolution data are read only once for
+              all levels.
+
+    If the :attr:`progressive` flag is set, the coarsest level is
+    computed first, from a strided (decimated) read, and made available
+    to the GUI immediately.  The other levels are then computed, by
+    averaging, in a second pass while the user is already navigating
+    the image (the quick look is kept as coarsest level).
 
     '''
 
-    def __init__(self, app, tool):
+    #: compute a strided quick look of the coarsest level first
+    progressive = True
+
+    def __init__(self, app, tool=None):
         super(AddoHelper, self).__init__(app, tool)
         self._datasetitem = None
         self._band = None
+        self._refinement = None
+
+        self.builder = overviewBuilder(app)
+
+    def userstop(self):
+        return self.builder.userstop
+
+    @QtCore.Slot(float)
+    def updateProgress(self, fract):
+        self.app.updateProgressBar(fract)
+
+    def _connect_signals(self):
+        self.builder.done.connect(self.finalize)
+        self.builder.progressChanged.connect(self.updateProgress)
+        self.app.stopbutton.clicked.connect(self.builder.stop)
+
+        if self.progressdialog:
+            self.progressdialog.canceled.connect(self.builder.stop)
+            self.app.progressbar.valueChanged.connect(
+                                                self.progressdialog.setValue)
+
+    def _disconnect_signals(self):
+        self.builder.done.disconnect(self.finalize)
+        self.builder.progressChanged.disconnect(self.updateProgress)
+        self.app.stopbutton.clicked.disconnect(self.builder.stop)
+
+        if self.progressdialog:
+            self.app.progressbar.valueChanged.disconnect(
+                                                self.progressdialog.setValue)
+            self.progressdialog.canceled.disconnect(self.builder.stop)
 
     def target_levels(self, dataset):
         if self._band is not None:
@@ -282,8 +425,13 @@ class AddoHelper(GdalHelper):
 
         return levels
 
-    def do_start(self, item):
+    def do_start(self, item, levels=None, quicklook=None):
         #levels = gdalsupport.ovrComputeLevels(item)
+        startitem = item
+
+        # @NOTE: explicitly requested levels are never computed
+        #        progressively (e.g. second pass)
+        progressive = self.progressive and levels is None
 
         # @NOTE: use dataset for levels computation because the
         #        IMAGE_STRUCTURE metadata are not propagated from
@@ -301,7 +449,8 @@ class AddoHelper(GdalHelper):
 
         assert isinstance(dataset, modelitems.CachedDatasetItem), str(dataset)
 
-        levels = self.target_levels(dataset)
+        if levels is None:
+            levels = self.target_levels(dataset)
 
         # @NOTE: overviews are computed for all bands so I do this at
         #        application level, before a specific band is choosen.
@@ -310,24 +459,33 @@ class AddoHelper(GdalHelper):
         if levels:
             self.logger.debug('requested levels: %s' % levels)
 
-            # Run an external process for overviews computation
-            self.app.statusBar().showMessage('Quick look image generation ...')
-
+            # Run a separate thread for overviews computation
+            # @NOTE: averaging in magphase space is used for complex bands
             self._tmpdir = self.setup_tmpdir(dataset)
             vrtfilename = os.path.basename(dataset.vrtfilename)
             vrtfilename = os.path.join(self._tmpdir, vrtfilename)
             self._datasetitem = dataset
 
-            # use averaging in magphase space for complex raster bands
-            if gdalsupport.has_complex_bands(dataset):
-                self.tool.set_resampling_method('average_magphase')
+            if progressive and len(levels) > 1:
+                # quick look of the coarsest level, all levels later
+                self._refinement = (startitem, levels)
+                self.builder.setup(vrtfilename, [max(levels)], strided=True)
+                msg = 'Quick look image generation ...'
             else:
-                self.tool.set_resampling_method('average')
-
-            args = [os.path.basename(vrtfilename)]
-            args.extend(str(level) for level in levels)
-            self.tool.cwd = os.path.dirname(vrtfilename)
-            self.controller.run_tool(self.tool, *args)
+                if quicklook is not None:
+                    # @NOTE: the ovr file of the quick look only contains
+                    #        the coarsest level so it is cheap to copy it
+                    #        in the private environment: it is preserved
+                    #        and the other levels are added to it
+                    cachedir = os.path.dirname(dataset.vrtfilename)
+                    for ovrfile in self.ovrfiles(cachedir):
+                        shutil.copy(ovrfile, self._tmpdir)
+                    levels = [level for level in levels
+                              if level != quicklook]
+                self.builder.setup(vrtfilename, levels)
+                msg = 'Overviews computation ...'
+            self.builder.start()
+            self.app.processingStarted(msg)
         else:
             return True
 
@@ -350,27 +508,73 @@ class AddoHelper(GdalHelper):
             shutil.move(ovrfile, dirname)
 
         dataset.reopen()
+        if self.builder.statistics:
+            self.setStatistics(dataset, self.builder.statistics)
+
         for row in range(dataset.rowCount()):
             item = dataset.child(row)
             self.app.treeview.expand(item.index())
 
+        if self._refinement is not None:
+            # @NOTE: start the second pass after finalization completes
+            QtCore.QTimer.singleShot(0, self._refine)
+
+    def do_finalize_on_error(self):
+        self._refinement = None
+
+    def setStatistics(self, dataset, statistics):
+        '''Store statistics computed with overviews in band metadata.'''
+
+        for index, (stats, hist) in enumerate(statistics):
+            band = dataset.GetRasterBand(index + 1)
+            if None not in stats:
+                for name, value in zip(gdalsupport.GDAL_STATS_KEYS, stats):
+                    band.SetMetadataItem(name, str(value))
+            if hist is not None:
+                band.SetDefaultHistogram(*hist)
+
+    @QtCore.Slot()
+    def _refine(self):
+        if self._refinement is None:
+            return
+        item, levels = self._refinement
+        self._refinement = None
+        # @NOTE: the "done" signal is emitted just before the end of
+        #        the builder thread
+        self.builder.wait()
+        self.start(item, levels=levels, quicklook=max(levels))
+
     def reset(self):
         super(AddoHelper, self).reset()
         self._datasetitem = None
         self._band = None
+        self._refinement = None
 
 
-class StatsHelper(GdalHelper):
-    '''Helper class for statistics pre-computation on live raster bands.'''
+class StatsDialogHelper(GdalHelper):
+    '''Helper class for statistics computation on live raster bands.'''
 
     _PROGRESS_RANGE = (0, 0)
+    _PROGRESS_DIALOD_MSG = 'Statistics computation.'
 
     # @TODO: test error control and user stop handling
 
     def __init__(self, app, tool):
-        super(StatsHelper, self).__init__(app, tool)
+        super(StatsDialogHelper, self).__init__(app, tool)
         self._datasetitem = None
         self._banditem = None
+        self.dialog = None
+        if self._PROGRESS_DIALOD_MSG:
+            self.setup_progress_dialog(app.tr(self._PROGRESS_DIALOD_MSG))
+
+    def start(self, item, dialog=None):
+        if dialog:
+            self.dialog = dialog
+
+        if not self.dialog:
+            raise ValueError('"dialog" attribute not set')
+
+        super(StatsDialogHelper, self).start(item)
 
     def do_start(self, item):
         if not isinstance(item, modelitems.BandItem):
@@ -384,8 +588,6 @@ class StatsHelper(GdalHelper):
         dataset = item.parent()
 
         # Run an external process for statistics computation
-        self.app.statusBar().showMessage('Compute coarse statistics ...')
-
         self._tmpdir = self.setup_tmpdir(dataset)
         vrtfilename = os.path.basename(dataset.vrtfilename)
         vrtfilename = os.path.join(self._tmpdir, vrtfilename)
@@ -424,9 +626,10 @@ class StatsHelper(GdalHelper):
         self.apply()
 
     def reset(self):
-        super(StatsHelper, self).reset()
+        super(StatsDialogHelper, self).reset()
         self._banditem = None
         self._datasetitem = None
+        self.dialog = None
 
     def copy_data(self, vrtband):
         stats = gdalsupport.GetCachedStatistics(vrtband)
@@ -437,34 +640,6 @@ class StatsHelper(GdalHelper):
         for name, value in zip(gdalsupport.GDAL_STATS_KEYS, stats):
             self._banditem.SetMetadataItem(name, str(value))
 
-    def apply(self):
-        self.gdalbackend.newImageView(self._banditem)
-
-
-class StatsDialogHelper(StatsHelper):
-    '''Helper class for statistics computation on live raster bands.'''
-
-    _PROGRESS_DIALOD_MSG = 'Statistics computation.'
-
-    def __init__(self, app, tool):
-        super(StatsDialogHelper, self).__init__(app, tool)
-        self.dialog = None
-        if self._PROGRESS_DIALOD_MSG:
-            self.setup_progress_dialog(app.tr(self._PROGRESS_DIALOD_MSG))
-
-    def start(self, item, dialog=None):
-        if dialog:
-            self.dialog = dialog
-
-        if not self.dialog:
-            raise ValueError('"dialog" attribute not set')
-
-        super(StatsDialogHelper, self).start(item)
-
-    def reset(self):
-        super(StatsDialogHelper, self).reset()
-        self.dialog = None
-
     def apply(self):
         self.dialog.updateStatistics()
 
@@ -494,7 +669,10 @@ class AddoDialogHelper(AddoHelper):
 
     _PROGRESS_DIALOD_MSG = 'Overviews computation.'
 
-    def __init__(self, app, tool):
+    # @NOTE: levels explicitly requested by the user are computed at once
+    progressive = False
+
+    def __init__(self, app, tool=None):
         super(AddoDialogHelper, self).__init__(app, tool)
         self.dialog = None
         self.setup_progress_dialog(app.tr(self._PROGRESS_DIALOD_MSG))
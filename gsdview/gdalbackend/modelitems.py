@@ -181,6 +181,8 @@ class BandItem(MajorObjectItem):
             return None, None
 
     def close(self):
+        if self.graphicsitem is not None:
+            self.graphicsitem.clearCache()
         self.scene.clear()
         self.graphicsitem = None
         #self.scene = None    # @WARNINIG: causes problems in event filters
@@ -238,6 +240,11 @@ class BandItem(MajorObjectItem):
             #self.sortChildren(0, QtCore.Qt.AscendngOrder)
 
         self._obj = gdalobj
+
+        # rendered tiles could refer to outdated overviews
+        if self.graphicsitem is not None:
+            self.graphicsitem.clearCache()
+
         self.model().itemChanged.emit(self)
 
 
@@ -384,6 +391,8 @@ class DatasetItem(MajorObjectItem):
         self.filename = None
         self._mode = None
         self.cmapper = None
+        if self.graphicsitem is not None:
+            self.graphicsitem.clearCache()
         self.graphicsitem = None
         #self.scene = None    # @WARNINIG: causes problems in event filters
         super(DatasetItem, self).close()
@@ -557,6 +566,9 @@ class CachedDatasetItem(DatasetItem):
 
         self._vrtobj = gdalobj
 
+        if self.graphicsitem is not None:
+            self.graphicsitem.clearCache()
+
         self.model().itemChanged.emit(self)
 
 
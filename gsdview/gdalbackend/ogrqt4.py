@@ -26,13 +26,24 @@ __date__ = '$Date$'
 __revision__ = '$Revision$'
 
 
+import os
+import sys
+import math
+import struct
 import logging
+import threading
+import itertools
 
+import numpy as np
 from osgeo import ogr, osr
 
+import qt
 from qt import QtCore, QtGui
 
+from .. import utils
 from .. import qt4draw
+from ..gdalbackend import gdalsupport
+from ..gdalbackend.gdalqt4 import BaseGdalGraphicsItem
 
 
 ### Graphics Items ############################################################
@@ -74,6 +85,965 @@ from .. import qt4draw
         #~ self.fid = fid
 
 
+### Spatial index #############################################################
+class GridIndex(object):
+    '''Uniform grid spatial index of bounding boxes.
+
+    Each bounding box (xmin, ymin, xmax, ymax) is registered in all grid
+    cells it overlaps.  Cells are stored in a compact (CSR like) form so
+    that the index can be built with vectorized operations also for
+    millions of items.
+
+    '''
+
+    #: average number of items per cell
+    ITEMS_PER_CELL = 8
+
+    #: max number of cells along each axis
+    MAX_GRID_SIZE = 256
+
+    def __init__(self, bboxes):
+        bboxes = np.asarray(bboxes, dtype='float64').reshape(-1, 4)
+        self.bboxes = bboxes
+
+        valid = np.isfinite(bboxes).all(axis=1)
+        ids = np.flatnonzero(valid)
+        if len(ids) == 0:
+            self.extent = None
+            self._ids = np.empty(0, dtype='int64')
+            self._offsets = np.zeros(2, dtype='int64')
+            self.shape = (1, 1)
+            return
+
+        boxes = bboxes[ids]
+        xmin, ymin = boxes[:, :2].min(axis=0)
+        xmax, ymax = boxes[:, 2:].max(axis=0)
+        self.extent = (xmin, ymin, xmax, ymax)
+
+        n = int(math.ceil(math.sqrt(len(ids) / float(self.ITEMS_PER_CELL))))
+        nx = ny = min(max(n, 1), self.MAX_GRID_SIZE)
+        self.shape = (ny, nx)
+        self._cellsize = (max(xmax - xmin, 1e-300) / nx,
+                          max(ymax - ymin, 1e-300) / ny)
+
+        cx0, cy0 = self._cell(boxes[:, 0], boxes[:, 1])
+        cx1, cy1 = self._cell(boxes[:, 2], boxes[:, 3])
+
+        # expand each item to the list of cells it overlaps
+        widths = cx1 - cx0 + 1
+        counts = widths * (cy1 - cy0 + 1)
+        starts = np.cumsum(counts) - counts
+        k = np.arange(counts.sum()) - np.repeat(starts, counts)
+        widths = np.repeat(widths, counts)
+        cells = ((np.repeat(cy0, counts) + k // widths) * nx +
+                 np.repeat(cx0, counts) + k % widths)
+
+        order = np.argsort(cells, kind='mergesort')
+        self._ids = np.repeat(ids, counts)[order]
+        self._offsets = np.searchsorted(cells[order],
+                                        np.arange(nx * ny + 1))
+
+    def __len__(self):
+        return len(self.bboxes)
+
+    def _cell(self, x, y):
+        ny, nx = self.shape
+        xmin, ymin = self.extent[:2]
+        dx, dy = self._cellsize
+        cx = np.clip(np.floor((x - xmin) / dx), 0, nx - 1).astype('int64')
+        cy = np.clip(np.floor((y - ymin) / dy), 0, ny - 1).astype('int64')
+        return cx, cy
+
+    def query(self, xmin, ymin, xmax, ymax):
+        '''Return indices of bounding boxes intersecting the query box.'''
+
+        if self.extent is None:
+            return np.empty(0, dtype='int64')
+
+        exmin, eymin, exmax, eymax = self.extent
+        if xmin > exmax or xmax < exmin or ymin > eymax or ymax < eymin:
+            return np.empty(0, dtype='int64')
+
+        (cx0, cx1), (cy0, cy1) = self._cell(np.array([xmin, xmax]),
+                                            np.array([ymin, ymax]))
+        nx = self.shape[1]
+        chunks = []
+        for cy in range(cy0, cy1 + 1):
+            start = self._offsets[cy * nx + cx0]
+            stop = self._offsets[cy * nx + cx1 + 1]
+            chunks.append(self._ids[start:stop])
+        candidates = np.unique(np.concatenate(chunks))
+
+        boxes = self.bboxes[candidates]
+        mask = ((boxes[:, 0] <= xmax) & (boxes[:, 2] >= xmin) &
+                (boxes[:, 1] <= ymax) & (boxes[:, 3] >= ymin))
+
+        return candidates[mask]
+
+
+### Geometry simplification ###################################################
+def simplifyCoords(coords, tolerance):
+    '''Simplify a polyline using the Douglas-Peucker algorithm.
+
+    *coords* is a (n, 2) array of vertices; vertices farther than
+    *tolerance* from the simplified polyline are preserved.
+    First and last vertices are always preserved (closed rings stay
+    closed).
+
+    '''
+
+    npoints = len(coords)
+    if npoints < 3 or tolerance <= 0:
+        return coords
+
+    keep = np.zeros(npoints, bool)
+    keep[0] = keep[-1] = True
+
+    # @NOTE: an explicit stack is used in place of recursion
+    stack = [(0, npoints - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        # @NOTE: the distance from the segment (not from the line) is
+        #        used so that vertices beyond its end points are bounded
+        #        too (for closed rings it is the distance from the first
+        #        vertex)
+        p0 = coords[first]
+        d = coords[last] - p0
+        inner = coords[first + 1:last] - p0
+        norm2 = np.dot(d, d)
+        if norm2 == 0:
+            t = np.zeros(len(inner))
+        else:
+            t = np.clip(np.dot(inner, d) / norm2, 0, 1)
+        inner = inner - t[:, np.newaxis] * d
+        dist = np.hypot(inner[:, 0], inner[:, 1])
+
+        index = dist.argmax()
+        if dist[index] > tolerance:
+            index += first + 1
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return coords[keep]
+
+
+def simplifyQPolygonF(qpoly, tolerance):
+    '''Simplify a QPolygonF (see :func:`simplifyCoords`).'''
+
+    if qpoly.count() < 3:
+        return qpoly
+
+    rect = qpoly.boundingRect()
+    if max(rect.width(), rect.height()) <= tolerance:
+        # the entire polygon is smaller than the tolerance
+        return QtGui.QPolygonF([qpoly.first(), qpoly.last()])
+
+    coords = simplifyCoords(qpolygonFToArray(qpoly), tolerance)
+    return arrayToQPolygonF(coords)
+
+
+### Vector layer item #########################################################
+class _VectorTile(object):
+    '''Batched graphics of the features of a grid tile.'''
+
+    # @NOTE: polygons are filled using the non-zero winding rule: since
+    #        outer rings and holes have opposite orientations (see
+    #        wkbToArrays) overlapping polygons do not cancel each other
+    #        (as they would do with the odd-even rule) and holes are
+    #        preserved
+
+    def __init__(self):
+        self.bbox = None    # xmin, ymin, xmax, ymax
+        self.polygons = QtGui.QPainterPath()
+        self.polygons.setFillRule(QtCore.Qt.WindingFill)
+        self.lines = QtGui.QPainterPath()
+        self.points = QtGui.QPolygonF()
+
+    def addPolygon(self, rings, bbox):
+        for qpoly in rings:
+            self.polygons.addPolygon(qpoly)
+        self.bbox = _unitedBBox(self.bbox, bbox)
+
+    def add(self, kind, qpoly, bbox):
+        if kind == 'line':
+            self.lines.addPolygon(qpoly)
+        else:
+            self.points += qpoly
+        self.bbox = _unitedBBox(self.bbox, bbox)
+
+    def intersects(self, rect, pad=0):
+        xmin, ymin, xmax, ymax = self.bbox
+        return (xmin - pad <= rect.right() and xmax + pad >= rect.left() and
+                ymin - pad <= rect.bottom() and ymax + pad >= rect.top())
+
+
+def _bbox(coords):
+    # @NOTE: QRectF.united ignores null rects (e.g. the bounding rect of a
+    #        single point) so bounding boxes are handled as tuples
+    if len(coords) == 0:
+        return None
+    xmin, ymin = coords.min(axis=0)
+    xmax, ymax = coords.max(axis=0)
+    return xmin, ymin, xmax, ymax
+
+
+def _unitedBBox(bbox1, bbox2):
+    if bbox1 is None:
+        return bbox2
+    elif bbox2 is None:
+        return bbox1
+    return (min(bbox1[0], bbox2[0]), min(bbox1[1], bbox2[1]),
+            max(bbox1[2], bbox2[2]), max(bbox1[3], bbox2[3]))
+
+
+def simplificationTolerances(levels, resolution):
+    '''Return (level, tolerance) pairs of a pyramid of simplified geometries.
+
+    The tolerance of level L is half the L * *resolution* pixel size.
+
+    '''
+
+    if not resolution:
+        return ()
+    return tuple((level, 0.5 * level * resolution) for level in levels)
+
+
+def simplifyParts(parts, tolerance):
+    '''Simplify the (kind, coordinates) parts of a feature.
+
+    Coordinates are (n, 2) arrays (see :func:`simplifyCoords`).
+    Points are not simplified and parts smaller than *tolerance* are
+    reduced to their first and last vertices.
+
+    '''
+
+    simplified = []
+    for kind, coords in parts:
+        if kind != 'point' and len(coords) > 2:
+            if (coords.max(axis=0) - coords.min(axis=0)).max() <= tolerance:
+                coords = coords[[0, -1]]
+            else:
+                coords = simplifyCoords(coords, tolerance)
+        simplified.append((kind, coords))
+    return simplified
+
+
+class GraphicsVectorLayerItem(QtGui.QAbstractGraphicsShapeItem):
+    '''Qt graphics item representing a (large) vector layer.
+
+    Geometries are not represented by individual graphics items: they
+    are grouped by the tiles of a regular grid, and only tiles
+    intersecting the exposed rect are drawn.  Polygons, lines and
+    points are batched into a single painter path (of each kind) for
+    each tile.  Polygons are filled with the non-zero winding rule so
+    their rings are expected to be oriented as the ones decoded by
+    :func:`wkbToArrays` (outer rings counter-clockwise, holes
+    clockwise).
+
+    Features are identified by their FID.  Picking and selection use a
+    :class:`GridIndex` spatial index of feature bounding boxes.
+
+    Points are drawn as filled circles of :data:`POINT_RADIUS` pixels
+    (see also :class:`gsdview.qt4draw.GraphicsPointItem`).
+
+    At low zoom levels lines and polygons are drawn using a pyramid of
+    simplified geometries (see :meth:`setSimplificationLevels`).
+
+    Tiles of each level of the pyramid (and of full resolution
+    geometries) are built lazily, the first time the level is drawn.
+
+    '''
+
+    Type = QtGui.QGraphicsItem.UserType + 102
+
+    #: number of tiles along each axis of the layer extent
+    TILE_GRID_SIZE = 16
+
+    #: radius of point markers (pixels)
+    POINT_RADIUS = 3
+
+    #: max scaling factor of point markers
+    POINT_MAX_FACTOR = 10
+
+    #: tolerance (pixels) for picking
+    PICK_TOLERANCE = 3
+
+    #: default simplification levels (same progression of the overview
+    #: levels computed by :func:`gdalsupport.ovrComputeLevels`)
+    SIMPLIFICATION_LEVELS = (3, 9, 27, 81)
+
+    #: number of pixels along the largest side of the tile grid at full
+    #: resolution (used to compute the default simplification resolution)
+    SIMPLIFICATION_BASE_SIZE = 4096
+
+    def __init__(self, name=None, parent=None, scene=None, **kargs):
+        super(GraphicsVectorLayerItem, self).__init__(parent, scene, **kargs)
+
+        # @COMPATIBILITY: Qt >= 4.6.0 needs this flag to be set otherwise the
+        #                 exact exposedRect is not computed
+        # @SEEALSO: ItemUsesExtendedStyleOption item at
+        # http://doc.qt.nokia.com/4.6/qgraphicsitem.html#GraphicsItemFlag-enum
+        try:
+            self.setFlag(QtGui.QGraphicsItem.ItemUsesExtendedStyleOptions)
+        except AttributeError:
+            ItemUsesExtendedStyleOptions = 0x200
+            self.setFlag(ItemUsesExtendedStyleOptions)
+
+        self.name = name
+        if name:
+            self.setData(DATAKEY['name'], name)
+
+        pen = self.pen()
+        pen.setCosmetic(True)
+        self.setPen(pen)
+
+        self._fids = []
+        self._parts = []        # list of (kind, coords) for each feature
+        self._bboxes = []
+        self._index = None
+        self._fidmap = None
+
+        self._extent = None     # xmin, ymin, xmax, ymax
+        self._hasPoints = False
+        self._grid = None       # x0, y0, tilewidth, tileheight, size
+        self._gridrect = None
+
+        self._levels = self.SIMPLIFICATION_LEVELS
+        self._resolution = None
+        self._autoResolution = True
+        self._pyramid = {}      # level (None for full resolution) --> tiles
+        self._ntiled = {}       # level --> number of features already tiled
+        self._simplified = {}   # level --> {index: precomputed parts}
+
+        self._selection = []
+        self._selectionPath = QtGui.QPainterPath()
+
+    def type(self):
+        return self.Type
+
+    def featureCount(self):
+        return len(self._fids)
+
+    def setGrid(self, rect, size=None):
+        '''Set the tile grid (in item coordinates).
+
+        By default the grid is computed from the extent of the first
+        batch of features added.  Setting it in advance (e.g. from the
+        layer extent) is useful when features are added incrementally.
+
+        '''
+
+        if size is None:
+            size = self.TILE_GRID_SIZE
+        width = max(rect.width() / size, 1e-12)
+        height = max(rect.height() / size, 1e-12)
+        tolerances = self.simplificationTolerances()
+        self._grid = (rect.left(), rect.top(), width, height, size)
+        self._gridrect = QtCore.QRectF(rect)
+        if self._autoResolution:
+            self._resolution = self.defaultResolution(rect)
+        self._resetTiles(tolerances != self.simplificationTolerances())
+
+    @classmethod
+    def defaultResolution(cls, rect):
+        '''Default simplification resolution for a tile grid on *rect*.'''
+
+        return max(rect.width(), rect.height()) / float(
+                                                cls.SIMPLIFICATION_BASE_SIZE)
+
+    def simplificationLevels(self):
+        '''Return the (levels, resolution) simplification settings.
+
+        The resolution is None if it is computed from the tile grid.
+
+        '''
+
+        resolution = None if self._autoResolution else self._resolution
+        return self._levels, resolution
+
+    def setSimplificationLevels(self, levels, resolution=None):
+        '''Set the levels of the pyramid of simplified geometries.
+
+        *levels* are decimation factors with respect to *resolution*
+        (item units per pixel) just like raster overview levels: e.g.
+        for a layer overlaid to a raster in pixel coordinates one can
+        use :func:`gdalsupport.ovrLevels` and a resolution of 1 (see
+        :func:`rasterOverlayLoader`).
+        Geometries of level L are simplified with a tolerance of half
+        the L * resolution pixel size.
+
+        If *resolution* is None it is computed from the size of the
+        tile grid (see :data:`SIMPLIFICATION_BASE_SIZE`).
+        An empty *levels* sequence disables simplification.
+
+        Levels of the pyramid are rebuilt when they are drawn again.
+
+        '''
+
+        tolerances = self.simplificationTolerances()
+        self._levels = tuple(sorted(levels))
+        self._autoResolution = resolution is None
+        if resolution is not None:
+            self._resolution = float(resolution)
+        elif self._gridrect is not None:
+            self._resolution = self.defaultResolution(self._gridrect)
+        else:
+            self._resolution = None
+        self._resetTiles(tolerances != self.simplificationTolerances())
+        self.update()
+
+    def simplificationTolerances(self):
+        '''Return (level, tolerance) pairs of the current pyramid.'''
+
+        return simplificationTolerances(self._levels, self._resolution)
+
+    def simplificationLevel(self, levelOfDetail):
+        '''Return the simplification level for *levelOfDetail*.
+
+        As for raster overviews (see
+        :meth:`gdalqt4.BaseGdalGraphicsItem._readLevel`) the largest
+        level not exceeding 1 / levelOfDetail (in resolution units) is
+        selected.  None is returned if full resolution geometries have
+        to be used.
+
+        '''
+
+        if not self._levels or not self._resolution or levelOfDetail <= 0:
+            return None
+
+        reqlevel = 1. / (levelOfDetail * self._resolution)
+        best = None
+        for level in self._levels:
+            if level <= reqlevel:
+                best = level
+        return best
+
+    def _tileKey(self, bbox):
+        x0, y0, width, height, size = self._grid
+        x = (bbox[0] + bbox[2]) / 2.
+        y = (bbox[1] + bbox[3]) / 2.
+        tx = min(max(int((x - x0) // width), 0), size - 1)
+        ty = min(max(int((y - y0) // height), 0), size - 1)
+        return tx, ty
+
+    def _tile(self, tiles, bbox):
+        key = self._tileKey(bbox)
+        tile = tiles.get(key)
+        if tile is None:
+            tile = tiles[key] = _VectorTile()
+        return tile
+
+    def _addToTiles(self, tiles, parts):
+        # all rings of a feature go in the same tile (and path)
+        rings = []
+        bbox = None
+        for kind, coords in parts:
+            pbbox = _bbox(coords)
+            if pbbox is None:
+                continue
+            if kind == 'polygon':
+                rings.append(arrayToQPolygonF(coords))
+                bbox = _unitedBBox(bbox, pbbox)
+            else:
+                self._tile(tiles, pbbox).add(kind, arrayToQPolygonF(coords),
+                                             pbbox)
+        if rings:
+            self._tile(tiles, bbox).addPolygon(rings, bbox)
+
+    def _levelTiles(self, level=None):
+        # return the tiles of a level of the pyramid (None for full
+        # resolution geometries) tiling features not tiled yet: features
+        # are simplified only if no precomputed parts are available
+        tiles = self._pyramid.setdefault(level, {})
+        first = self._ntiled.get(level, 0)
+        if self._grid is None or first == len(self._parts):
+            return tiles
+
+        if level is not None:
+            tolerance = dict(self.simplificationTolerances())[level]
+            precomputed = self._simplified.pop(level, {})
+
+        for index in range(first, len(self._parts)):
+            parts = self._parts[index]
+            if level is not None:
+                if index in precomputed:
+                    parts = precomputed[index]
+                else:
+                    parts = simplifyParts(parts, tolerance)
+            self._addToTiles(tiles, parts)
+
+        self._ntiled[level] = len(self._parts)
+        return tiles
+
+    def _resetTiles(self, simplified=True):
+        # tiles are rebuilt lazily (see _levelTiles)
+        self._pyramid = {}
+        self._ntiled = {}
+        if simplified:
+            self._simplified = {}
+
+    def addFeatures(self, features, simplified=None):
+        '''Add a batch of features.
+
+        *features* is a sequence of (fid, parts) where parts is a list
+        of (kind, coordinates) tuples and kind is one of "polygon"
+        (oriented rings, see :func:`wkbToArrays`), "line" or "point"
+        (coordinates of points).
+        Coordinates are (n, 2) arrays (see :func:`transformCoords`);
+        QPolygonF objects are accepted too but they are converted.
+
+        Tiles are not built here but the first time they are drawn
+        (see :meth:`paint`).
+        Simplified parts can be precomputed (e.g. in a worker thread,
+        see :class:`VectorLayerLoader`) and passed as *simplified*, a
+        (tolerances, levels) tuple where levels maps each level to the
+        list of the :func:`simplifyParts` results for each feature.
+        Levels whose tolerance does not match the one of the item (see
+        :meth:`simplificationTolerances`) are ignored.
+
+        '''
+
+        self.prepareGeometryChange()
+
+        first = len(self._parts)
+        for fid, parts in features:
+            bbox = None
+            coords = []
+            for kind, points in parts:
+                if isinstance(points, QtGui.QPolygonF):
+                    points = qpolygonFToArray(points)
+                coords.append((kind, points))
+                bbox = _unitedBBox(bbox, _bbox(points))
+                if kind == 'point':
+                    self._hasPoints = True
+
+            self._fids.append(fid)
+            self._parts.append(coords)
+            if bbox is not None:
+                self._bboxes.append(bbox)
+                self._extent = _unitedBBox(self._extent, bbox)
+            else:
+                self._bboxes.append((np.nan,) * 4)
+
+        if self._grid is None and self._extent is not None:
+            xmin, ymin, xmax, ymax = self._extent
+            self.setGrid(QtCore.QRectF(xmin, ymin, xmax - xmin, ymax - ymin))
+
+        if simplified is not None:
+            tolerances, levels = simplified
+            for level, tolerance in self.simplificationTolerances():
+                if (level, tolerance) in tolerances:
+                    precomputed = self._simplified.setdefault(level, {})
+                    precomputed.update(enumerate(levels[level], first))
+
+        self._index = None
+        self._fidmap = None
+        self.update()
+
+    def clear(self):
+        self.prepareGeometryChange()
+        self._fids = []
+        self._parts = []
+        self._bboxes = []
+        self._index = None
+        self._fidmap = None
+        self._extent = None
+        self._hasPoints = False
+        self._grid = None
+        self._gridrect = None
+        self._resetTiles()
+        if self._autoResolution:
+            self._resolution = None
+        self.setSelectedFeatures([])
+
+    def spatialIndex(self):
+        if self._index is None:
+            self._index = GridIndex(self._bboxes)
+        return self._index
+
+    def boundingRect(self):
+        if self._extent is None:
+            return QtCore.QRectF()
+
+        xmin, ymin, xmax, ymax = self._extent
+        rect = QtCore.QRectF(xmin, ymin, xmax - xmin, ymax - ymin)
+        if self._hasPoints:
+            pad = self.POINT_RADIUS * self.POINT_MAX_FACTOR
+            rect.adjust(-pad, -pad, pad, pad)
+        return rect
+
+    def paint(self, painter, option, widget):
+        lod = BaseGdalGraphicsItem._levelOfDetail(option, painter)
+        pen = self.pen()
+        brush = self.brush()
+
+        # @NOTE: tiles are padded by the point marker size so that markers
+        #        crossing the exposed rect border are not culled
+        pad = self.POINT_RADIUS / max(lod, 1e-12)
+        exposed = option.exposedRect
+        tiles = self._levelTiles(self.simplificationLevel(lod))
+        tiles = [tile for tile in tiles.values()
+                 if tile.intersects(exposed, pad)]
+
+        painter.setPen(pen)
+        painter.setBrush(brush)
+        for tile in tiles:
+            if not tile.polygons.isEmpty():
+                painter.drawPath(tile.polygons)
+
+        painter.setBrush(QtCore.Qt.NoBrush)
+        for tile in tiles:
+            if not tile.lines.isEmpty():
+                painter.drawPath(tile.lines)
+
+        if self._hasPoints:
+            radius = min(self.POINT_RADIUS,
+                         self.POINT_RADIUS * self.POINT_MAX_FACTOR * lod)
+            color = brush.color() if brush.style() else pen.color()
+            ppen = QtGui.QPen(color, 2 * radius)
+            ppen.setCosmetic(True)
+            ppen.setCapStyle(QtCore.Qt.RoundCap)
+            painter.setPen(ppen)
+            for tile in tiles:
+                if not tile.points.isEmpty():
+                    painter.drawPoints(tile.points)
+
+        if not self._selectionPath.isEmpty():
+            fgcolor = option.palette.windowText().color()
+            spen = QtGui.QPen(fgcolor, 2, QtCore.Qt.DashLine)
+            spen.setCosmetic(True)
+            painter.setPen(spen)
+            painter.setBrush(QtCore.Qt.NoBrush)
+            painter.drawPath(self._selectionPath)
+
+    ### Picking and selection ###
+    def _featurePath(self, index):
+        path = QtGui.QPainterPath()
+        for kind, coords in self._parts[index]:
+            path.addPolygon(arrayToQPolygonF(coords))
+        return path
+
+    def featuresIn(self, rect):
+        '''Return FIDs of features whose bounding box intersects rect.'''
+
+        indices = self.spatialIndex().query(rect.left(), rect.top(),
+                                            rect.right(), rect.bottom())
+        return [self._fids[index] for index in indices]
+
+    def featuresAt(self, pos, tolerance=0):
+        '''Return FIDs of features at *pos* (item coordinates).
+
+        Polygons are hit if *pos* is inside them, lines and points if
+        *pos* is closer than *tolerance*.
+
+        '''
+
+        x, y = pos.x(), pos.y()
+        indices = self.spatialIndex().query(x - tolerance, y - tolerance,
+                                            x + tolerance, y + tolerance)
+
+        stroker = QtGui.QPainterPathStroker()
+        stroker.setWidth(2 * tolerance)
+
+        return [self._fids[index] for index in indices
+                if self._hitTest(index, pos, tolerance, stroker)]
+
+    def _hitTest(self, index, pos, tolerance, stroker):
+        rings = QtGui.QPainterPath()
+        for kind, coords in self._parts[index]:
+            qpoly = arrayToQPolygonF(coords)
+            if kind == 'polygon':
+                rings.addPolygon(qpoly)
+            elif kind == 'line':
+                path = QtGui.QPainterPath()
+                path.addPolygon(qpoly)
+                if stroker.createStroke(path).contains(pos):
+                    return True
+            else:
+                for point in qpoly:
+                    if QtCore.QLineF(pos, point).length() <= tolerance:
+                        return True
+
+        # @NOTE: all rings are tested at once (holes are handled by the
+        #        odd-even fill rule)
+        return not rings.isEmpty() and rings.contains(pos)
+
+    def selectedFeatures(self):
+        return list(self._selection)
+
+    def setSelectedFeatures(self, fids):
+        if self._fidmap is None:
+            self._fidmap = dict((fid, index)
+                                for index, fid in enumerate(self._fids))
+
+        self._selection = [fid for fid in fids if fid in self._fidmap]
+        path = QtGui.QPainterPath()
+        for fid in self._selection:
+            path.addPath(self._featurePath(self._fidmap[fid]))
+        self._selectionPath = path
+        self.update()
+
+    def mousePressEvent(self, event):
+        if event.button() != QtCore.Qt.LeftButton:
+            event.ignore()
+            return
+
+        lod = 1.
+        widget = event.widget()
+        if widget is not None and widget.parentWidget() is not None:
+            view = widget.parentWidget()
+            if isinstance(view, QtGui.QGraphicsView):
+                lod = BaseGdalGraphicsItem._levelOfDetailFromTransform(
+                        self.deviceTransform(view.viewportTransform()))
+        tolerance = self.PICK_TOLERANCE / max(lod, 1e-12)
+
+        fids = self.featuresAt(event.pos(), tolerance)
+        if event.modifiers() & QtCore.Qt.ControlModifier:
+            selection = self.selectedFeatures()
+            for fid in fids:
+                if fid in selection:
+                    selection.remove(fid)
+                else:
+                    selection.append(fid)
+            self.setSelectedFeatures(selection)
+        else:
+            self.setSelectedFeatures(fids)
+
+        if fids:
+            event.accept()
+        else:
+            event.ignore()
+
+
+### WKB decoding ##############################################################
+#: byte order used for WKB export (the native one avoids byte swapping)
+WKB_BYTE_ORDER = ogr.wkbNDR if sys.byteorder == 'little' else ogr.wkbXDR
+
+_WKB_POINT = 1
+_WKB_LINESTRING = 2
+_WKB_POLYGON = 3
+_WKB_MULTI = (4, 5, 6, 7)
+
+# struct/numpy byte order prefixes indexed by the WKB byte order flag
+_WKB_ENDIANNESS = ('>', '<')
+
+
+def _wkbCoords(wkb, offset, count, dims, hasz, endianness):
+    data = np.frombuffer(wkb, endianness + 'f8', count * dims, offset)
+    data = data.reshape(count, dims)
+
+    # @NOTE: the M coordinate, if any, is always the last one
+    xyz = np.zeros((count, 3), np.float64)
+    if hasz:
+        xyz[:] = data[:, :3]
+    else:
+        xyz[:, :2] = data[:, :2]
+
+    return xyz, offset + data.nbytes
+
+
+def _signedArea(xyz):
+    # twice the signed area of a ring (shoelace formula): positive for
+    # counter-clockwise rings (with the y axis pointing upwards)
+    x = xyz[:, 0] - xyz[0, 0]
+    y = xyz[:, 1] - xyz[0, 1]
+    return np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)
+
+
+def _wkbParse(wkb, offset, parts):
+    order = struct.unpack_from('B', wkb, offset)[0]
+    endianness = _WKB_ENDIANNESS[order]
+    gtype = struct.unpack_from(endianness + 'I', wkb, offset + 1)[0]
+    offset += 5
+
+    # both the OGC 2.5D flags and ISO (Z: +1000, M: +2000, ZM: +3000)
+    # type codes are handled
+    hasz = bool(gtype & 0x80000000)
+    hasm = bool(gtype & 0x40000000)
+    flags, gtype = divmod(gtype & 0x0fffffff, 1000)
+    hasz = hasz or flags in (1, 3)
+    hasm = hasm or flags in (2, 3)
+    dims = 2 + hasz + hasm
+
+    if gtype == _WKB_POINT:
+        xyz, offset = _wkbCoords(wkb, offset, 1, dims, hasz, endianness)
+        # empty points are encoded as NaN coordinates
+        if not np.isnan(xyz[0, 0]):
+            parts.append(('point', xyz))
+    elif gtype in (_WKB_LINESTRING, _WKB_POLYGON):
+        if gtype == _WKB_POLYGON:
+            kind = 'polygon'
+            nrings = struct.unpack_from(endianness + 'I', wkb, offset)[0]
+            offset += 4
+        else:
+            kind = 'line'
+            nrings = 1
+
+        for index in range(nrings):
+            count = struct.unpack_from(endianness + 'I', wkb, offset)[0]
+            offset += 4
+            xyz, offset = _wkbCoords(wkb, offset, count, dims, hasz,
+                                     endianness)
+            if count:
+                # outer rings counter-clockwise, holes clockwise
+                if kind == 'polygon':
+                    if (_signedArea(xyz) > 0) != (index == 0):
+                        xyz = xyz[::-1]
+                parts.append((kind, xyz))
+    elif gtype in _WKB_MULTI:
+        ngeoms = struct.unpack_from(endianness + 'I', wkb, offset)[0]
+        offset += 4
+        for index in range(ngeoms):
+            offset = _wkbParse(wkb, offset, parts)
+    else:
+        raise ValueError('unsupported WKB geometry type: %d' % gtype)
+
+    return offset
+
+
+def wkbToArrays(wkb):
+    '''Decode a WKB geometry into a list of (kind, coordinates) parts.
+
+    Coordinates of each single geometry are decoded in a single step
+    (using :func:`numpy.frombuffer`) into a (n, 3) float64 array of
+    x, y, z values (z is zero for 2D geometries and M values are
+    discarded).
+
+    *kind* is "polygon" for polygon rings, "point" for points and
+    "line" for line strings.  Multi geometries and geometry
+    collections are flattened and empty geometries are skipped.
+
+    Polygon rings are oriented so that they can be filled with the
+    non-zero winding rule: outer rings are counter-clockwise and holes
+    are clockwise (with the y axis pointing upwards).
+
+    '''
+
+    parts = []
+    _wkbParse(wkb, 0, parts)
+    return parts
+
+
+def geometryToArrays(geom):
+    '''Decode an OGR geometry into a list of (kind, coordinates) parts.
+
+    Same as :func:`wkbToArrays` but it also accepts bare linear rings
+    (e.g. polygon rings returned by `GetGeometryRef`) that OGR cannot
+    export to WKB.  Bare rings are "line" parts.
+
+    '''
+
+    if geom.GetGeometryName() == 'LINEARRING':
+        points = geom.GetPoints()
+        if not points:
+            return []
+        points = np.asarray(points, np.float64)
+        xyz = np.zeros((len(points), 3), np.float64)
+        xyz[:, :points.shape[1]] = points[:, :3]
+        return [('line', xyz)]
+
+    return wkbToArrays(geom.ExportToWkb(WKB_BYTE_ORDER))
+
+
+def vectorized(func):
+    '''Mark *func* as a vectorized coordinate transform.
+
+    Vectorized transforms are called once per geometry part as
+    `func(x, y, z)` with numpy arrays of coordinates and must return
+    a (x, y[, z]) tuple of arrays.
+
+    Can be used as a decorator.
+
+    '''
+
+    func.vectorized = True
+    return func
+
+
+def transformCoords(xyz, transform=None):
+    '''Apply *transform* to a (n, 3) array of coordinates.
+
+    *transform* can be:
+
+    * None: no transformation is applied
+    * a QTransform: the (possibly projective) transformation is
+      applied using numpy operations
+    * a vectorized callable (see :func:`vectorized`): it is called
+      once with the x, y and z coordinate arrays
+    * any other callable: it is called as `transform(x, y, z)` for
+      each point
+
+    :returns:
+        a (n, 2) array of transformed x, y coordinates
+
+    '''
+
+    if transform is None:
+        return xyz[:, :2]
+
+    x, y, z = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+    if isinstance(transform, QtGui.QTransform):
+        xt = transform.m11() * x + transform.m21() * y + transform.dx()
+        yt = transform.m12() * x + transform.m22() * y + transform.dy()
+        if not transform.isAffine():
+            w = transform.m13() * x + transform.m23() * y + transform.m33()
+            xt /= w
+            yt /= w
+    elif getattr(transform, 'vectorized', False):
+        result = transform(x, y, z)
+        xt, yt = result[0], result[1]
+    else:
+        points = [transform(*point)[:2] for point in xyz]
+        return np.asarray(points, np.float64).reshape(len(xyz), 2)
+
+    return np.column_stack((xt, yt)).astype(np.float64)
+
+
+def arrayToQPolygonF(coords):
+    '''Build a QPolygonF from a (n, 2) array of coordinates.
+
+    With PyQt4 the coordinates are copied in bulk into the QPolygonF
+    internal buffer, otherwise QPointF objects are set one by one.
+
+    '''
+
+    coords = np.require(coords[:, :2], np.float64, 'C')
+    qpoly = QtGui.QPolygonF(len(coords))
+    if len(coords) == 0:
+        return qpoly
+
+    if qt.qt_api == 'pyqt':
+        # @NOTE: QPointF is a pair of qreal that is assumed to be a
+        #        double (true on all desktop platforms)
+        ptr = qpoly.data()
+        ptr.setsize(coords.nbytes)
+        buf = np.frombuffer(ptr, np.float64)
+        buf[:] = coords.ravel()
+    else:
+        for index, (x, y) in enumerate(coords):
+            qpoly[index] = QtCore.QPointF(x, y)
+
+    return qpoly
+
+
+def qpolygonFToArray(qpoly):
+    '''Return a (n, 2) array with the coordinates of a QPolygonF.'''
+
+    npoints = qpoly.count()
+    if npoints and qt.qt_api == 'pyqt':
+        # @NOTE: qreal is assumed to be a double (see arrayToQPolygonF)
+        ptr = qpoly.data()
+        ptr.setsize(npoints * 2 * np.dtype(np.float64).itemsize)
+        return np.frombuffer(ptr, np.float64).reshape(npoints, 2).copy()
+
+    return np.array([(point.x(), point.y()) for point in qpoly],
+                    np.float64).reshape(npoints, 2)
+
+
 ### Helpers for geometry management ###########################################
 def transformGeometry(geom, transform):
     '''Apply an OSR transform to an OGR geometry.
@@ -100,6 +1070,52 @@ def transformGeometry(geom, transform):
     return geom
 
 
+#: cache of OSR coordinate transformations indexed by
+#: (source WKT, target WKT)
+transformcache = utils.LRUCache(32)
+
+
+def getCoordinateTransformation(src, dst, cache=None):
+    '''Return the (cached) OSR transformation from *src* to *dst*.
+
+    None is returned if one of the spatial references is not
+    specified or if they are the same.
+
+    By default transformations are stored in :data:`transformcache`;
+    a different *cache* can be used e.g. by worker threads since OSR
+    transformations cannot be shared between threads.
+
+    '''
+
+    if src is None or dst is None or src.IsSame(dst):
+        return None
+
+    if cache is None:
+        cache = transformcache
+
+    key = (src.ExportToWkt(), dst.ExportToWkt())
+    transform = cache.get(key)
+    if transform is None:
+        transform = osr.CoordinateTransformation(src, dst)
+        cache.put(key, transform)
+
+    return transform
+
+
+def transformPoints(xyz, transform):
+    '''Apply an OSR transformation to a (n, 3) array of coordinates.
+
+    All points are transformed with a single `TransformPoints` call.
+
+    '''
+
+    if transform is None or not len(xyz):
+        return xyz
+
+    points = transform.TransformPoints(xyz.tolist())
+    return np.asarray(points, np.float64).reshape(len(xyz), 3)
+
+
 def singleGeometryToGraphicsItem(geom, transform=None):
     '''Convert a single OGR geometry into a Qt4 graphics item.
 
@@ -108,7 +1124,7 @@ def singleGeometryToGraphicsItem(geom, transform=None):
 
     If the *transform* callable is provided then each point in the
     geometry is converted using the `transform(x, y, z)` call before
-    genereting the graphics item path.
+    genereting the graphics item path (see :func:`transformCoords`).
 
     .. note: for 2.5D geometries the *z* value is ignored.
 
@@ -162,28 +1178,20 @@ def singleGeometryToGraphicsItem(geom, transform=None):
     elif gtype in (ogr.wkbLinearRing, ogr.wkbPolygon, ogr.wkbPolygon25D,
                    ogr.wkbLineString, ogr.wkbLineString25D):
 
+        parts = geometryToArrays(geom)
+        if parts:
+            qpoly = arrayToQPolygonF(transformCoords(parts[0][1], transform))
+        else:
+            qpoly = QtGui.QPolygonF()
+
         # @NOTE: use only if geometry is a ring
         if geom.IsRing():
-            qpoly = QtGui.QPolygonF(geom.GetPointCount())
-            for index in range(geom.GetPointCount()):
-                point = geom.GetPoint(index)
-                if transform:
-                    point = transform(*point)
-                qpoly[index] = QtCore.QPointF(point[0], point[1])
             qitem = QtGui.QGraphicsPolygonItem(qpoly)
             #qitem.setFillRule(QtCore.Qt.WindingFill)    # @TODO: check
         else:
             qpath = QtGui.QPainterPath()
             #qpath.setFillRule(QtCore.Qt.WindingFill)    # @TODO: check
-            point = geom.GetPoint(0)
-            if transform:
-                point = transform(*point)
-            qpath.moveTo(point[0], point[1])
-            for index in range(1, geom.GetPointCount()):
-                point = geom.GetPoint(index)
-                if transform:
-                    point = transform(*point)
-                qpath.lineTo(point[0], point[1])
+            qpath.addPolygon(qpoly)
             qitem = QtGui.QGraphicsPathItem(qpath)
 
     elif gtype in (ogr.wkbMultiPoint, ogr.wkbMultiPoint25D,
@@ -246,8 +1254,34 @@ def geometryToGraphicsItem(geom, transform=None):
 
     return qitem
 
-#: the max number of features that are converted whan the graphics item
-#: for a layer is generated
+def geometryToParts(geom, transform=None):
+    '''Convert an OGR geometry into a list of (kind, QPolygonF) parts.
+
+    Each single geometry is converted into a QPolygonF and *kind* is
+    "polygon" for polygon rings, "point" for points and "line" for all
+    other geometries.
+
+    The geometry is exported to WKB once and coordinates are decoded
+    and transformed in bulk (see :func:`geometryToArrays` and
+    :func:`transformCoords`).
+
+    If the *transform* callable is provided then points in the
+    geometry are converted using the `transform(x, y, z)` call.
+
+    .. seealso:: :class:`GraphicsVectorLayerItem`
+
+    '''
+
+    parts = []
+    for kind, xyz in geometryToArrays(geom):
+        coords = transformCoords(xyz, transform)
+        parts.append((kind, arrayToQPolygonF(coords)))
+    return parts
+
+
+#: the max number of features that are converted into individual graphics
+#: items whan the graphics item for a layer is generated
+#: (a :class:`GraphicsVectorLayerItem` is used for larger layers)
 MAX_FEATURE_COUNT = 600
 DATAKEY = {
     'name': 1,
@@ -257,7 +1291,7 @@ DATAKEY = {
 }
 
 
-def layerToGraphicsItem(layer, srs=None, transform=None):
+def layerToGraphicsItem(layer, srs=None, transform=None, cachekey=None):
     '''Convert an OGR layer into a Qt4 graphics item.
 
     If the *srs* parameter is provided each feature is converted into
@@ -276,25 +1310,28 @@ def layerToGraphicsItem(layer, srs=None, transform=None):
         the target OSR spatial reference system
     :param transform:
         callable object for arbitrary coordinate conversion
+    :param cachekey:
+        key identifying the layer in the coordinates cache (see
+        :func:`layerCacheKey` and :func:`layerCoordinates`), if None
+        coordinates are not cached
     :returns:
         a Qt4 graphics item (QGraphicsItemGroup) representing the layer
 
+    Layers with more than :data:`MAX_FEATURE_COUNT` features are
+    converted into a :class:`GraphicsVectorLayerItem`.
+
     .. seealso:: :func:`singleGeometryToGraphicsItem`,
-                 :func:`geometryToGraphicsItem` and
+                 :func:`geometryToGraphicsItem`,
+                 :func:`layerToVectorItem` and
                  :data:`MAX_FEATURE_COUNT`
 
     '''
 
-    layer_srs = layer.GetSpatialRef()
-    if (srs is not None and layer_srs is not None and
-                                            not layer_srs.IsSame(srs)):
-        srs_transform = osr.CoordinateTransformation(layer_srs, srs)
-    else:
-        srs_transform = None
-
     if layer.GetFeatureCount() > MAX_FEATURE_COUNT:
-        raise RuntimeError('too many features in layed %s: %d' % (
-                                    layer.GetName(), layer.GetFeatureCount()))
+        return layerToVectorItem(layer, srs, transform, cachekey)
+
+    layer_srs = layer.GetSpatialRef()
+    srs_transform = getCoordinateTransformation(layer_srs, srs)
 
     #~ print 'extent:', layer.GetExtent() # @TODO: check
     #qlayer = GraphicsLayerItem(layer.GetName())
@@ -305,24 +1342,8 @@ def layerToGraphicsItem(layer, srs=None, transform=None):
         qfeature = qt4draw.GraphicsItemGroup()
         qfeature.setData(DATAKEY['FID'], feature.GetFID())
 
-        geom = feature.GetGeometryRef()
+        geom = _featureGeometry(feature, layer_srs, srs, srs_transform)
         if geom:
-            geotransform = srs_transform
-            geom_srs = geom.GetSpatialReference()
-            if geom_srs:
-                if (layer_srs is not None and not geom_srs.IsSame(layer_srs)):
-                    if srs is not None:
-                        geotransform = osr.CoordinateTransformation(geom_srs,
-                                                                    srs)
-                    else:
-                        geotransform = osr.CoordinateTransformation(geom_srs,
-                                                                    layer_srs)
-                elif srs is not None and not geom_srs.IsSame(srs):
-                    geotransform = osr.CoordinateTransformation(geom_srs, srs)
-
-            if geotransform:
-                geom = transformGeometry(geom, geotransform)
-
             qitem = geometryToGraphicsItem(geom, transform)
             if qitem:
                 qfeature.addToGroup(qitem)
@@ -346,6 +1367,549 @@ def layerToGraphicsItem(layer, srs=None, transform=None):
     return qlayer
 
 
+def _featureGeometry(feature, layer_srs=None, srs=None, srs_transform=None):
+    '''Return the feature geometry in the target spatial reference.'''
+
+    geom = feature.GetGeometryRef()
+    if not geom:
+        return geom
+
+    geotransform = srs_transform
+    geom_srs = geom.GetSpatialReference()
+    if geom_srs:
+        if (layer_srs is not None and not geom_srs.IsSame(layer_srs)):
+            if srs is not None:
+                geotransform = getCoordinateTransformation(geom_srs, srs)
+            else:
+                geotransform = getCoordinateTransformation(geom_srs,
+                                                           layer_srs)
+        elif srs is not None and not geom_srs.IsSame(srs):
+            geotransform = getCoordinateTransformation(geom_srs, srs)
+
+    if geotransform:
+        # @NOTE: the geometry belongs to a feature that is discarded
+        #        after the conversion so there is no need to clone it
+        err = geom.Transform(geotransform)
+        if err:
+            raise ValueError('geomery coordinate transformation failed')
+
+    return geom
+
+
+#: default memory budget (in bytes) for the cache of layer coordinates
+COORDS_CACHE_SIZE = 64 * 1024 ** 2
+
+
+def _coordsSize(features):
+    return sum(xyz.nbytes for fid, parts in features for kind, xyz in parts)
+
+
+#: cache of decoded (and reprojected) layer coordinates indexed by
+#: (layer key, target WKT)
+coordscache = utils.LRUCache(COORDS_CACHE_SIZE, sizefunc=_coordsSize)
+
+
+def layerCacheKey(filename, layer):
+    '''Return the key of *layer* of the *filename* datasource.
+
+    The key identifies layer coordinates in :data:`coordscache` (see
+    :func:`layerCoordinates`): it includes the absolute path, the size
+    and the modification time of the datasource file so that entries
+    of modified files are never used.
+    *layer* is the layer index or name.
+
+    '''
+
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        # not a file (e.g. a database connection string)
+        return (filename, None, None, layer)
+    return (os.path.abspath(filename), stat.st_size, stat.st_mtime, layer)
+
+
+def layerCoordinates(layer, srs=None, cachekey=None):
+    '''Return coordinates of all features in *layer*.
+
+    The returned value is a list of (fid, parts) tuples where *parts*
+    is the list of (kind, coordinates) tuples returned by
+    :func:`wkbToArrays`.
+
+    If the *srs* parameter is provided coordinates are converted into
+    the target spatial reference system.  Points sharing the same
+    coordinate transformation are converted all at once
+    (see :func:`transformPoints`).
+
+    If *cachekey* is provided results are stored in
+    :data:`coordscache` using *cachekey* and the target spatial
+    reference as key so that a layer is never reprojected twice.
+    Since OGR layers have no reference to their datasource the key
+    cannot be derived from *layer*: it must identify the datasource
+    and its version (see :func:`layerCacheKey`).
+
+    '''
+
+    if cachekey is not None:
+        key = (cachekey, srs.ExportToWkt() if srs is not None else None)
+        features = coordscache.get(key)
+        if features is not None:
+            return features
+
+    layer.ResetReading()
+    features = decodeFeatures(layer, layer.GetSpatialRef(), srs)
+    if cachekey is not None:
+        coordscache.put(key, features)
+
+    return features
+
+
+def decodeFeatures(features, layer_srs=None, srs=None, cache=None):
+    '''Decode and reproject coordinates of a sequence of OGR features.
+
+    Return a list of (fid, parts) tuples (see :func:`layerCoordinates`).
+    All points sharing the same coordinate transformation are
+    converted into the target *srs* at once.
+
+    The *cache* parameter is passed to
+    :func:`getCoordinateTransformation`.
+
+    '''
+
+    target_srs = srs if srs is not None else layer_srs
+    layer_transform = getCoordinateTransformation(layer_srs, target_srs,
+                                                  cache)
+
+    # decode geometries and collect arrays per coordinate transformation
+    result = []
+    groups = {}
+    for feature in features:
+        geom = feature.GetGeometryRef()
+        if not geom:
+            logging.debug('feature %d has no geometry' % feature.GetFID())
+            result.append((feature.GetFID(), []))
+            continue
+
+        parts = wkbToArrays(geom.ExportToWkb(WKB_BYTE_ORDER))
+        result.append((feature.GetFID(), parts))
+
+        geom_srs = geom.GetSpatialReference()
+        if (geom_srs is None or layer_srs is None or
+                                            geom_srs.IsSame(layer_srs)):
+            transform = layer_transform
+        else:
+            transform = getCoordinateTransformation(geom_srs, target_srs,
+                                                    cache)
+
+        if transform is not None:
+            arrays = groups.setdefault(id(transform), (transform, []))[1]
+            arrays.extend(xyz for kind, xyz in parts)
+
+    for transform, arrays in groups.values():
+        if not arrays:
+            continue
+        points = transformPoints(np.concatenate(arrays), transform)
+        offset = 0
+        for xyz in arrays:
+            xyz[...] = points[offset:offset + len(xyz)]
+            offset += len(xyz)
+
+    return result
+
+
+def layerToVectorItem(layer, srs=None, transform=None, cachekey=None):
+    '''Convert an OGR layer into a :class:`GraphicsVectorLayerItem`.
+
+    Parameters have the same meaning as in :func:`layerToGraphicsItem`.
+
+    Coordinates are retrieved using :func:`layerCoordinates` so that,
+    if *cachekey* is provided, re-converting a layer into the same
+    target spatial reference does not require reprojection.
+
+    '''
+
+    qlayer = GraphicsVectorLayerItem(layer.GetName())
+
+    # @NOTE: features are added at once so that the tile grid is computed
+    #        on the entire layer extent
+    features = []
+    for fid, parts in layerCoordinates(layer, srs, cachekey):
+        parts = [(kind, transformCoords(xyz, transform))
+                 for kind, xyz in parts]
+        features.append((fid, parts))
+
+    qlayer.addFeatures(features)
+
+    qlayer.setToolTip('Layer "%s": %d features.' % (layer.GetName(),
+                                                    qlayer.featureCount()))
+
+    return qlayer
+
+
+### Background layer loading ##################################################
+def _rectSamples(rect, nsamples=9):
+    # points along the border of rect (for non linear transformations)
+    t = np.linspace(0, 1, nsamples)
+    x0, y0, w, h = rect.left(), rect.top(), rect.width(), rect.height()
+    xs = np.concatenate((x0 + t * w, x0 + t * w,
+                         np.repeat(x0, nsamples), np.repeat(x0 + w, nsamples)))
+    ys = np.concatenate((np.repeat(y0, nsamples), np.repeat(y0 + h, nsamples),
+                         y0 + t * h, y0 + t * h))
+    return xs, ys
+
+
+def _boundingQRectF(x, y):
+    return QtCore.QRectF(QtCore.QPointF(np.nanmin(x), np.nanmin(y)),
+                         QtCore.QPointF(np.nanmax(x), np.nanmax(y)))
+
+
+def _transformRect(rect, srs_transform, transform=None):
+    # bounding rect of the transformed border of rect
+    xs, ys = _rectSamples(rect)
+    xyz = np.column_stack((xs, ys, np.zeros_like(xs)))
+    xy = transformCoords(transformPoints(xyz, srs_transform), transform)
+    return _boundingQRectF(xy[:, 0], xy[:, 1])
+
+
+def _geographicSRS(mapper):
+    srs = osr.SpatialReference()
+    srs.SetWellKnownGeogCS(mapper.geogCS)
+    return srs
+
+
+def viewportFilterRect(rect, mapper=None, layer_srs=None):
+    '''Map a scene rect into a spatial filter rect for an OGR layer.
+
+    If a :class:`gdalsupport.CoordinateMapper` is provided *rect* is
+    assumed to be in raster (pixel, line) coordinates and it is mapped
+    into geographic coordinates and then into the *layer_srs* spatial
+    reference.  Otherwise *rect* is assumed to be already in layer
+    coordinates.
+
+    '''
+
+    if mapper is None:
+        return QtCore.QRectF(rect)
+
+    lon, lat = mapper.imgToGeoPoints(*_rectSamples(rect))
+    xyz = np.column_stack((lon, lat, np.zeros_like(lon)))
+    transform = getCoordinateTransformation(_geographicSRS(mapper), layer_srs)
+    xyz = transformPoints(xyz, transform)
+
+    return _boundingQRectF(xyz[:, 0], xyz[:, 1])
+
+
+def mapperTransform(mapper):
+    '''Return (srs, transform) arguments to map features on a raster.
+
+    Features are converted into the spatial reference of the raster
+    (the one of the geotransform of the
+    :class:`gdalsupport.CoordinateMapper`, geographic coordinates
+    only if the raster is not projected) and then into raster (pixel,
+    line) coordinates applying the inverse geotransform with a
+    vectorized transform.
+
+    '''
+
+    @vectorized
+    def transform(x, y, z):
+        # @NOTE: geoToImgPoints only applies the inverse geotransform
+        #        (it does not convert geographic coordinates back into
+        #        the raster spatial reference)
+        pixel, line = mapper.geoToImgPoints(x, y)
+        return pixel, line
+
+    return mapper.sref.Clone(), transform
+
+
+class VectorLayerLoader(QtCore.QThread):
+    '''Worker thread that streams OGR features into a vector item.
+
+    The OGR layer is re-opened in the worker thread and only features
+    intersecting the requested rectangles (see :meth:`request` and
+    :meth:`requestViewport`) are read, using the OGR spatial filter.
+
+    Features are decoded and reprojected (see :func:`decodeFeatures`)
+    in chunks of :attr:`chunksize` features.  Simplified parts for
+    the pyramid of the item are computed in the worker thread too
+    (see :func:`simplifyParts`), then each chunk is emitted with the
+    :attr:`featuresReady` signal and added to the
+    :class:`GraphicsVectorLayerItem` in the GUI thread.
+    The item tile grid is set from the layer extent as soon as the
+    layer is open so that chunks are tiled consistently.
+
+    Each feature is loaded only once: when a new area is requested
+    only the features that have not been loaded yet are read.
+
+    '''
+
+    #: default number of features per chunk
+    CHUNK_SIZE = 1000
+
+    extentReady = QtCore.Signal(object, QtCore.QRectF)
+    featuresReady = QtCore.Signal(object, object, object)
+    loadingDone = QtCore.Signal(object)
+
+    def __init__(self, item, filename, layer=0, srs=None, transform=None,
+                 chunksize=None, mapper=None, parent=None):
+        super(VectorLayerLoader, self).__init__(parent)
+
+        self.item = item
+        self.filename = filename
+        self.layer = layer      # layer index or name
+        self.srs = srs.Clone() if srs is not None else None
+        self.transform = transform
+        self.chunksize = chunksize if chunksize else self.CHUNK_SIZE
+        self.mapper = mapper    # default mapper for requestViewport
+
+        # @NOTE: simplification settings are read in the GUI thread
+        self._simplification = item.simplificationLevels()
+
+        self._condition = threading.Condition()
+        self._rect = None
+        self._rect_srs = None
+        self._requested = False
+        self._stopped = False
+
+        # @NOTE: only accessed in the worker thread
+        self._loaded = set()
+
+        self.extentReady.connect(self._onExtentReady)
+        self.featuresReady.connect(self._onFeaturesReady)
+
+    def request(self, rect=None, srs=None):
+        '''Load features intersecting *rect*.
+
+        *rect* is expressed in layer coordinates unless the *srs*
+        spatial reference is specified.
+        If *rect* is None all features are loaded.
+        A new request interrupts the one currently processed.
+
+        '''
+
+        with self._condition:
+            self._rect = QtCore.QRectF(rect) if rect is not None else None
+            self._rect_srs = srs.Clone() if srs is not None else None
+            self._requested = True
+            self._condition.notify()
+
+    def requestViewport(self, graphicsview, mapper=None):
+        '''Load features in the area visible in *graphicsview*.
+
+        The visible scene rect is mapped into item coordinates and then
+        requested using :meth:`requestItemRect`.
+
+        '''
+
+        viewport = graphicsview.viewport().rect()
+        rect = graphicsview.mapToScene(viewport).boundingRect()
+        self.requestItemRect(self.item.mapRectFromScene(rect), mapper)
+
+    def requestItemRect(self, rect, mapper=None):
+        '''Load features intersecting *rect* (in item coordinates).
+
+        If a :class:`gdalsupport.CoordinateMapper` is available (the
+        *mapper* argument or :attr:`mapper`) *rect* is mapped into
+        geographic coordinates (see :func:`viewportFilterRect`).
+        Otherwise it is mapped back through :attr:`transform` and
+        requested in the :attr:`srs` spatial reference.
+
+        .. note:: only QTransform objects can be inverted: if
+                  :attr:`transform` is any other callable (or a
+                  singular QTransform) all features are loaded.
+
+        Conversion into layer coordinates is performed in the worker
+        thread.
+
+        '''
+
+        if mapper is None:
+            mapper = self.mapper
+        if mapper is not None:
+            self.request(viewportFilterRect(rect, mapper),
+                         _geographicSRS(mapper))
+            return
+
+        if self.transform is not None:
+            if (isinstance(self.transform, QtGui.QTransform) and
+                                            self.transform.isInvertible()):
+                inverted, invertible = self.transform.inverted()
+                rect = inverted.mapRect(rect)
+            else:
+                # arbitrary callables cannot be inverted
+                rect = None
+
+        self.request(rect, self.srs)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self.wait()
+
+    def _interrupted(self):
+        return self._requested or self._stopped
+
+    def _openLayer(self):
+        # @NOTE: the datasource must be kept alive as long as the layer
+        datasource = ogr.Open(self.filename)
+        if datasource is None:
+            raise IOError('unable to open "%s"' % self.filename)
+
+        if isinstance(self.layer, basestring):
+            layer = datasource.GetLayerByName(self.layer)
+        else:
+            layer = datasource.GetLayer(self.layer)
+        if layer is None:
+            raise ValueError('invalid layer: %s' % self.layer)
+
+        return datasource, layer
+
+    def run(self):
+        try:
+            datasource, layer = self._openLayer()
+        except (IOError, ValueError) as e:
+            logging.warning(str(e))
+            return
+
+        layer_srs = layer.GetSpatialRef()
+
+        # @NOTE: OSR transformations cannot be shared between threads
+        cache = utils.LRUCache(8)
+        srs_transform = getCoordinateTransformation(layer_srs, self.srs,
+                                                    cache)
+
+        xmin, xmax, ymin, ymax = layer.GetExtent()
+        extent = QtCore.QRectF(xmin, ymin, xmax - xmin, ymax - ymin)
+        extent = _transformRect(extent, srs_transform, self.transform)
+        self.extentReady.emit(self.item, extent)
+
+        # @NOTE: same tolerances of the item if its grid is set from the
+        #        layer extent (see _onExtentReady)
+        levels, resolution = self._simplification
+        if resolution is None:
+            resolution = GraphicsVectorLayerItem.defaultResolution(extent)
+        tolerances = simplificationTolerances(levels, resolution)
+
+        while True:
+            with self._condition:
+                while not self._requested and not self._stopped:
+                    self._condition.wait()
+
+                if self._stopped:
+                    break
+
+                rect = self._rect
+                rect_srs = self._rect_srs
+                self._requested = False
+
+            if rect is not None and rect_srs is not None:
+                transform = getCoordinateTransformation(rect_srs, layer_srs,
+                                                        cache)
+                if transform is not None:
+                    rect = _transformRect(rect, transform)
+
+            try:
+                completed = self._load(layer, rect, cache, tolerances)
+            except Exception as e:
+                logging.warning('unable to load features from "%s": %s' % (
+                                                        self.filename, e))
+            else:
+                if completed:
+                    self.loadingDone.emit(self.item)
+
+        layer = None
+        datasource = None
+
+    def _features(self, layer):
+        for feature in layer:
+            if self._interrupted():
+                break
+            if feature.GetFID() not in self._loaded:
+                yield feature
+
+    def _load(self, layer, rect, cache, tolerances=()):
+        if rect is None:
+            layer.SetSpatialFilter(None)
+        else:
+            layer.SetSpatialFilterRect(rect.left(), rect.top(),
+                                       rect.right(), rect.bottom())
+        layer.ResetReading()
+
+        layer_srs = layer.GetSpatialRef()
+        features = self._features(layer)
+        while True:
+            chunk = list(itertools.islice(features, self.chunksize))
+            if not chunk:
+                break
+
+            chunk = decodeFeatures(chunk, layer_srs, self.srs, cache)
+            parts = []
+            for fid, fparts in chunk:
+                fparts = [(kind, transformCoords(xyz, self.transform))
+                          for kind, xyz in fparts]
+                parts.append((fid, fparts))
+
+            # @NOTE: coordinates are simplified before any QPolygonF is
+            #        built (see GraphicsVectorLayerItem.addFeatures)
+            simplified = {}
+            for level, tolerance in tolerances:
+                simplified[level] = [simplifyParts(fparts, tolerance)
+                                     for fid, fparts in parts]
+            self.featuresReady.emit(self.item, parts,
+                                    (tolerances, simplified))
+
+            # @NOTE: features are marked as loaded only when delivered
+            #        so that they are read again if the chunk fails
+            self._loaded.update(fid for fid, fparts in parts)
+
+        return not self._interrupted()
+
+    def _onExtentReady(self, item, rect):
+        try:
+            if item.featureCount() == 0:
+                item.setGrid(rect)
+        except RuntimeError:
+            # the underlying C++ object has been deleted
+            pass
+
+    def _onFeaturesReady(self, item, features, simplified):
+        try:
+            item.addFeatures(features, simplified)
+        except RuntimeError:
+            # the underlying C++ object has been deleted
+            pass
+
+
+def rasterOverlayLoader(item, filename, layer, dataset, chunksize=None,
+                        parent=None):
+    '''Setup a loader for overlaying a vector layer to a raster.
+
+    Features are reprojected into the spatial reference of *dataset*
+    and mapped into its raster (pixel, line) coordinates (see
+    :func:`mapperTransform`) and the simplification
+    levels of *item* are set to the overview levels of the raster
+    (see :func:`gdalsupport.ovrLevels`) so that geometries and
+    raster data are decimated consistently.
+
+    Return a :class:`VectorLayerLoader` (not started yet) or None if
+    the raster has no geographic information.
+
+    '''
+
+    mapper = gdalsupport.coordinate_mapper(dataset)
+    if mapper is None:
+        return None
+
+    levels = gdalsupport.ovrLevels(dataset)
+    if not levels:
+        levels = GraphicsVectorLayerItem.SIMPLIFICATION_LEVELS
+    item.setSimplificationLevels(levels, resolution=1)
+
+    srs, transform = mapperTransform(mapper)
+    return VectorLayerLoader(item, filename, layer, srs, transform,
+                             chunksize, mapper, parent)
+
+
 ### Helpers for layers management #############################################
 #~ class LayerItemModel(QtGui.QStandardItemModel):
     #~ #def __init__(self, parent=None, **kargs):
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+### Copyright (C) 2008-2012 Antonio Valentino <a_valentino@users.sf.net>
+
+### This file is part of GSDView.
+
+### GSDView is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; either version 2 of the License, or
+### (at your option) any later version.
+
+### GSDView is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+
+### You should have received a copy of the GNU General Public License
+### along with GSDView; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from osgeo import gdal
+
+# Fix sys path
+from os.path import abspath, dirname
+GSDVIEWROOT = abspath(os.path.join(dirname(__file__),
+                                   os.pardir, os.pardir, os.pardir))
+sys.path.insert(0, GSDVIEWROOT)
+
+from gsdview.gdalbackend import gdalsupport
+
+
+class TestBlockAverage(unittest.TestCase):
+    def test_average(self):
+        data = np.arange(16.).reshape(4, 4)
+        result = gdalsupport.blockAverage(data, 2)
+        self.assertTrue(np.allclose(result, [[2.5, 4.5], [10.5, 12.5]]))
+
+    def test_partial_blocks(self):
+        data = np.arange(9.).reshape(3, 3)
+        result = gdalsupport.blockAverage(data, 2)
+        self.assertTrue(np.allclose(result, [[2, 3.5], [6.5, 8]]))
+
+    def test_nodata(self):
+        data = np.array([[1., -1.], [3., -1.]])
+        result = gdalsupport.blockAverage(data, 2, nodata=-1)
+        self.assertTrue(np.allclose(result, [[2.]]))
+        data = -np.ones((2, 2))
+        result = gdalsupport.blockAverage(data, 2, nodata=-1)
+        self.assertTrue(np.allclose(result, [[-1.]]))
+
+    def test_magphase(self):
+        data = np.array([[1j, -1j], [1, 1]])
+        result = gdalsupport.blockAverage(data, 2)
+        self.assertTrue(np.allclose(result, [[1.]]))
+
+
+class TestStatsAccumulator(unittest.TestCase):
+    def test_stats(self):
+        data = np.random.normal(1000., 10., (300, 200))
+        acc = gdalsupport.StatsAccumulator(data.dtype)
+        for y in range(0, 300, 7):
+            acc.update(data[y:y + 7])
+        vmin, vmax, mean, stddev = acc.stats()
+        self.assertEqual(vmin, data.min())
+        self.assertEqual(vmax, data.max())
+        self.assertAlmostEqual(mean, data.mean())
+        self.assertAlmostEqual(stddev, data.std())
+
+    def test_nodata(self):
+        data = np.arange(100, dtype='int16').reshape(10, 10)
+        acc = gdalsupport.StatsAccumulator(data.dtype, nodata=0)
+        acc.update(data)
+        self.assertEqual(acc.stats()[0], 1)
+        self.assertEqual(acc.count, 99)
+
+    def test_exact_histogram(self):
+        data = np.arange(256, dtype='uint8').reshape(16, 16)
+        acc = gdalsupport.StatsAccumulator(data.dtype)
+        acc.update(data)
+        hmin, hmax, hist = acc.histogram()
+        self.assertEqual((hmin, hmax), (-0.5, 255.5))
+        self.assertEqual(hist, [1] * 256)
+
+    def test_histogram_range_growth(self):
+        acc = gdalsupport.StatsAccumulator('float32')
+        acc.update(np.array([1., 2.]))
+        acc.update(np.array([-100., 500.]))
+        hmin, hmax, hist = acc.histogram(6)
+        self.assertEqual((hmin, hmax), (-100., 500.))
+        self.assertEqual(sum(hist), 4)
+        self.assertEqual(hist[0], 1)
+        self.assertEqual(hist[1], 2)
+        self.assertEqual(hist[-1], 1)
+
+
+class TestOverviewBuilder(unittest.TestCase):
+    LEVELS = [2, 3, 4, 8]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'test.tif')
+        driver = gdal.GetDriverByName('GTiff')
+        dataset = driver.Create(self.filename, 301, 257, 2, gdal.GDT_UInt16)
+        self.data = []
+        for index in (1, 2):
+            data = np.random.randint(0, 4000, (257, 301)).astype('uint16')
+            dataset.GetRasterBand(index).WriteArray(data)
+            self.data.append(data)
+        dataset = None
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_levels(self):
+        dataset = gdal.Open(self.filename)
+        builder = gdalsupport.OverviewBuilder(dataset, self.LEVELS)
+        self.assertTrue(builder.run())
+
+        for index, data in zip((1, 2), self.data):
+            band = dataset.GetRasterBand(index)
+            self.assertEqual(band.GetOverviewCount(), len(self.LEVELS))
+            for ovrindex, level in enumerate(self.LEVELS):
+                expected = np.round(gdalsupport.blockAverage(data, level))
+                result = band.GetOverview(ovrindex).ReadAsArray()
+                self.assertTrue(np.all(result == expected))
+
+    def test_statistics(self):
+        dataset = gdal.Open(self.filename)
+        builder = gdalsupport.OverviewBuilder(dataset, self.LEVELS)
+        self.assertTrue(builder.run())
+
+        for (stats, hist), data in zip(builder.statistics, self.data):
+            vmin, vmax, mean, stddev = stats
+            self.assertEqual(vmin, data.min())
+            self.assertEqual(vmax, data.max())
+            self.assertAlmostEqual(mean, data.mean())
+            self.assertAlmostEqual(stddev, data.std())
+            self.assertEqual(sum(hist[2]), data.size)
+
+    def test_strided(self):
+        dataset = gdal.Open(self.filename)
+        builder = gdalsupport.OverviewBuilder(dataset, [8], strided=True)
+        self.assertTrue(builder.run())
+
+        band = dataset.GetRasterBand(1)
+        self.assertEqual(band.GetOverviewCount(), 1)
+        ovrband = band.GetOverview(0)
+        self.assertEqual((ovrband.XSize, ovrband.YSize), (38, 33))
+        self.assertEqual(ovrband.ReadAsArray().shape, (33, 38))
+
+    def test_strided_values(self):
+        # @NOTE: the sample picked in each block by decimated reads
+        #        depends on the GDAL version so data are constant on
+        #        blocks of 24 (multiple of all levels) pixels
+        blocks = np.random.randint(0, 4000, (11, 13)).astype('uint16')
+        data = np.kron(blocks, np.ones((24, 24), 'uint16'))
+        filename = os.path.join(self.tmpdir, 'blocks.tif')
+        driver = gdal.GetDriverByName('GTiff')
+        dataset = driver.Create(filename, data.shape[1], data.shape[0], 1,
+                                gdal.GDT_UInt16)
+        dataset.GetRasterBand(1).WriteArray(data)
+        dataset = None
+
+        dataset = gdal.Open(filename)
+        builder = gdalsupport.OverviewBuilder(dataset, self.LEVELS,
+                                              strided=True)
+        self.assertTrue(builder.run())
+
+        band = dataset.GetRasterBand(1)
+        for ovrindex, level in enumerate(self.LEVELS):
+            result = band.GetOverview(ovrindex).ReadAsArray()
+            expected = data[::level, ::level]
+            self.assertTrue(np.all(result == expected))
+
+    def test_cancel(self):
+        dataset = gdal.Open(self.filename)
+        builder = gdalsupport.OverviewBuilder(dataset, self.LEVELS)
+        builder.cancel()
+        self.assertFalse(builder.run())
+
+
+class TestSampleData(unittest.TestCase):
+    def _band(self, xsize, ysize):
+        driver = gdal.GetDriverByName('MEM')
+        # @NOTE: MEM datasets have one line blocks
+        self.dataset = driver.Create('', xsize, ysize, 1, gdal.GDT_Byte)
+        band = self.dataset.GetRasterBand(1)
+        band.Fill(7)
+        return band
+
+    def test_small(self):
+        band = self._band(30, 20)
+        self.assertEqual(gdalsupport.sampleData(band, 1000).size, 600)
+
+    def test_blocks(self):
+        band = self._band(100, 100)
+        data = gdalsupport.sampleData(band, 1000)
+        self.assertTrue(0 < data.size <= 1000)
+        self.assertTrue(np.all(data == 7))
+
+    def test_large_blocks(self):
+        band = self._band(1000, 20)
+        data = gdalsupport.sampleData(band, 500)
+        self.assertTrue(0 < data.size <= 500)
+        self.assertTrue(np.all(data == 7))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,9 +21,16 @@
 
 import os
 import sys
+import math
+import time
+import shutil
+import struct
 import logging
+import tempfile
+import unittest
 
-from osgeo import ogr
+import numpy as np
+from osgeo import gdal, ogr, osr
 
 # Fix sys path
 from os.path import abspath, dirname
@@ -33,9 +40,10 @@ sys.path.insert(0, GSDVIEWROOT)
 
 from qt import QtCore, QtGui
 
+from gsdview import utils
 from gsdview.mousemanager import MouseManager
 from gsdview.layermanager import LayerManager
-from gsdview.gdalbackend import ogrqt4
+from gsdview.gdalbackend import ogrqt4, gdalsupport
 
 
 class VectorGraphicsApp(QtGui.QMainWindow):
@@ -123,6 +131,18 @@ class VectorGraphicsApp(QtGui.QMainWindow):
         toolbar.addActions(self.helpactions.actions())
         self.addToolBar(toolbar)
 
+        # Background loaders of large layers (see VectorLayerLoader)
+        self.loaders = []
+        self._viewportTimer = QtCore.QTimer(self)
+        self._viewportTimer.setSingleShot(True)
+        self._viewportTimer.setInterval(100)
+        self._viewportTimer.timeout.connect(self.requestViewport)
+        for scrollbar in (self.graphicsview.horizontalScrollBar(),
+                          self.graphicsview.verticalScrollBar()):
+            # @NOTE: the range of scrollbars changes when zooming
+            scrollbar.valueChanged.connect(self._viewportTimer.start)
+            scrollbar.rangeChanged.connect(self._viewportTimer.start)
+
         self.resize(900, 500)
         self.reset()
         self.statusBar().showMessage('Ready')
@@ -226,6 +246,9 @@ class VectorGraphicsApp(QtGui.QMainWindow):
 
     @QtCore.Slot()
     def reset(self):
+        for loader in self.loaders:
+            loader.stop()
+        self.loaders = []
         self.scene.clear()
         self.graphicsview.resetTransform()
         self.graphicsview.scale(1., -1.)
@@ -278,7 +301,21 @@ class VectorGraphicsApp(QtGui.QMainWindow):
             raise RuntimeError('too many layers: %d' % ds.GetLayerCount())
 
         for index, layer in enumerate(ds):
-            qlayer = ogrqt4.layerToGraphicsItem(layer, srs, transform)
+            if layer.GetFeatureCount() > ogrqt4.MAX_FEATURE_COUNT:
+                # stream features from a worker thread
+                qlayer = ogrqt4.GraphicsVectorLayerItem(layer.GetName())
+                loader = ogrqt4.VectorLayerLoader(qlayer, filename, index,
+                                                  srs, transform, parent=self)
+                loader.extentReady.connect(self._onExtentReady)
+                loader.featuresReady.connect(self._onFeaturesReady)
+                QtGui.QApplication.instance().aboutToQuit.connect(
+                                                                loader.stop)
+                self.loaders.append(loader)
+                loader.start()
+            else:
+                cachekey = ogrqt4.layerCacheKey(filename, index)
+                qlayer = ogrqt4.layerToGraphicsItem(layer, srs, transform,
+                                                    cachekey)
             #qlayer.datasource = ds.GetName()
             #qlayer.index = index
             qlayer.setData(ogrqt4.DATAKEY['datasource'], ds.GetName())
@@ -287,7 +324,13 @@ class VectorGraphicsApp(QtGui.QMainWindow):
             if affine_transform:
                 qlayer.setTransform(affine_transform)
 
-            if qlayer.childItems():
+            if isinstance(qlayer, ogrqt4.GraphicsVectorLayerItem):
+                nfeatures = qlayer.featureCount()
+            else:
+                nfeatures = len(qlayer.childItems())
+
+            if nfeatures or isinstance(qlayer,
+                                       ogrqt4.GraphicsVectorLayerItem):
                 self.scene.addItem(qlayer)
 
                 item = QtGui.QStandardItem(layer.GetName())
@@ -296,12 +339,32 @@ class VectorGraphicsApp(QtGui.QMainWindow):
                 item.setData(qlayer)
                 item.setToolTip(self.tr('Layer "%s": %d features.' % (
                                                     layer.GetName(),
-                                                    len(qlayer.childItems()))))
+                                                    nfeatures)))
 
                 self.model.appendRow(item)
 
         self.treeview.resizeColumnToContents(0)
 
+    @QtCore.Slot()
+    def requestViewport(self):
+        # only features in the visible area are read
+        for loader in self.loaders:
+            loader.requestViewport(self.graphicsview)
+
+    def _onExtentReady(self, qlayer, rect):
+        # show the entire layer and load the visible features
+        self.scene.setSceneRect(self.scene.itemsBoundingRect().united(rect))
+        self.graphicsview.fitInView(rect, QtCore.Qt.KeepAspectRatio)
+        self.requestViewport()
+
+    def _onFeaturesReady(self, qlayer, features, simplified):
+        for row in range(self.model.rowCount()):
+            item = self.model.item(row)
+            if item.data() is qlayer:
+                item.setToolTip(self.tr('Layer "%s": %d features.' % (
+                                                    qlayer.name,
+                                                    qlayer.featureCount())))
+
     def _autocolor(self):
         COLORS = (
             #QtCore.Qt.white,
@@ -344,6 +407,517 @@ class VectorGraphicsApp(QtGui.QMainWindow):
             qlayer.setBrush(brush)
 
 
+### Tests #####################################################################
+POLYGON_WITH_HOLE = ('POLYGON ((0 0, 10 0, 10 10, 0 10, 0 0), '
+                     '(2 2, 4 2, 4 4, 2 4, 2 2))')
+
+
+class TestWkbToArrays(unittest.TestCase):
+    def test_polygon(self):
+        geom = ogr.CreateGeometryFromWkt(POLYGON_WITH_HOLE)
+        parts = ogrqt4.wkbToArrays(geom.ExportToWkb(ogrqt4.WKB_BYTE_ORDER))
+        self.assertEqual([kind for kind, xyz in parts],
+                         ['polygon', 'polygon'])
+        self.assertEqual(parts[0][1].shape, (5, 3))
+        # the hole is reversed (clockwise)
+        self.assertTrue(np.all(parts[1][1][:, :2] ==
+                               [(2, 2), (2, 4), (4, 4), (4, 2), (2, 2)]))
+        self.assertTrue(np.all(parts[1][1][:, 2] == 0))
+
+    def test_ring_orientation(self):
+        geom = ogr.CreateGeometryFromWkt(
+            'MULTIPOLYGON (((0 0, 0 10, 10 10, 10 0, 0 0), '
+            '(2 2, 4 2, 4 4, 2 4, 2 2), (6 6, 6 8, 8 8, 8 6, 6 6)), '
+            '((20 0, 30 0, 30 10, 20 0)))')
+        parts = ogrqt4.wkbToArrays(geom.ExportToWkb(ogrqt4.WKB_BYTE_ORDER))
+        areas = [ogrqt4._signedArea(xyz) for kind, xyz in parts]
+        self.assertEqual(areas, [200, -8, -8, 100])
+
+    def test_big_endian_25d(self):
+        points = [(1., 2., 3.), (4., 5., 6.)]
+        wkb = struct.pack('>BII', 0, 0x80000002, len(points))
+        for point in points:
+            wkb += struct.pack('>3d', *point)
+        parts = ogrqt4.wkbToArrays(wkb)
+        self.assertEqual(len(parts), 1)
+        self.assertEqual(parts[0][0], 'line')
+        self.assertTrue(np.all(parts[0][1] == points))
+
+    def test_iso_m(self):
+        # M values are discarded
+        wkb = struct.pack('<BII', 1, 2002, 2) + struct.pack('<6d',
+                                                            1, 2, 9, 3, 4, 9)
+        xyz = ogrqt4.wkbToArrays(wkb)[0][1]
+        self.assertTrue(np.all(xyz == [(1, 2, 0), (3, 4, 0)]))
+
+    def test_collection(self):
+        geom = ogr.CreateGeometryFromWkt(
+            'GEOMETRYCOLLECTION (POINT (1 2), LINESTRING (0 0, 1 1), '
+            'MULTIPOLYGON (((0 0, 1 0, 1 1, 0 0))))')
+        parts = ogrqt4.wkbToArrays(geom.ExportToWkb(ogrqt4.WKB_BYTE_ORDER))
+        self.assertEqual([kind for kind, xyz in parts],
+                         ['point', 'line', 'polygon'])
+
+
+def _wgs84():
+    srs = osr.SpatialReference()
+    srs.SetWellKnownGeogCS('WGS84')
+    return srs
+
+
+def _utm(zone):
+    srs = _wgs84()
+    srs.SetUTM(zone)
+    return srs
+
+
+class TestCoordinateTransformation(unittest.TestCase):
+    def setUp(self):
+        self.cache = utils.LRUCache(8)
+
+    def test_cache(self):
+        src, dst = _wgs84(), _utm(32)
+        transform = ogrqt4.getCoordinateTransformation(src, dst, self.cache)
+        self.assertTrue(transform is not None)
+        self.assertTrue(ogrqt4.getCoordinateTransformation(
+                            src.Clone(), dst.Clone(), self.cache) is transform)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_identity(self):
+        srs = _wgs84()
+        for src, dst in ((srs, srs.Clone()), (None, srs), (srs, None)):
+            self.assertTrue(ogrqt4.getCoordinateTransformation(
+                                                src, dst, self.cache) is None)
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestDecodeFeatures(unittest.TestCase):
+    def setUp(self):
+        self.layer_srs = _wgs84()
+        self.srs = _utm(32)
+
+        geometries = (
+            ('POINT (9 45)', None),
+            ('LINESTRING (8 44, 10 46)', _wgs84()),
+            ('POINT (500000 5000000)', _utm(33)),
+            ('POINT (400000 4900000)', _utm(33)),
+            (None, None),
+        )
+        defn = ogr.FeatureDefn()
+        self.features = []
+        for fid, (wkt, srs) in enumerate(geometries):
+            feature = ogr.Feature(defn)
+            feature.SetFID(fid)
+            if wkt is not None:
+                geom = ogr.CreateGeometryFromWkt(wkt)
+                if srs is not None:
+                    geom.AssignSpatialReference(srs)
+                feature.SetGeometry(geom)
+            self.features.append(feature)
+
+    def _expected(self, feature):
+        geom = feature.GetGeometryRef().Clone()
+        srs = geom.GetSpatialReference() or self.layer_srs
+        geom.Transform(osr.CoordinateTransformation(srs, self.srs))
+        return np.array(geom.GetPoints())[:, :2]
+
+    def test_grouping(self):
+        calls = []
+        transformPoints = ogrqt4.transformPoints
+
+        def counter(xyz, transform):
+            calls.append(len(xyz))
+            return transformPoints(xyz, transform)
+
+        ogrqt4.transformPoints = counter
+        try:
+            result = ogrqt4.decodeFeatures(self.features, self.layer_srs,
+                                           self.srs, utils.LRUCache(8))
+        finally:
+            ogrqt4.transformPoints = transformPoints
+
+        # a single call for each coordinate transformation
+        self.assertEqual(sorted(calls), [2, 3])
+
+        self.assertEqual([fid for fid, parts in result], list(range(5)))
+        self.assertEqual(result[-1][1], [])
+        for feature, (fid, parts) in zip(self.features[:-1], result):
+            xyz = np.concatenate([xyz for kind, xyz in parts])
+            self.assertTrue(np.allclose(xyz[:, :2], self._expected(feature),
+                                        atol=1e-6))
+
+
+class TestLayerCoordinates(unittest.TestCase):
+    def setUp(self):
+        driver = ogr.GetDriverByName('Memory')
+        self.datasource = driver.CreateDataSource('memory')
+        self.layer = self.datasource.CreateLayer('points', _wgs84(),
+                                                 ogr.wkbPoint)
+        for x in range(3):
+            feature = ogr.Feature(self.layer.GetLayerDefn())
+            feature.SetGeometry(ogr.CreateGeometryFromWkt(
+                                                    'POINT (%d 45)' % x))
+            self.layer.CreateFeature(feature)
+
+        # @NOTE: a key not used by other tests (coordscache is global)
+        self.cachekey = ('memory', id(self))
+
+    def test_cache_hit(self):
+        features = ogrqt4.layerCoordinates(self.layer, _utm(32),
+                                           self.cachekey)
+        self.assertEqual(len(features), 3)
+        self.assertTrue(ogrqt4.layerCoordinates(
+                            self.layer, _utm(32), self.cachekey) is features)
+        self.assertFalse(ogrqt4.layerCoordinates(
+                            self.layer, _utm(33), self.cachekey) is features)
+
+    def test_no_cachekey(self):
+        features = ogrqt4.layerCoordinates(self.layer)
+        self.assertEqual(len(features), 3)
+        self.assertFalse(ogrqt4.layerCoordinates(self.layer) is features)
+
+    def test_cachekey(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'layer.geojson')
+            with open(filename, 'w') as fd:
+                fd.write('{}')
+
+            key = ogrqt4.layerCacheKey(filename, 0)
+            self.assertEqual(ogrqt4.layerCacheKey(filename, 0), key)
+            self.assertNotEqual(ogrqt4.layerCacheKey(filename, 1), key)
+
+            stat = os.stat(filename)
+            os.utime(filename, (stat.st_atime, stat.st_mtime + 10))
+            self.assertNotEqual(ogrqt4.layerCacheKey(filename, 0), key)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestTransformCoords(unittest.TestCase):
+    def setUp(self):
+        self.xyz = np.array([(0., 0., 0.), (1., 2., 0.), (3., 4., 5.)])
+        self.expected = np.array([(1., -1.), (3., 3.), (7., 7.)])
+
+    def test_none(self):
+        result = ogrqt4.transformCoords(self.xyz)
+        self.assertTrue(np.all(result == self.xyz[:, :2]))
+
+    def test_callable(self):
+        transform = lambda x, y, z: (2 * x + 1, 2 * y - 1, z)
+        result = ogrqt4.transformCoords(self.xyz, transform)
+        self.assertTrue(np.allclose(result, self.expected))
+
+    def test_vectorized(self):
+        calls = []
+
+        @ogrqt4.vectorized
+        def transform(x, y, z):
+            calls.append(len(x))
+            return 2 * x + 1, 2 * y - 1
+
+        result = ogrqt4.transformCoords(self.xyz, transform)
+        self.assertTrue(np.allclose(result, self.expected))
+        self.assertEqual(calls, [3])
+
+    def test_qtransform(self):
+        transform = QtGui.QTransform(2, 0, 0, 2, 1, -1)
+        result = ogrqt4.transformCoords(self.xyz, transform)
+        self.assertTrue(np.allclose(result, self.expected))
+
+
+class TestGeometryConversion(unittest.TestCase):
+    def test_polygon_with_hole(self):
+        geom = ogr.CreateGeometryFromWkt(POLYGON_WITH_HOLE)
+        qitem = ogrqt4.geometryToGraphicsItem(geom)
+        children = qitem.childItems()
+        self.assertEqual(len(children), 2)
+        for child in children:
+            self.assertTrue(isinstance(child, QtGui.QGraphicsPolygonItem))
+            self.assertEqual(child.polygon().count(), 5)
+        self.assertEqual(children[1].polygon().boundingRect(),
+                         QtCore.QRectF(2, 2, 2, 2))
+
+    def test_polygon_parts(self):
+        geom = ogr.CreateGeometryFromWkt(POLYGON_WITH_HOLE)
+        parts = ogrqt4.geometryToParts(geom)
+        self.assertEqual([kind for kind, qpoly in parts],
+                         ['polygon', 'polygon'])
+        self.assertEqual(parts[0][1].boundingRect(),
+                         QtCore.QRectF(0, 0, 10, 10))
+
+    def test_bare_ring(self):
+        geom = ogr.CreateGeometryFromWkt(POLYGON_WITH_HOLE)
+        ring = geom.GetGeometryRef(1)
+        parts = ogrqt4.geometryToParts(ring)
+        self.assertEqual(len(parts), 1)
+        self.assertEqual(parts[0][1].count(), 5)
+
+
+
+class TestGridIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        xy = rng.uniform(0, 1000, (500, 2))
+        wh = rng.exponential(20, (500, 2))
+        self.bboxes = np.column_stack((xy, xy + wh))
+        self.bboxes[::50] = np.nan      # empty geometries
+
+    def _bruteForce(self, xmin, ymin, xmax, ymax):
+        b = self.bboxes
+        mask = ((b[:, 0] <= xmax) & (b[:, 2] >= xmin) &
+                (b[:, 1] <= ymax) & (b[:, 3] >= ymin))
+        return sorted(np.flatnonzero(mask))
+
+    def test_query(self):
+        index = ogrqt4.GridIndex(self.bboxes)
+        self.assertEqual(len(index), len(self.bboxes))
+        rng = np.random.RandomState(1)
+        for x, y, w, h in rng.uniform(-100, 1100, (100, 4)):
+            box = (x, y, x + abs(w) / 4, y + abs(h) / 4)
+            self.assertEqual(sorted(index.query(*box)),
+                             self._bruteForce(*box))
+
+    def test_point_query(self):
+        index = ogrqt4.GridIndex(self.bboxes)
+        x, y = self.bboxes[1, :2]
+        self.assertEqual(sorted(index.query(x, y, x, y)),
+                         self._bruteForce(x, y, x, y))
+
+    def test_outside(self):
+        index = ogrqt4.GridIndex(self.bboxes)
+        self.assertEqual(len(index.query(2000, 2000, 3000, 3000)), 0)
+
+    def test_empty(self):
+        index = ogrqt4.GridIndex([(np.nan,) * 4])
+        self.assertEqual(len(index.query(0, 0, 1, 1)), 0)
+
+
+class TestSimplifyCoords(unittest.TestCase):
+    @staticmethod
+    def _distance(points, coords):
+        # distance of points from the polyline defined by coords
+        dist = np.inf
+        for p0, p1 in zip(coords[:-1], coords[1:]):
+            d = p1 - p0
+            norm = np.dot(d, d)
+            if norm == 0:
+                t = np.zeros(len(points))
+            else:
+                t = np.clip(np.dot(points - p0, d) / norm, 0, 1)
+            proj = p0 + t[:, np.newaxis] * d
+            dist = np.minimum(dist, np.hypot(*(points - proj).T))
+        return dist
+
+    def test_error_bound(self):
+        rng = np.random.RandomState(0)
+        coords = np.cumsum(rng.normal(size=(1000, 2)), axis=0)
+        for tolerance in (0.5, 2, 10):
+            result = ogrqt4.simplifyCoords(coords, tolerance)
+            self.assertTrue(len(result) < len(coords))
+            self.assertTrue(np.all(result[0] == coords[0]))
+            self.assertTrue(np.all(result[-1] == coords[-1]))
+            self.assertTrue(np.all(self._distance(coords, result) <=
+                                   tolerance + 1e-9))
+
+    def test_closed_ring(self):
+        t = np.linspace(0, 2 * np.pi, 100)
+        coords = np.column_stack((np.cos(t), np.sin(t)))
+        coords[-1] = coords[0]
+        result = ogrqt4.simplifyCoords(coords, 0.01)
+        self.assertTrue(3 < len(result) < len(coords))
+        self.assertTrue(np.all(result[0] == result[-1]))
+
+    def test_collinear(self):
+        coords = np.column_stack((np.arange(10.), np.arange(10.)))
+        result = ogrqt4.simplifyCoords(coords, 1e-6)
+        self.assertTrue(np.all(result == coords[[0, -1]]))
+
+    def test_zero_tolerance(self):
+        coords = np.array([(0., 0.), (1., 1e-9), (2., 0.)])
+        self.assertTrue(ogrqt4.simplifyCoords(coords, 0) is coords)
+
+
+class TestVectorLayerItem(unittest.TestCase):
+    def _square(self, x, y, size):
+        return ('polygon', QtGui.QPolygonF([
+            QtCore.QPointF(x, y), QtCore.QPointF(x + size, y),
+            QtCore.QPointF(x + size, y + size), QtCore.QPointF(x, y + size),
+            QtCore.QPointF(x, y)]))
+
+    def _paths(self, item):
+        return [tile.polygons for tile in item._levelTiles().values()]
+
+    def _decode(self, wkt):
+        geom = ogr.CreateGeometryFromWkt(wkt)
+        wkb = geom.ExportToWkb(ogrqt4.WKB_BYTE_ORDER)
+        return [(kind, xyz[:, :2]) for kind, xyz in ogrqt4.wkbToArrays(wkb)]
+
+    def test_overlapping_polygons(self):
+        item = ogrqt4.GraphicsVectorLayerItem()
+        item.setGrid(QtCore.QRectF(0, 0, 15, 15), 1)
+        item.addFeatures([(0, [self._square(0, 0, 10)]),
+                          (1, [self._square(5, 5, 10)])])
+        paths = self._paths(item)
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(paths[0].fillRule(), QtCore.Qt.WindingFill)
+        self.assertTrue(paths[0].contains(QtCore.QPointF(7, 7)))
+
+    def test_polygon_with_hole(self):
+        item = ogrqt4.GraphicsVectorLayerItem()
+        item.setGrid(QtCore.QRectF(0, 0, 20, 20), 1)
+        item.addFeatures([(0, self._decode(POLYGON_WITH_HOLE)),
+                          (1, [self._square(12, 12, 5)])])
+        paths = self._paths(item)
+        self.assertEqual(len(paths), 1)
+        self.assertTrue(paths[0].contains(QtCore.QPointF(7, 7)))
+        self.assertTrue(paths[0].contains(QtCore.QPointF(14, 14)))
+        self.assertFalse(paths[0].contains(QtCore.QPointF(3, 3)))
+
+        # per feature paths (for picking) do not depend on orientation
+        self.assertEqual(item.featuresAt(QtCore.QPointF(3, 3)), [])
+        self.assertEqual(item.featuresAt(QtCore.QPointF(7, 7)), [0])
+
+    def _lineItem(self, tolerances=None):
+        item = ogrqt4.GraphicsVectorLayerItem()
+        item.setGrid(QtCore.QRectF(0, 0, 100, 100))
+        level = item.simplificationTolerances()[0][0]
+        if tolerances is None:
+            tolerances = item.simplificationTolerances()
+
+        # the precomputed line is not simplified (it would have 2 vertices)
+        coords = np.array([(0, 0), (50, 0.001), (100, 0)], np.float64)
+        item.addFeatures([(0, [('line', coords)])],
+                         (tolerances, {level: [[('line', coords)]]}))
+        return item, level
+
+    def _lineVertices(self, tiles):
+        return sum(tile.lines.elementCount() for tile in tiles.values())
+
+    def test_lazy_pyramid(self):
+        item, level = self._lineItem()
+        self.assertEqual(item._pyramid, {})
+        self.assertEqual(self._lineVertices(item._levelTiles(level)), 3)
+        self.assertEqual(self._lineVertices(item._levelTiles()), 3)
+
+    def test_mismatching_tolerances(self):
+        item, level = self._lineItem(((3, 1e6),))
+        self.assertEqual(self._lineVertices(item._levelTiles(level)), 2)
+
+
+class TestMapperTransform(unittest.TestCase):
+    def test_projected_raster(self):
+        srs = osr.SpatialReference()
+        srs.SetUTM(33)
+        srs.SetWellKnownGeogCS('WGS84')
+        dataset = gdal.GetDriverByName('MEM').Create('', 100, 100)
+        dataset.SetProjection(srs.ExportToWkt())
+        dataset.SetGeoTransform((500000, 10, 0, 4500000, 0, -10))
+        mapper = gdalsupport.coordinate_mapper(dataset)
+
+        pixels = np.array([(10., 20.), (75., 40.)])
+        xyz = np.column_stack((500000 + 10 * pixels[:, 0],
+                               4500000 - 10 * pixels[:, 1], np.zeros(2)))
+        wgs84 = osr.SpatialReference()
+        wgs84.SetWellKnownGeogCS('WGS84')
+        lonlat = ogrqt4.transformPoints(
+                            xyz, osr.CoordinateTransformation(srs, wgs84))
+
+        target, transform = ogrqt4.mapperTransform(mapper)
+        self.assertTrue(target.IsSame(srs))
+        xyz = ogrqt4.transformPoints(
+                lonlat, ogrqt4.getCoordinateTransformation(wgs84, target))
+        result = ogrqt4.transformCoords(xyz, transform)
+        self.assertTrue(np.allclose(result, pixels, atol=1e-6))
+
+
+class TestVectorLayerLoader(unittest.TestCase):
+    def _loader(self, transform=None):
+        srs = osr.SpatialReference()
+        srs.SetWellKnownGeogCS('WGS84')
+        item = ogrqt4.GraphicsVectorLayerItem()
+        return ogrqt4.VectorLayerLoader(item, 'unused.shp', srs=srs,
+                                        transform=transform)
+
+    def test_item_rect(self):
+        loader = self._loader()
+        rect = QtCore.QRectF(0, 0, 10, 5)
+        loader.requestItemRect(rect)
+        self.assertEqual(loader._rect, rect)
+        self.assertTrue(loader._rect_srs.IsSame(loader.srs))
+
+    def test_qtransform(self):
+        loader = self._loader(QtGui.QTransform.fromScale(2, -2))
+        loader.requestItemRect(QtCore.QRectF(0, -10, 20, 10))
+        self.assertEqual(loader._rect, QtCore.QRectF(0, 0, 10, 5))
+        self.assertTrue(loader._rect_srs.IsSame(loader.srs))
+
+    def test_callable(self):
+        loader = self._loader(ogrqt4.vectorized(lambda x, y, z: (x, y)))
+        loader.requestItemRect(QtCore.QRectF(0, 0, 10, 5))
+        self.assertTrue(loader._requested)
+        self.assertTrue(loader._rect is None)
+
+
+### Benchmark #################################################################
+def _getpointParts(geom, transform=None):
+    # legacy conversion: one GetPoint call per vertex
+    if geom.GetGeometryCount():
+        parts = []
+        for index in range(geom.GetGeometryCount()):
+            parts.extend(_getpointParts(geom.GetGeometryRef(index),
+                                        transform))
+        return parts
+
+    qpoly = QtGui.QPolygonF(geom.GetPointCount())
+    for index in range(geom.GetPointCount()):
+        point = geom.GetPoint(index)
+        if transform:
+            point = transform(*point)
+        qpoly[index] = QtCore.QPointF(point[0], point[1])
+    return [('line', qpoly)]
+
+
+def _testpolygon(nvertices):
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for index in range(nvertices - 1):
+        angle = 2 * math.pi * index / (nvertices - 1)
+        ring.AddPoint_2D(math.cos(angle), math.sin(angle))
+    ring.CloseRings()
+    polygon = ogr.Geometry(ogr.wkbPolygon)
+    polygon.AddGeometry(ring)
+    return polygon
+
+
+def benchmark(nvertices=50000, repeat=5):
+    '''Compare the per-vertex and the WKB based geometry conversion.'''
+
+    geom = _testpolygon(nvertices)
+    transform = lambda x, y, z: (2 * x + 1, 2 * y - 1, z)
+    vtransform = ogrqt4.vectorized(lambda x, y, z: (2 * x + 1, 2 * y - 1, z))
+
+    cases = (
+        ('GetPoint', _getpointParts, None),
+        ('WKB', ogrqt4.geometryToParts, None),
+        ('GetPoint+transform', _getpointParts, transform),
+        ('WKB+transform', ogrqt4.geometryToParts, transform),
+        ('WKB+vectorized', ogrqt4.geometryToParts, vtransform),
+    )
+
+    print('polygon size: %d vertices' % geom.GetGeometryRef(0).GetPointCount())
+    print('%-20s  %10s  %14s' % ('method', 'ms', 'vertices/s'))
+    for name, func, transform in cases:
+        best = None
+        for index in range(repeat):
+            t0 = time.time()
+            func(geom, transform)
+            elapsed = time.time() - t0
+            if best is None or elapsed < best:
+                best = elapsed
+        print('%-20s  %10.2f  %14.0f' % (name, best * 1e3,
+                                         nvertices / max(best, 1e-9)))
+
+
 def main(*argv):
     # @NOTE: basic config doesn't work since sip use it before this line
     #logging.basicConfig(level=logging.DEBUG,
@@ -368,6 +942,11 @@ def main(*argv):
 
 
 if __name__ == '__main__':
+    if '--benchmark' in sys.argv:
+        app = QtGui.QApplication(sys.argv)
+        benchmark()
+        sys.exit(0)
+
     import glob
     datadir = os.path.expanduser('~/Immagini/naturalearth_small_scale')
     shapefiles = glob.glob(os.path.join(datadir, '110m_physical', '*.shp'))
@@ -22,6 +22,10 @@
 '''Tools for geo-spatial images handling and visualization.'''
 
 
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
 
 
@@ -150,22 +154,21 @@ def histogram_equalized_lut(hist, dtype='uint8', fill=False):
                          'selected data type (%s)' % (nbins, dtype.name))
 
     if fill:
-        nout = nbins
-    else:
         nout = nmax
+    else:
+        nout = nbins
 
-    lut = np.cumsum(hist) - hist[0]
+    cdf = np.cumsum(hist) - hist[0]
 
-    total = float(lut[-1])
+    total = float(cdf[-1])
     if total == 0:
-        return np.zeros(nout)
+        return np.zeros(nout, dtype)
 
-    lut = nmax / total * (lut + hist / 2.)
-    lut.clip(0, nout - 1)
-    lut.resize(nout)
+    lut = np.empty(nout)
+    lut[:nbins] = np.round((nmax - 1) / total * cdf)
     lut[nbins:] = lut[nbins - 1]
 
-    return lut.asarray(dtype)
+    return lut.clip(0, nmax - 1).astype(dtype)
 
 
 def log_lut(dtype='uint8'):
@@ -219,6 +222,329 @@ def square(dtype='uint8'):
     return lut.astype(dtype)
 
 
+### Histogram utils ##########################################################
+#: default number of bins for histograms of non integer data
+HISTOGRAM_BINS = 1024
+
+
+class Histogram(object):
+    '''Image histogram.
+
+    Provides histogram driven stretching parameters: percentile clip,
+    sigma clip and equalization.
+    All of them are computed from bin counts so, once the histogram has
+    been computed, no further access to pixel data is needed.
+
+    The histogram of integer data spanning less than *nbins* values
+    has one bin per value.
+
+    '''
+
+    def __init__(self, hist, edges):
+        self.hist = np.asarray(hist)
+        self.edges = np.asarray(edges, dtype='float64')
+        if len(self.edges) != len(self.hist) + 1:
+            raise ValueError('len(edges) must be len(hist) + 1')
+
+        cdf = np.zeros(len(self.edges))
+        np.cumsum(self.hist, out=cdf[1:])
+        self._cdf = cdf
+        self._curves = {}
+
+    @classmethod
+    def fromdata(cls, data, nbins=HISTOGRAM_BINS, nodata=None):
+        '''Compute the histogram of *data*.
+
+        Invalid (NaN and infinite) values and values equal to *nodata*
+        are not taken into account.
+        Return None if *data* does not contain valid values.
+
+        '''
+
+        data = np.ravel(data)
+        if nodata is not None:
+            data = data[data != nodata]
+        if data.dtype.kind in 'fc':
+            data = data[np.isfinite(data)]
+        if data.size == 0:
+            return None
+
+        vmin, vmax = data.min(), data.max()
+        if data.dtype.kind in 'iub' and (int(vmax) - int(vmin)) < nbins:
+            vmin, vmax = int(vmin), int(vmax)
+            hist = np.bincount((data.astype('int64') - vmin).ravel())
+            edges = np.arange(vmin, vmax + 2) - 0.5
+        else:
+            if vmin == vmax:
+                vmin, vmax = vmin - 0.5, vmax + 0.5
+            hist, edges = np.histogram(data, nbins, (vmin, vmax))
+
+        return cls(hist, edges)
+
+    @property
+    def total(self):
+        return self._cdf[-1]
+
+    @property
+    def vmin(self):
+        return self.edges[0]
+
+    @property
+    def vmax(self):
+        return self.edges[-1]
+
+    @property
+    def centers(self):
+        return (self.edges[:-1] + self.edges[1:]) / 2.
+
+    def mean(self):
+        return np.dot(self.hist, self.centers) / self.total
+
+    def std(self):
+        deviations = self.centers - self.mean()
+        return np.sqrt(np.dot(self.hist, deviations ** 2) / self.total)
+
+    def cdf(self, values):
+        '''Cumulative distribution function (in [0, 1]) at *values*.'''
+
+        return np.interp(values, self.edges, self._cdf / self.total)
+
+    def percentile(self, q):
+        '''Return the value(s) corresponding to percentile(s) *q*.'''
+
+        q = np.asarray(q, dtype='float64') / 100.
+        return np.interp(q * self.total, self._cdf, self.edges)
+
+    def percentile_range(self, lower=2., upper=98.):
+        '''Return the input range for a percentile clip stretch.'''
+
+        vmin, vmax = self.percentile([lower, upper])
+        return float(vmin), float(vmax)
+
+    def sigma_range(self, nsigma=3.):
+        '''Return the input range for a sigma clip stretch.'''
+
+        mean, std = self.mean(), self.std()
+        vmin = max(mean - nsigma * std, self.vmin)
+        vmax = min(mean + nsigma * std, self.vmax)
+        return float(vmin), float(vmax)
+
+    def equalization(self, imin=None, imax=None):
+        '''Return the equalization curve for the [imin, imax] range.
+
+        The returned curve maps [0, 1] normalized input values onto
+        [0, 1] and it can be used as :attr:`LUTStretcher.curve`.
+        Curves are cached so that repeated calls with the same
+        arguments return the same object.
+
+        '''
+
+        if imin is None:
+            imin = self.vmin
+        if imax is None:
+            imax = self.vmax
+
+        key = (imin, imax)
+        curve = self._curves.get(key)
+        if curve is None:
+            cmin, cmax = self.cdf([imin, imax])
+            cscale = (cmax - cmin) or 1.
+
+            def curve(x):
+                return (self.cdf(imin + x * (imax - imin)) - cmin) / cscale
+
+            self._curves[key] = curve
+
+        return curve
+
+
+### LUT cache ################################################################
+#: input data types for which LUTs are indexed directly by samples
+LUT_DIRECT_TYPES = (np.dtype('uint8'), np.dtype('int8'),
+                    np.dtype('uint16'), np.dtype('int16'))
+
+#: maximum number of LUTs kept in the LUT cache
+LUT_CACHE_SIZE = 32
+
+# @NOTE: gsdview.utils.LRUCache is not used in order to keep this module
+#        independent from Qt.  The cache is small so the LRU order is
+#        simply tracked by a list of keys (Python 2.6 has no OrderedDict)
+_lutcache = {}
+_lutcache_keys = []     # least recently used first
+_lutcache_lock = threading.Lock()
+
+_curves = {
+    'linear': lambda x: x,
+    'sqrt': np.sqrt,
+    'square': np.square,
+    'log': lambda x: np.log1p(x * (np.e - 1)),
+}
+
+
+def _lutvalues(indtype, imin, imax):
+    '''Input values corresponding to LUT entries.'''
+
+    if indtype is None:
+        # generic data types: entries for [imin, imax] only
+        imin = int(np.floor(imin))
+        imax = int(np.ceil(imax))
+        return np.arange(imin, max(imax, imin) + 1, dtype='float64')
+
+    indtype = np.dtype(indtype)
+    nbits = 8 * indtype.itemsize
+    values = np.arange(2 ** nbits, dtype='uint%d' % nbits)
+    if indtype.kind == 'i':
+        # signed samples are indexed by their bit pattern
+        values = values.view(indtype)
+
+    return values.astype('float64')
+
+
+def cached_lut(indtype, imin, imax, omin=0, omax=255, dtype='uint8',
+               curve='linear'):
+    '''Return a LUT mapping [imin, imax] onto [omin, omax].
+
+    For 8 and 16 bit integer *indtype* the LUT has one entry for each
+    possible input value and it is indexed by the (unsigned) bit
+    pattern of samples.
+    If *indtype* is None the LUT is indexed by (value - floor(imin))
+    and covers the [imin, imax] input range.
+
+    LUTs are computed only once and stored in a LRU cache.
+
+    '''
+
+    dtype = np.dtype(dtype)
+    if indtype is not None:
+        indtype = np.dtype(indtype)
+        if indtype not in LUT_DIRECT_TYPES:
+            raise ValueError('invalid input dtype "%s"' % indtype)
+
+    key = (indtype and indtype.str, imin, imax, omin, omax, dtype.str, curve)
+    with _lutcache_lock:
+        lut = _lutcache.get(key)
+        if lut is not None:
+            _lutcache_keys.remove(key)
+            _lutcache_keys.append(key)
+            return lut
+
+    values = _lutvalues(indtype, imin, imax)
+    if imax == imin:
+        lut = np.where(values < imin, omin, omax)
+    else:
+        x = ((values - imin) / float(imax - imin)).clip(0, 1)
+        curvefunc = _curves.get(curve, curve)
+        lut = np.round(omin + (omax - omin) * curvefunc(x))
+    lut = lut.clip(omin, omax).astype(dtype)
+
+    # @NOTE: cached LUTs are shared
+    lut.flags.writeable = False
+    with _lutcache_lock:
+        if key not in _lutcache:
+            _lutcache_keys.append(key)
+        _lutcache[key] = lut
+        while len(_lutcache_keys) > LUT_CACHE_SIZE:
+            del _lutcache[_lutcache_keys.pop(0)]
+
+    return lut
+
+
+### Fused stretching kernels #################################################
+#: number of pixels processed at once by chunked stretching kernels
+STRETCH_CHUNK_SIZE = 64 * 1024
+
+#: minimum number of chunks for multi-threaded execution
+STRETCH_MIN_THREADED_CHUNKS = 16
+
+_threadpool = None
+_threadpool_lock = threading.Lock()
+_scratch = threading.local()
+
+
+def _getthreadpool():
+    global _threadpool
+
+    with _threadpool_lock:
+        if _threadpool is None:
+            _threadpool = ThreadPool(multiprocessing.cpu_count())
+    return _threadpool
+
+
+def _scratchbuffer(shape, dtype):
+    '''Return a per-thread scratch buffer with the given shape and type.'''
+
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    buf = getattr(_scratch, dtype.str, None)
+    if buf is None or buf.size < size:
+        buf = np.empty(max(size, STRETCH_CHUNK_SIZE), dtype)
+        setattr(_scratch, dtype.str, buf)
+    return buf[:size].reshape(shape)
+
+
+def _rowblocks(shape, chunksize=STRETCH_CHUNK_SIZE):
+    rowsize = int(np.prod(shape[1:]))
+    nrows = max(1, chunksize // max(rowsize, 1))
+    return [slice(start, start + nrows) for start in range(0, shape[0], nrows)]
+
+
+def linear_stretch(data, out, offset=0, scale=1., vmin=None, vmax=None,
+                   nthreads=None, chunksize=STRETCH_CHUNK_SIZE):
+    '''Compute out = clip(scale * (data - offset), vmin, vmax).
+
+    Offset, scale, clipping and the final type conversion are
+    performed in a single pass: data are processed in blocks of rows
+    of about *chunksize* pixels using a small scratch buffer that fits
+    the CPU cache, so input data are read once and the *out* array is
+    written once with no full size temporary.
+
+    Blocks are processed in parallel by a pool of threads if
+    *nthreads* is greater than 1 (numpy releases the GIL while
+    computing).
+    If *nthreads* is None multiple threads are used only for large
+    arrays.
+
+    '''
+
+    data = np.asarray(data)
+    result = out
+    if data.ndim == 0:
+        data = data.reshape(1)
+        out = out.reshape(1)
+
+    ctype = np.result_type(data.dtype, np.float32)
+
+    def kernel(rows):
+        block = data[rows]
+        tmp = _scratchbuffer(block.shape, ctype)
+        if offset:
+            np.subtract(block, offset, out=tmp)
+            if scale != 1.0:
+                np.multiply(tmp, scale, out=tmp)
+        elif scale != 1.0:
+            np.multiply(block, scale, out=tmp)
+        else:
+            tmp[...] = block
+        if vmin is not None and vmax is not None:
+            np.clip(tmp, vmin, vmax, out=tmp)
+        out[rows] = tmp
+
+    blocks = _rowblocks(data.shape, chunksize)
+    if nthreads is None:
+        if len(blocks) >= STRETCH_MIN_THREADED_CHUNKS:
+            nthreads = multiprocessing.cpu_count()
+        else:
+            nthreads = 1
+
+    if nthreads > 1 and len(blocks) > 1:
+        _getthreadpool().map(kernel, blocks)
+    else:
+        for rows in blocks:
+            kernel(rows)
+
+    return result
+
+
 ### Stretching utils #########################################################
 class BaseStretcher(object):
     '''Base class for stretcher objects.
@@ -235,6 +561,10 @@ class BaseStretcher(object):
         stretch = BaseStretch(0, 255, 'uint8')
         data = stretch(data)
 
+    All stretchers accept an optional *out* argument: if provided the
+    result is written into it (it must have the same shape of data)
+    and the *out* array is returned.
+
     '''
 
     stretchtype = 'clip'
@@ -251,10 +581,13 @@ class BaseStretcher(object):
         #: data type for output data
         self.dtype = dtype
 
-    def __call__(self, data):
+    def __call__(self, data, out=None):
         data = np.asarray(data)
         if self.min is not None and self.max is not None:
             data = data.clip(self.min, self.max, out=data)
+        if out is not None:
+            out[...] = data
+            return out
         if self.dtype is not None and data.dtype != np.dtype(self.dtype):
             data = data.astype(self.dtype)
         return data
@@ -270,6 +603,9 @@ class LinearStretcher(BaseStretcher):
 
         .. math:: output = scale \cdot (data - offset)
 
+    If an output data type is set the computation is performed by the
+    :func:`linear_stretch` fused kernel.
+
     '''
 
     stretchtype = 'linear'
@@ -279,13 +615,22 @@ class LinearStretcher(BaseStretcher):
         self.scale = scale
         self.offset = offset
 
-    def __call__(self, data):
+        #: number of threads used for stretching (None for automatic)
+        self.nthreads = None
+
+    def __call__(self, data, out=None):
         data = np.asarray(data)
-        if self.offset:
-            data = data - self.offset
-        if self.scale != 1.0:
-            data = self.scale * data
-        return super(LinearStretcher, self).__call__(data)
+        if out is None:
+            if self.dtype is None:
+                if self.offset:
+                    data = data - self.offset
+                if self.scale != 1.0:
+                    data = self.scale * data
+                return super(LinearStretcher, self).__call__(data)
+            out = np.empty(data.shape, self.dtype)
+
+        return linear_stretch(data, out, self.offset, self.scale,
+                              self.min, self.max, self.nthreads)
 
     # @TODO: if the API is compatible use
     #           range = property(get_range, set_range)
@@ -316,10 +661,19 @@ class LinearStretcher(BaseStretcher):
 class LUTStretcher(BaseStretcher):
     '''Stretch using LUT.
 
-    Perform an arbitrary scaling on unsigned data using a look-up table
+    Perform an arbitrary scaling on integer data using a look-up table
     (LUT).
 
-    An optional offset is applied before LUT application.
+    8 and 16 bit data (both signed and unsigned) are mapped using a
+    LUT with one entry for each possible input value that is indexed
+    directly by samples: signed 16 bit samples are used via their bit
+    pattern (unsigned view) so no offset has to be applied.
+    Other data types are clipped to the input range and an offset is
+    applied before LUT application.
+
+    LUTs are shared via a module level LRU cache indexed by input data
+    type, input range, output range, output type and curve so
+    switching between recently used stretches is instant.
 
     '''
 
@@ -329,43 +683,65 @@ class LUTStretcher(BaseStretcher):
         if np.dtype(dtype) not in (np.uint8, np.uint16):
             raise ValueError('only "uint8" and "uint16" are allowed.')
         super(LUTStretcher, self).__init__(vmin, vmax, dtype)
+
+        #: number of LUT entries (only used by the :attr:`lut` property)
         self.fill = fill
+
+        #: lower bound of the input range
         self.offset = offset
-        self.lut = linear_lut(offset, vmax, 'uint8', fill, vmin, vmax)
 
-    def __call__(self, data):
+        #: transfer function: 'linear', 'sqrt', 'square', 'log' or a
+        #: callable mapping [0, 1] onto [0, 1] (e.g. an equalization
+        #: curve computed by :meth:`Histogram.equalization`)
+        self.curve = 'linear'
+
+        self._imax = vmax
+
+    def getlut(self, indtype):
+        '''Return the (cached) LUT for the specified input data type.'''
+
+        return cached_lut(indtype, self.offset, self._imax, self.min,
+                          self.max, self.dtype, self.curve)
+
+    @property
+    def lut(self):
+        '''LUT for 8 or 16 bit unsigned input data (depending on fill).'''
+
+        if self.fill is not True and self.fill > 256:
+            return self.getlut(np.uint16)
+        else:
+            return self.getlut(np.uint8)
+
+    def __call__(self, data, out=None):
         data = np.asarray(data)
-        if self.offset:
-            data = data - self.offset
-        if data.dtype != self.dtype:
-            data = data.clip(0, len(self.lut) - 1, out=data)
-            data = data.astype('uint32')
-        return self.lut[data]
+
+        if data.dtype in LUT_DIRECT_TYPES:
+            lut = self.getlut(data.dtype)
+            if data.dtype == np.int16:
+                data = data.view(np.uint16)
+            elif data.dtype == np.int8:
+                data = data.view(np.uint8)
+            return np.take(lut, data, out=out, mode='clip')
+
+        imin = int(np.floor(self.offset))
+        lut = self.getlut(None)
+        data = data.clip(imin, imin + len(lut) - 1)
+        if imin:
+            data -= imin
+        return np.take(lut, data.astype(np.intp), out=out, mode='clip')
 
     @property
     def range(self):
-        indices = np.where(self.lut != self.lut[-1])[0]
-        imax = self.offset + len(indices)
-        return self.offset, imax
+        return self.offset, self._imax
 
     def set_range(self, imin, imax, fill=None):
+        if fill is not None:
+            self.fill = fill
         if (imin, imax) == self.range:
             return
-        if imin == imax:
-            self.lut[...] = imin
-            return self.lut
 
-        omax = self.max
-        omin = self.min
-        #assert omin != omax
         self.offset = imin
-        if imin < 0:
-            imin = 0
-            imax -= self.offset
-        if fill is None:
-            fill = self.fill
-
-        self.lut = linear_lut(imin, imax, self.dtype, fill, omin, omax)
+        self._imax = imax
 
         return self.lut
 
@@ -408,7 +784,7 @@ class LogarithmicStretcher(BaseStretcher):
         assert base in self.logfunctions
         self.base = base
 
-    def __call__(self, data):
+    def __call__(self, data, out=None):
         data = np.asarray(data)
         if self.offset:
             data = data - self.offset
@@ -424,4 +800,4 @@ class LogarithmicStretcher(BaseStretcher):
 
         if self.scale != 1.0:
             data = self.scale * data
-        return super(LogarithmicStretcher, self).__call__(data)
+        return super(LogarithmicStretcher, self).__call__(data, out)
@@ -25,6 +25,8 @@
 import os
 import csv
 import logging
+import weakref
+import threading
 from cStringIO import StringIO
 from ConfigParser import ConfigParser
 
@@ -471,23 +473,139 @@ import numpy as np
 GRAY_COLORTABLE = [QtGui.QColor(i, i, i).rgb() for i in range(256)]
 
 
+class BufferPool(object):
+    '''Pool of reusable numpy buffers with 32-bit aligned scanlines.
+
+    Arrays returned by :meth:`acquire` are views of raw memory buffers
+    whose rows are padded to a multiple of *align* bytes so that they
+    can be wrapped by QImage objects with no copy.
+    Buffers handed back to the pool via :meth:`release` are re-used by
+    following requests of the same size avoiding allocations in
+    steady state.
+
+    .. note:: all methods are protected by a lock so the pool can be
+              safely shared between threads.
+
+    '''
+
+    def __init__(self, maxbuffers=64, align=4):
+        #: maximum number of free buffers kept for each buffer size
+        self.maxbuffers = maxbuffers
+
+        #: alignment (in bytes) of rows
+        self.align = align
+
+        self._free = {}
+        self._owned = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def acquire(self, shape, dtype):
+        '''Return a (possibly re-used) array with the given shape and type.
+
+        The content of the array is undefined.
+
+        '''
+
+        dtype = np.dtype(dtype)
+        shape = tuple(int(n) for n in shape)
+
+        strides = [dtype.itemsize]
+        for n in reversed(shape[2:]):
+            strides.insert(0, strides[0] * n)
+        rowbytes = strides[0] * shape[1]
+        stride = (rowbytes + self.align - 1) // self.align * self.align
+        strides.insert(0, stride)
+
+        nbytes = max(stride * shape[0], 1)
+        with self._lock:
+            free = self._free.get(nbytes)
+            if free:
+                buf = free.pop()
+            else:
+                buf = np.empty(nbytes, np.uint8)
+                self._owned[id(buf)] = buf
+
+        return np.ndarray(shape, dtype, buffer=buf, strides=strides)
+
+    def release(self, data):
+        '''Give back to the pool the memory buffer of *data*.
+
+        Arrays not allocated by the pool are silently ignored.
+
+        .. warning:: *data* (and any other view of the same buffer)
+                     must not be used after release.
+
+        '''
+
+        buf = _rootbuffer(data)
+        with self._lock:
+            if self._owned.get(id(buf)) is not buf:
+                return
+            free = self._free.setdefault(buf.nbytes, [])
+            if len(free) < self.maxbuffers and \
+                                    not any(item is buf for item in free):
+                free.append(buf)
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
+
+
+#: buffer pool shared by image conversion functions
+bufferpool = BufferPool()
+
+
+def _rootbuffer(data):
+    while isinstance(data.base, np.ndarray):
+        data = data.base
+    return data
+
+
+def _imagebuffer(data):
+    '''Return (buffer, bytesPerLine) for wrapping *data* in a QImage.
+
+    None is returned if data memory layout is not compatible with
+    QImage (rows must be contiguous and 32-bit aligned).
+
+    '''
+
+    itemsize = data.itemsize
+    inner = itemsize
+    for n, stride in reversed(list(zip(data.shape[1:], data.strides[1:]))):
+        if stride != inner:
+            return None
+        inner *= n
+
+    bytesPerLine = data.strides[0]
+    if bytesPerLine < inner or bytesPerLine % 4:
+        return None
+
+    root = _rootbuffer(data)
+    if not root.flags.c_contiguous:
+        return None
+    if data.ctypes.data != root.ctypes.data:
+        return None
+    if root.nbytes < bytesPerLine * (data.shape[0] - 1) + inner:
+        return None
+
+    return root.data, bytesPerLine
+
+
 def _aligned(data, nbyes=4):
-    h, w = data.shape
-
-    fact = nbyes / data.itemsize
-    shape = (h, np.ceil(w / float(fact)) * nbyes)
-    if shape != data.shape:
-        # build aligned matrix
-        image = np.zeros(shape, data.dtype)
-        image[:, 0:w] = data[:, 0:w]
-    else:
-        image = np.require(data, data.dtype, 'CO')  # 'CAO'
+    '''Return a copy of data with rows aligned to *nbytes* bytes.'''
+
+    image = BufferPool(0, nbyes).acquire(data.shape, data.dtype)
+    image[...] = data
     return image
 
 
 def numpy2qimage(data):
     '''Convert a numpy array into a QImage.
 
+    No copy is performed if rows of *data* are contiguous and aligned to
+    32-bit boundaries (e.g. arrays returned by
+    :meth:`BufferPool.acquire`) so the QImage shares memory with *data*.
+
     .. note:: requires sip >= 4.7.5.
 
     '''
@@ -497,20 +615,20 @@ def numpy2qimage(data):
     if data.dtype in (np.uint8, np.ubyte, np.byte):
         if data.ndim == 2:
             h, w = data.shape
-            image = _aligned(data)
+            image = data
             format_ = QtGui.QImage.Format_Indexed8
             colortable = GRAY_COLORTABLE
 
         elif data.ndim == 3 and data.shape[2] == 3:
             h, w = data.shape[:2]
-            image = np.zeros((h, w, 4), data.dtype)
+            image = bufferpool.acquire((h, w, 4), data.dtype)
             image[:, :, 2::-1] = data
             image[..., -1] = 255
             format_ = QtGui.QImage.Format_RGB32
 
         elif data.ndim == 3 and data.shape[2] == 4:
             h, w = data.shape[:2]
-            image = np.require(data, np.uint8, 'CO')  # 'CAO'
+            image = data
             format_ = QtGui.QImage.Format_ARGB32
 
         else:
@@ -521,12 +639,12 @@ def numpy2qimage(data):
     elif data.dtype == np.uint16 and data.ndim == 2:
         # @TODO: check
         h, w = data.shape
-        image = _aligned(data)
+        image = data
         format_ = QtGui.QImage.Format_RGB16
 
     elif data.dtype == np.uint32 and data.ndim == 2:
         h, w = data.shape
-        image = np.require(data, data.dtype, 'CO')  # 'CAO'
+        image = data
         #format_ = QtGui.QImage.Format_ARGB32
         format_ = QtGui.QImage.Format_RGB32
 
@@ -534,7 +652,13 @@ def numpy2qimage(data):
         raise ValueError('unable to convert data: shape=%s, dtype="%s"' % (
                                         data.shape, np.dtype(data.dtype)))
 
-    result = QtGui.QImage(image.data, w, h, format_)
+    imagebuffer = _imagebuffer(image)
+    if imagebuffer is None:
+        image = _aligned(image)
+        imagebuffer = _imagebuffer(image)
+    buf, bytesPerLine = imagebuffer
+
+    result = QtGui.QImage(buf, w, h, bytesPerLine, format_)
     result.ndarray = image
     if colortable:
         result.setColorTable(colortable)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+### Copyright (C) 2008-2012 Antonio Valentino <a_valentino@users.sf.net>
+
+### This file is part of GSDView.
+
+### GSDView is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; either version 2 of the License, or
+### (at your option) any later version.
+
+### GSDView is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+
+### You should have received a copy of the GNU General Public License
+### along with GSDView; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA.
+
+'''Benchmark for linear stretching.
+
+Compare the legacy multi-pass implementation of linear stretching
+(offset, scale, clip and cast performed by separate numpy operations)
+with the fused :func:`gsdview.imgutils.linear_stretch` kernel.
+
+For each data type the script reports the time per megapixel and the
+memory traffic per megapixel.  Memory traffic is estimated counting
+bytes read and written by each full size pass over data (the scratch
+buffer of the fused kernel is assumed to stay in the CPU cache).
+
+'''
+
+import os
+import sys
+import time
+import optparse
+
+# Fix sys path
+from os.path import abspath, dirname
+GSDVIEWROOT = abspath(os.path.join(dirname(__file__), os.pardir, os.pardir))
+sys.path.insert(0, GSDVIEWROOT)
+
+
+import numpy as np
+from gsdview.imgutils import linear_stretch
+
+
+MB = 1024. ** 2
+
+
+def multipass_stretch(data, offset, scale, vmin, vmax, dtype='uint8'):
+    data = data - offset
+    data = scale * data
+    data = data.clip(vmin, vmax, out=data)
+    return data.astype(dtype)
+
+
+def multipass_traffic(itemsize, tmpsize=8, outsize=1):
+    # (data - offset): read input, write tmp
+    traffic = itemsize + tmpsize
+    # scale * data: read tmp, write tmp
+    traffic += 2 * tmpsize
+    # clip: read tmp, write tmp
+    traffic += 2 * tmpsize
+    # astype: read tmp, write output
+    traffic += tmpsize + outsize
+    return traffic
+
+
+def fused_traffic(itemsize, outsize=1):
+    # read input, write output
+    return itemsize + outsize
+
+
+def timeit(func, repeat):
+    best = None
+    for i in range(repeat):
+        t0 = time.time()
+        func()
+        elapsed = time.time() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-s', '--size', type='int', default=4096,
+                      help='side of the (square) test image '
+                           '(default: %default)')
+    parser.add_option('-r', '--repeat', type='int', default=5,
+                      help='number of repetitions (default: %default)')
+    parser.add_option('-j', '--threads', type='int', default=None,
+                      help='number of threads for the fused kernel '
+                           '(default: automatic)')
+    options, args = parser.parse_args()
+
+    size = options.size
+    mpixels = size * size / 1e6
+    offset, scale, vmin, vmax = 100., 0.1, 0, 255
+    out = np.empty((size, size), np.uint8)
+
+    print('image size: %dx%d (%.1f Mpixel)' % (size, size, mpixels))
+    print('%-8s  %-10s  %12s  %16s' % ('dtype', 'method', 'ms/Mpixel',
+                                       'traffic MB/Mpixel'))
+
+    for dtype in ('uint8', 'int16', 'uint16', 'float32', 'float64'):
+        data = (np.random.rand(size, size) * 4000).astype(dtype)
+        itemsize = data.itemsize
+        tmpsize = (data[:1, :1] - offset).itemsize
+
+        elapsed = timeit(lambda: multipass_stretch(data, offset, scale,
+                                                   vmin, vmax),
+                         options.repeat)
+        traffic = multipass_traffic(itemsize, tmpsize) * 1e6 / MB
+        print('%-8s  %-10s  %12.2f  %16.2f' % (dtype, 'multipass',
+                                               elapsed * 1e3 / mpixels,
+                                               traffic))
+
+        elapsed = timeit(lambda: linear_stretch(data, out, offset, scale,
+                                                vmin, vmax,
+                                                options.threads),
+                         options.repeat)
+        traffic = fused_traffic(itemsize) * 1e6 / MB
+        print('%-8s  %-10s  %12.2f  %16.2f' % (dtype, 'fused',
+                                               elapsed * 1e3 / mpixels,
+                                               traffic))
+
+
+if __name__ == '__main__':
+    main()
@@ -120,9 +120,59 @@ class TestLinearLUT(unittest.TestCase):
         self.assertEqual(len(lut), len(expected_lut))
         self.assertTrue(np.all(lut == expected_lut))
 
-#~ class TestHistogramEqualizedLUT(unittest.TestCase):
-    #~ def test_(self):
-        #~ pass
+class TestHistogramEqualizedLUT(unittest.TestCase):
+    def test_flat(self):
+        lut = histogram_equalized_lut(np.ones(256))
+        self.assertEqual(lut.dtype, np.uint8)
+        self.assertEqual(len(lut), 256)
+        self.assertEqual(lut[0], 0)
+        self.assertEqual(lut[-1], 255)
+        self.assertTrue(np.all(np.diff(lut.astype('int')) >= 0))
+
+    def test_fill(self):
+        lut = histogram_equalized_lut(np.ones(100), fill=True)
+        self.assertEqual(len(lut), 256)
+        self.assertTrue(np.all(lut[99:] == 255))
+
+    def test_empty_hist(self):
+        lut = histogram_equalized_lut(np.zeros(10))
+        self.assertTrue(np.all(lut == 0))
+
+
+class TestHistogram(unittest.TestCase):
+    def test_integer_bins(self):
+        hist = Histogram.fromdata(np.arange(1000, dtype='uint16'))
+        self.assertEqual(len(hist.hist), 1000)
+        self.assertEqual(hist.total, 1000)
+
+    def test_percentile_range(self):
+        hist = Histogram.fromdata(np.arange(1000, dtype='uint16'))
+        lower, upper = hist.percentile_range(10, 90)
+        self.assertAlmostEqual(lower, 99.5)
+        self.assertAlmostEqual(upper, 899.5)
+
+    def test_sigma_range(self):
+        data = np.random.normal(100., 10., 100000)
+        hist = Histogram.fromdata(data)
+        self.assertAlmostEqual(hist.mean(), data.mean(), 1)
+        self.assertAlmostEqual(hist.std(), data.std(), 1)
+        lower, upper = hist.sigma_range(2)
+        self.assertAlmostEqual(lower, data.mean() - 2 * data.std(), 0)
+        self.assertAlmostEqual(upper, data.mean() + 2 * data.std(), 0)
+
+    def test_invalid_values(self):
+        data = np.array([np.nan, np.inf, -9999., 1., 2., 3.])
+        hist = Histogram.fromdata(data, nodata=-9999)
+        self.assertEqual(hist.total, 3)
+        self.assertEqual(Histogram.fromdata(np.array([np.nan])), None)
+
+    def test_equalization(self):
+        hist = Histogram.fromdata(np.arange(1000, dtype='uint16'))
+        curve = hist.equalization()
+        self.assertTrue(curve is hist.equalization())
+        x = np.linspace(0, 1, 11)
+        self.assertTrue(np.allclose(curve(x), x))
+
 
 
 if __name__ == '__main__':
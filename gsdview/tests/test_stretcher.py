@@ -142,5 +142,41 @@ class TestLUTStretcher(unittest.TestCase):
         self.assertTrue(np.all(outdata[10:-10] == np.arange(20)))
         self.assertTrue(np.all(outdata[-10:] == 20))
 
+    def test_uint16(self):
+        stretch = LUTStretcher()
+        stretch.set_range(1000, 1255)
+        indata = np.arange(0, 2 ** 16, 5, dtype='uint16')
+        refout = LUTStretcher()
+        refout.set_range(1000, 1255)
+        refout = refout(indata.astype('int64'))
+        outdata = stretch(indata)
+        self.assertEqual(outdata.dtype, np.uint8)
+        self.assertTrue(np.all(outdata == refout))
+
+    def test_int16(self):
+        stretch = LUTStretcher(vmax=20)
+        stretch.set_range(-10, 10)
+        outdata = stretch(np.arange(-20, 20, dtype='int16'))
+        self.assertTrue(np.all(outdata[:10] == 0))
+        self.assertTrue(np.all(outdata[10:-10] == np.arange(20)))
+        self.assertTrue(np.all(outdata[-10:] == 20))
+
+    def test_out(self):
+        stretch = LUTStretcher()
+        indata = np.arange(-300, 300, dtype='int16').reshape(20, 30)
+        out = np.empty(indata.shape, 'uint8')
+        outdata = stretch(indata, out=out)
+        self.assertTrue(outdata is out)
+        self.assertTrue(np.all(out == indata.clip(0, 255)))
+
+    def test_cached_lut(self):
+        stretch = LUTStretcher()
+        stretch.set_range(-100, 100)
+        lut1 = stretch.getlut(np.int16)
+        stretch.set_range(0, 50)
+        stretch.set_range(-100, 100)
+        self.assertTrue(stretch.getlut(np.int16) is lut1)
+        self.assertEqual(len(lut1), 2 ** 16)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+### Copyright (C) 2008-2012 Antonio Valentino <a_valentino@users.sf.net>
+
+### This file is part of GSDView.
+
+### GSDView is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; either version 2 of the License, or
+### (at your option) any later version.
+
+### GSDView is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+
+### You should have received a copy of the GNU General Public License
+### along with GSDView; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA.
+
+import os
+import sys
+import unittest
+
+# Fix sys path
+from os.path import abspath, dirname
+GSDVIEWROOT = abspath(os.path.join(dirname(__file__), os.pardir, os.pardir))
+sys.path.insert(0, GSDVIEWROOT)
+
+
+from gsdview.utils import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(3)
+        for key in 'abcd':
+            cache.put(key, key)
+        self.assertEqual(cache.keys(), ['b', 'c', 'd'])
+
+    def test_get_updates_order(self):
+        cache = LRUCache(3)
+        for key in 'abc':
+            cache.put(key, key)
+        self.assertEqual(cache.get('a'), 'a')
+        cache.put('d', 'd')
+        self.assertEqual(cache.keys(), ['c', 'a', 'd'])
+
+    def test_sizefunc(self):
+        evicted = []
+        cache = LRUCache(10, sizefunc=len,
+                         callback=lambda key, value: evicted.append(key))
+        cache.put(1, 'x' * 6)
+        cache.put(2, 'x' * 6)
+        self.assertEqual(cache.keys(), [2])
+        self.assertEqual(cache.size, 6)
+        self.assertEqual(evicted, [1])
+
+    def test_maxsize(self):
+        cache = LRUCache(10)
+        for key in range(10):
+            cache.put(key, key)
+        cache.maxsize = 2
+        self.assertEqual(cache.keys(), [8, 9])
+
+    def test_discard(self):
+        cache = LRUCache(10)
+        for key in range(10):
+            cache.put(key, key)
+        cache.discard(lambda key: key % 2)
+        self.assertEqual(cache.keys(), [0, 2, 4, 6, 8])
+        self.assertEqual(cache.size, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
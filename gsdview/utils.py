@@ -26,9 +26,15 @@ import os
 import sys
 import stat
 import platform
+import threading
 import traceback
 import email.utils
 
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
+
 try:
     import pkg_resources
 except ImportError:
@@ -44,7 +50,8 @@ __date__ = '$Date$'
 __revision__ = '$Revision$'
 
 __all__ = ['which', 'isexecutable', 'isscript', 'scriptcmd', 'default_workdir',
-           'getresource', 'format_platform_info', 'foramt_bugreport']
+           'getresource', 'format_platform_info', 'foramt_bugreport',
+           'LRUCache']
 
 
 def default_workdir():
@@ -243,6 +250,178 @@ def scriptcmd(scriptname):
     return cmd
 
 
+### Caching tools #############################################################
+if OrderedDict is None:
+    # @COMPATIBILITY: collections.OrderedDict is new in Python 2.7
+    class OrderedDict(dict):
+        '''Minimal dictionary that remembers the insertion order.
+
+        Only the subset of the Python 2.7 OrderedDict interface used in
+        this module is provided.
+
+        '''
+
+        def __init__(self):
+            super(OrderedDict, self).__init__()
+            # doubly linked list of [prev, next, key] links
+            self._root = root = []
+            root[:] = [root, root, None]
+            self._links = {}
+
+        def __setitem__(self, key, value):
+            if key not in self:
+                root = self._root
+                last = root[0]
+                last[1] = root[0] = self._links[key] = [last, root, key]
+            dict.__setitem__(self, key, value)
+
+        def __delitem__(self, key):
+            dict.__delitem__(self, key)
+            prev, next_, key = self._links.pop(key)
+            prev[1] = next_
+            next_[0] = prev
+
+        def __iter__(self):
+            root = self._root
+            link = root[1]
+            while link is not root:
+                yield link[2]
+                link = link[1]
+
+        def keys(self):
+            return list(self)
+
+        def pop(self, key, *default):
+            if key in self:
+                value = dict.__getitem__(self, key)
+                del self[key]
+                return value
+            elif default:
+                return default[0]
+            raise KeyError(key)
+
+        def popitem(self, last=True):
+            if not self:
+                raise KeyError('dictionary is empty')
+            key = self._root[0][2] if last else self._root[1][2]
+            return key, self.pop(key)
+
+        def clear(self):
+            dict.clear(self)
+            self._links.clear()
+            root = self._root
+            root[:] = [root, root, None]
+
+
+class LRUCache(object):
+    '''Size bounded cache with least recently used eviction policy.
+
+    The size of each entry is computed by the *sizefunc* callable
+    (by default each entry counts 1) and the least recently used
+    entries are discarded as soon as the total size exceeds *maxsize*.
+
+    If provided, the *callback* callable is called with the (key, value)
+    pair of each entry that is evicted or explicitly removed.
+
+    .. note:: all methods are protected by a lock so the cache can be
+              safely shared between threads.
+
+    '''
+
+    def __init__(self, maxsize=128, sizefunc=None, callback=None):
+        super(LRUCache, self).__init__()
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._size = 0
+        self._maxsize = maxsize
+        self._sizefunc = sizefunc
+        self._callback = callback
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    @property
+    def size(self):
+        '''Total size of cached entries.'''
+
+        return self._size
+
+    def _get_maxsize(self):
+        return self._maxsize
+
+    def _set_maxsize(self, maxsize):
+        with self._lock:
+            self._maxsize = maxsize
+            self._shrink()
+
+    maxsize = property(_get_maxsize, _set_maxsize,
+                       doc='Maximum total size of cached entries.')
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            # move to the most recently used position
+            self._data[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self.pop(key)
+
+            if self._sizefunc is not None:
+                size = self._sizefunc(value)
+            else:
+                size = 1
+
+            self._data[key] = value
+            self._sizes[key] = size
+            self._size += size
+            self._shrink()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+
+            value = self._data.pop(key)
+            self._size -= self._sizes.pop(key)
+            if self._callback is not None:
+                self._callback(key, value)
+
+            return value
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def discard(self, predicate):
+        '''Remove all entries for which predicate(key) is True.'''
+
+        with self._lock:
+            for key in self.keys():
+                if predicate(key):
+                    self.pop(key)
+
+    def clear(self):
+        with self._lock:
+            for key in self.keys():
+                self.pop(key)
+
+    def _shrink(self):
+        # @NOTE: the most recent entry is always preserved
+        while self._size > self._maxsize and len(self._data) > 1:
+            key = next(iter(self._data))
+            self.pop(key)
+
+
 ### Geographic tools ##########################################################
 # @TODO: support vectors
 def geonormalize(x, angle_range=360.):